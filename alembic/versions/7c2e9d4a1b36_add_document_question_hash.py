@@ -0,0 +1,71 @@
+"""add document question_hash
+
+Revision ID: 7c2e9d4a1b36
+Revises: 405d63e0a5db
+Create Date: 2026-10-18 09:12:40.218734
+
+"""
+import hashlib
+import unicodedata
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e9d4a1b36'
+down_revision: Union[str, None] = '405d63e0a5db'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Số document tính hash mỗi lần
+BATCH_SIZE = 5000
+
+
+def question_hash(question: str) -> str:
+    """
+    Bản sao cố định của app.utils.helpers.question_hash tại thời điểm tạo migration
+    (NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối, sha256): migration không phụ thuộc code ứng dụng về sau.
+    """
+    text = " ".join(unicodedata.normalize("NFC", question).lower().split()).rstrip(" ?.!…")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('question_hash', sa.String(length=64), nullable=True))
+
+    # Tính hash cho các document đã có (chuẩn hoá Unicode bằng Python, không làm được bằng SQL)
+    conn = op.get_bind()
+    documents = sa.table(
+        'documents',
+        sa.column('id', sa.Integer),
+        sa.column('question', sa.Text),
+        sa.column('question_hash', sa.String),
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(documents.c.id, documents.c.question)
+            .where(documents.c.id > last_id)
+            .order_by(documents.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            documents.update()
+            .where(documents.c.id == sa.bindparam('doc_id'))
+            .values(question_hash=sa.bindparam('hash')),
+            [{'doc_id': row.id, 'hash': question_hash(row.question)} for row in rows],
+        )
+        last_id = rows[-1].id
+
+    op.create_index(op.f('ix_documents_question_hash'), 'documents', ['question_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_documents_question_hash'), table_name='documents')
+    op.drop_column('documents', 'question_hash')
@@ -0,0 +1,39 @@
+"""add pagination indexes
+
+Revision ID: b5d81f3e6a20
+Revises: 7c2e9d4a1b36
+Create Date: 2026-10-18 10:05:17.530112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d81f3e6a20'
+down_revision: Union[str, None] = '7c2e9d4a1b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY không chạy được trong transaction và không khoá ghi bảng trong lúc tạo
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_unknown_questions_timestamp_id', 'unknown_questions', ['timestamp', 'id'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_chat_history_user_id_timestamp', 'chat_history', ['user_id', 'timestamp'],
+            unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chat_history_user_id_timestamp', table_name='chat_history', postgresql_concurrently=True)
+        op.drop_index('ix_unknown_questions_timestamp_id', table_name='unknown_questions', postgresql_concurrently=True)
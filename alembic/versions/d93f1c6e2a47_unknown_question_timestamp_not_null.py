@@ -0,0 +1,39 @@
+"""unknown question timestamp not null
+
+Revision ID: d93f1c6e2a47
+Revises: e41a7c5b9d02
+Create Date: 2026-10-18 15:42:08.314270
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd93f1c6e2a47'
+down_revision: Union[str, None] = 'e41a7c5b9d02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Thời gian gán cho các câu hỏi không có timestamp (xếp sau mọi câu hỏi có thời gian thật)
+MISSING_TIMESTAMP = datetime(1970, 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Phân trang keyset theo (timestamp, id) không so sánh được với NULL
+    unknown_questions = sa.table('unknown_questions', sa.column('timestamp', sa.DateTime))
+    op.execute(
+        unknown_questions.update()
+        .where(unknown_questions.c.timestamp.is_(None))
+        .values(timestamp=MISSING_TIMESTAMP)
+    )
+    op.alter_column('unknown_questions', 'timestamp', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('unknown_questions', 'timestamp', existing_type=sa.DateTime(), nullable=True)
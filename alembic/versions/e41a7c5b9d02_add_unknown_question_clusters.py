@@ -0,0 +1,50 @@
+"""add unknown question clusters
+
+Revision ID: e41a7c5b9d02
+Revises: b5d81f3e6a20
+Create Date: 2026-10-18 11:20:43.861205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41a7c5b9d02'
+down_revision: Union[str, None] = 'b5d81f3e6a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('unknown_question_clusters',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('representative', sa.Text(), nullable=False),
+    sa.Column('representative_distance', sa.Float(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('first_seen', sa.DateTime(), nullable=True),
+    sa.Column('last_seen', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_unknown_question_clusters_id'), 'unknown_question_clusters', ['id'], unique=False)
+    op.create_index(op.f('ix_unknown_question_clusters_count'), 'unknown_question_clusters', ['count'], unique=False)
+    op.add_column('unknown_questions', sa.Column('cluster_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_unknown_questions_cluster_id'), 'unknown_questions', ['cluster_id'], unique=False)
+    op.create_foreign_key(
+        'fk_unknown_questions_cluster_id', 'unknown_questions', 'unknown_question_clusters',
+        ['cluster_id'], ['id'], ondelete='SET NULL'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_unknown_questions_cluster_id', 'unknown_questions', type_='foreignkey')
+    op.drop_index(op.f('ix_unknown_questions_cluster_id'), table_name='unknown_questions')
+    op.drop_column('unknown_questions', 'cluster_id')
+    op.drop_index(op.f('ix_unknown_question_clusters_count'), table_name='unknown_question_clusters')
+    op.drop_index(op.f('ix_unknown_question_clusters_id'), table_name='unknown_question_clusters')
+    op.drop_table('unknown_question_clusters')
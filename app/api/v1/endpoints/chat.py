@@ -1,27 +1,54 @@
 # app/api/v1/endpoints/chat.py
-from fastapi import APIRouter, Depends
+import json
+import weakref
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.schemas.chat import ChatRequest, ChatResponse
-from app.services.chat_service import get_answer_from_documents_v1, get_answer_from_documents_v2, get_answer_from_documents_v3
+from app.services.chat_service import get_answer_from_documents_v1, get_answer_from_documents_v2, get_answer_from_documents_v3, get_chat_stats, stream_answer
 from app.services.user_service import get_or_create_user
+from app.services.model_service import model_manager
+from app.services.executor_service import ExecutorSaturated, inference_executor
 from app.db.session import get_db
 
 router = APIRouter(prefix="/chat", tags=["Trò chuyện với chatbot"])
 
+def require_models(*names):
+    """Từ chối request nếu worker này không được cấu hình phục vụ các mô hình cần thiết (WORKER_MODELS)."""
+    missing = [name for name in names if not model_manager.is_enabled(name)]
+    if missing:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Worker này không phục vụ mô hình: {', '.join(missing)}"
+        )
+
+async def run_inference(route: str, fn, *args):
+    """Chạy tác vụ chat trên executor suy luận, trả 429/503 kèm Retry-After khi quá tải."""
+    try:
+        return await inference_executor.run(route, fn, *args)
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
 @router.post("/v1", response_model=ChatResponse, summary="Chat với chatbot v1 (trả lời tiếng Việt)")
-def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
     """
     Nhận message (tiếng Việt) từ user, trả về câu trả lời.
     Kết quả được truy xuất từ dữ liệu huấn luyện (FAISS + Document).
     Tốc độ nhanh, câu trả lời có thể sẽ thô
     Lưu ý: không cần GPU, chỉ cần CPU.
     """
+    require_models("embed")
     user_id = request.user_id
-    answer = get_answer_from_documents_v1(user_id, request.message, db)
+    answer = await run_inference("v1", get_answer_from_documents_v1, user_id, request.message, db)
     return {"answer": answer}
 
 @router.post("/v2", response_model=ChatResponse, summary="Chat với chatbot v2 (trả lời tiếng Việt)")
-def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
     """
     Nhận message (tiếng Việt) từ user, trả về câu trả lời.
     Kết quả được truy xuất từ dữ liệu huấn luyện (FAISS + Document). 
@@ -29,18 +56,85 @@ def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
     Tốc độ có thể chậm hơn một chút so với chat_v1.
     Lưu ý: Có thể sử dụng GPU để tăng tốc độ.
     """
+    require_models("embed", "generator")
     user_id = request.user_id
-    answer = get_answer_from_documents_v2(user_id, request.message, db)
+    answer = await run_inference("v2", get_answer_from_documents_v2, user_id, request.message, db)
     return {"answer": answer}
 
 @router.post("/v3", response_model=ChatResponse, summary="Chat với chatbot v3 (trả lời tiếng Việt)")
-def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
     """
     Nhận message (tiếng Việt) từ user, trả về câu trả lời.
     Kết quả được truy xuất thẳng từ dữ liệu đã fine-tune để có câu trả lời tự nhiên.
     Tốc độ có thể chậm hơn một chút so với chat_v1.
     Lưu ý: Có thể sử dụng GPU để tăng tốc độ.
     """
+    require_models("generator")
     user_id = request.user_id
-    answer = get_answer_from_documents_v3(user_id, request.message, db)
+    answer = await run_inference("v3", get_answer_from_documents_v3, user_id, request.message, db)
     return {"answer": answer}
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_response(route: str, request: ChatRequest, db: Session):
+    """
+    Trả lời dạng Server-Sent Events. Chiếm một chỗ của executor suy luận trong suốt quá trình stream
+    (429/503 kèm Retry-After khi quá tải, giống các route thường).
+    """
+    try:
+        release = inference_executor.reserve(route)
+    except ExecutorSaturated as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    def events():
+        try:
+            for event, data in stream_answer(route, request.user_id, request.message, db):
+                yield _sse(event, {"text": data} if event == "token" else data)
+        finally:
+            release()
+
+    stream = events()
+    # Generator chưa chạy lần nào (client ngắt kết nối trước chunk đầu tiên) không chạy finally:
+    # trả chỗ khi generator bị thu hồi (release chỉ có tác dụng một lần)
+    weakref.finalize(stream, release)
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/v2/stream", summary="Chat với chatbot v2, trả lời dạng streaming (SSE)")
+async def chat_stream_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+    """
+    Giống /chat/v2 nhưng gửi từng đoạn câu trả lời ngay khi được sinh (Server-Sent Events):
+    - event `token`: {"text": đoạn câu trả lời}
+    - event `done`: {"answer": câu trả lời đầy đủ, "ttft_ms": thời gian tới token đầu tiên, "total_ms": tổng thời gian}
+    - event `error`: thông báo lỗi
+    Khi streaming, câu trả lời được sinh bằng giải mã greedy/sampling (GEN_STREAM_PROFILE).
+    """
+    require_models("embed", "generator")
+    return stream_response("v2", request, db)
+
+@router.post("/v3/stream", summary="Chat với chatbot v3, trả lời dạng streaming (SSE)")
+async def chat_stream_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+    """
+    Giống /chat/v3 nhưng gửi từng đoạn câu trả lời ngay khi được sinh (Server-Sent Events),
+    định dạng sự kiện như /chat/v2/stream.
+    """
+    require_models("generator")
+    return stream_response("v3", request, db)
+
+@router.get("/stats", summary="Thống kê hàng đợi, batch và cache của chatbot")
+def chat_stats():
+    """
+    Trả về độ sâu hàng đợi và kích thước batch của bộ mã hoá câu hỏi (v1/v2)
+    và bộ sinh câu trả lời ViT5 (v2/v3), số lần hit/miss của cache câu trả lời
+    và TTFT/tổng thời gian của các lượt trả lời streaming.
+    """
+    return {**get_chat_stats(), "executor": inference_executor.stats()}
@@ -1,42 +1,90 @@
 # app/api/v1/endpoints/fine_tune.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import pandas as pd
+import os
 
 from app.schemas.fine_tune_data import FineTuneDataOut
-from app.services.fine_tune_data_service import create_documents_from_excel, delete_document, get_all_documents
-from app.services.chat_service import rebuild_fine_tune
+from app.services.chat_service import FINE_TUNE_MODES
+from app.services.fine_tune_data_service import ingest_documents, delete_document, get_all_documents
+from app.services.model_registry_service import get_serving_stats, list_versions, maybe_reload, promote_version, rollback_version
+from app.services.ingest_service import UPLOAD_FORMATS, UnreadableFile, progress_logger, remove_spooled, spool_upload, upload_format
+from app.models.fine_tune_data import FineTuneData
 from app.db.session import SessionLocal, get_db
+from app.api.v1.endpoints.jobs import start_job
 
 router = APIRouter(prefix="/fine_tune", tags=["Quản lý tài liệu fine-tune"])
 
-@router.post("/upload", summary="Upload file Excel để thêm dữ liệu huấn luyện câu trả lời theo ngữ cảnh")
+@router.post("/upload", summary="Upload file (Excel, CSV, JSONL) để thêm dữ liệu huấn luyện câu trả lời theo ngữ cảnh")
 async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    if not file.filename.endswith(('.xls', '.xlsx')):
-        raise HTTPException(status_code=400, detail="Vui lòng upload file Excel (.xlsx).")
+    """
+    Import FineTuneData từ file: cột đầu là câu trả lời, cột thứ hai là câu trả lời mong muốn
+    (JSONL: [answer, target] hoặc {"answer": ..., "target": ...}). Các dòng lỗi bị bỏ qua và liệt kê trong kết quả.
+    """
+    fmt = upload_format(file.filename)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Vui lòng upload file {', '.join(UPLOAD_FORMATS)}.")
 
+    path = await run_in_threadpool(spool_upload, file.file, os.path.splitext(file.filename)[1])
     try:
-        contents = await file.read()
-
-        import io
-        import pandas as pd
-        df = pd.read_excel(io.BytesIO(contents), header=None)
-    except Exception as e:
+        report = await run_in_threadpool(ingest_documents, path, fmt, db, progress_logger(f"upload {file.filename}"))
+    except UnreadableFile as e:
         print(f"Lỗi đọc file: {str(e)}")
-        raise HTTPException(status_code=400, detail="Không thể đọc file Excel.")
-
-    docs = create_documents_from_excel(df, db)
-    return {"message": f"Đã thêm {len(docs)} bản ghi từ file Excel."}
+        raise HTTPException(status_code=400, detail="Không thể đọc file.")
+    except Exception as e:
+        # Lỗi ghi DB (đã rollback): lỗi phía server, không phải do file
+        print(f"Lỗi ghi dữ liệu từ file: {str(e)}")
+        raise HTTPException(status_code=500, detail="Lỗi ghi dữ liệu, vui lòng thử lại sau.")
+    finally:
+        remove_spooled(path)
+    return {"message": f"Đã thêm {report.inserted} bản ghi từ file.", **report.to_dict()}
 
-@router.post("/start", summary="Fine-tune từ dữ liệu đã upload")
-def start_training(db: Session = Depends(get_db)):
+@router.post("/start", status_code=202, summary="Fine-tune từ dữ liệu đã upload (tác vụ nền)")
+def start_training(
+    db: Session = Depends(get_db),
+    mode: str = Query("full", description="full: toàn bộ dữ liệu; incremental: chỉ dữ liệu mới (kèm một phần dữ liệu cũ) từ checkpoint gần nhất"),
+    lora: bool = Query(False, description="Chỉ huấn luyện adapter LoRA (nhanh hơn, cần peft)"),
+    promote: bool = Query(True, description="Đưa phiên bản mới vào phục vụ ngay khi huấn luyện xong")
+):
     """
-    Fine-tune dựa trên tất cả Document trong DB.
+    Fine-tune dựa trên FineTuneData trong DB, kết quả là một phiên bản mới trong kho phiên bản (/fine_tune/models).
+    Chạy trong tiến trình nền, trả về ngay job_id; theo dõi tiến độ (bước, loss) tại /jobs/{job_id}.
     """
-    success = rebuild_fine_tune(db)
-    if not success:
+    if mode not in FINE_TUNE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode phải là một trong: {', '.join(FINE_TUNE_MODES)}.")
+    if db.query(FineTuneData.id).first() is None:
         raise HTTPException(status_code=400, detail="Không có dữ liệu để fine-tune.")
-    return {"message": "Đã fine-tune cho các câu trả lời.", "documents": len(get_all_documents(db))}
+    return start_job("fine_tune", "Đã bắt đầu fine-tune.", {"mode": mode, "lora": lora, "promote": promote})
+
+@router.get("/models", summary="Danh sách phiên bản mô hình fine-tune")
+def model_versions():
+    """
+    Các phiên bản mô hình còn lưu (số phiên bản cũ được giữ theo MODEL_KEEP_VERSIONS): số dòng dữ liệu, loss,
+    thời điểm tạo, phiên bản đang phục vụ; kèm phiên bản worker này đang dùng.
+    """
+    return {"versions": list_versions(), "worker": get_serving_stats()}
+
+@router.post("/models/promote", summary="Đưa một phiên bản mô hình vào phục vụ")
+def model_promote(version_id: str = Query(..., description="Phiên bản cần kích hoạt")):
+    """
+    Các worker nạp phiên bản mới ở luồng nền (trong vòng MODEL_RELOAD_CHECK_SECONDS) rồi mới chuyển sang,
+    chat không bị gián đoạn.
+    """
+    try:
+        version_id = promote_version(version_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    maybe_reload(force=True)
+    return {"message": f"Đã chuyển mô hình sang phiên bản {version_id}.", "version_id": version_id}
+
+@router.post("/models/rollback", summary="Quay lại phiên bản mô hình trước đó")
+def model_rollback(version_id: str = Query(None, description="Phiên bản cần kích hoạt (mặc định: phiên bản liền trước)")):
+    try:
+        version_id = rollback_version(version_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    maybe_reload(force=True)
+    return {"message": f"Đã chuyển mô hình về phiên bản {version_id}.", "version_id": version_id}
 
 @router.get("/documents", response_model=list[FineTuneDataOut], summary="Danh sách tài liệu huấn luyện")
 def list_documents(db: Session = Depends(get_db)):
@@ -0,0 +1,51 @@
+# app/api/v1/endpoints/jobs.py
+from fastapi import APIRouter, HTTPException, Query
+
+from app.services.job_service import JOB_KINDS, JobConflict, cancel_job, get_job, list_jobs, submit_job
+
+router = APIRouter(prefix="/jobs", tags=["Tác vụ nền"])
+
+def start_job(kind: str, message: str, options: dict = None):
+    """Tạo tác vụ nền và trả về ngay id tác vụ (409 nếu đã có tác vụ cùng loại đang chạy)."""
+    try:
+        job = submit_job(kind, options)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "job_id": e.job["id"]})
+    return {"message": message, "job_id": job["id"], "status": job["status"]}
+
+@router.get("", summary="Danh sách tác vụ nền")
+def jobs_list(
+    kind: str = Query(None, description=f"Loại tác vụ ({', '.join(JOB_KINDS)})"),
+    limit: int = Query(default=50, ge=1, le=500),
+):
+    return {"items": list_jobs(kind, limit)}
+
+@router.get("/{job_id}", summary="Trạng thái và tiến độ tác vụ")
+def job_status(job_id: str):
+    """
+    Trạng thái (queued, running, succeeded, failed, cancelled) và tiến độ:
+    số câu đã mã hoá (index) hoặc bước huấn luyện, epoch, loss (fine_tune).
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tác vụ không tồn tại.")
+    return job
+
+@router.get("/{job_id}/result", summary="Kết quả tác vụ")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tác vụ không tồn tại.")
+    if job["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="Tác vụ chưa hoàn thành.")
+    return {"job_id": job["id"], "status": job["status"], "result": job["result"], "error": job["error"]}
+
+@router.post("/{job_id}/cancel", summary="Huỷ tác vụ")
+def job_cancel(job_id: str, force: bool = Query(False, description="Dừng ngay tiến trình tác vụ (SIGTERM)")):
+    """
+    Yêu cầu huỷ tác vụ; tác vụ dừng sau batch mã hoá hoặc bước huấn luyện hiện tại.
+    """
+    job = cancel_job(job_id, force)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tác vụ không tồn tại.")
+    return {"job_id": job["id"], "status": job["status"], "cancel_requested": job["status"] in ("queued", "running")}
@@ -1,17 +1,24 @@
 # app/api/v1/endpoints/train.py
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Header
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-import pandas as pd
-from fastapi.responses import FileResponse
-from io import BytesIO
-from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import os
+from typing import Optional
 
 from app.schemas.document import DocumentOut
 from app.models.document import Document
 from app.schemas.common import PaginationResponse
-from app.services.document_service import create_documents_from_excel, delete_document, get_all_documents
-from app.services.chat_service import rebuild_faiss_index
+from app.services.document_service import ingest_documents, delete_document, get_all_documents
+from app.services.dedup_service import DEDUP_POLICIES
+from app.services.export_service import EXPORT_FORMATS, export_filename, export_stream
+from app.services.ingest_service import UPLOAD_FORMATS, UnreadableFile, progress_logger, remove_spooled, spool_upload, upload_format
+from app.services.index_service import add_documents_to_index, remove_documents_from_index, reset_faiss_index, list_index_versions, rollback_index
 from app.db.session import SessionLocal, get_db
+from app.utils.pagination import count_cache, decode_cursor, encode_cursor, page_info
+from app.services.job_service import JobConflict, submit_job
+from app.api.v1.endpoints.jobs import start_job
 
 router = APIRouter(prefix="/train", tags=["Quản lý tài liệu huấn luyện"])
 
@@ -19,141 +26,190 @@ router = APIRouter(prefix="/train", tags=["Quản lý tài liệu huấn luyện
 class DocumentResponse(PaginationResponse):
     items: list[DocumentOut]
 
-@router.post("/upload", summary="Upload file Excel để thêm dữ liệu huấn luyện")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    if not file.filename.endswith(('.xls', '.xlsx')):
-        raise HTTPException(status_code=400, detail="Vui lòng upload file Excel (.xlsx).")
+# Cột của file export: (khoá JSONL, tiêu đề cột, độ rộng cột Excel)
+DOCUMENT_EXPORT_COLUMNS = [("id", "ID", 10), ("question", "Câu hỏi", 60), ("answer", "Câu trả lời", 100)]
 
-    try:
-        contents = await file.read()
+@router.post("/upload", summary="Upload file (Excel, CSV, JSONL) để thêm dữ liệu huấn luyện")
+async def upload_file(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    dedup: str = Query(None, description=f"Xử lý câu hỏi trùng: {', '.join(DEDUP_POLICIES)} (mặc định INGEST_DEDUP_POLICY)"),
+):
+    """
+    Import Document từ file: cột đầu là câu hỏi, cột thứ hai là câu trả lời (JSONL: [question, answer]
+    hoặc {"question": ..., "answer": ...}). File được lưu tạm ra đĩa rồi đọc và ghi theo từng khối;
+    các dòng lỗi bị bỏ qua và liệt kê trong kết quả.
+    Câu hỏi trùng với tài liệu đã có hoặc với dòng trước đó (cùng câu hỏi sau chuẩn hoá; gần trùng theo
+    embedding nếu bật INGEST_NEAR_DUP_DISTANCE): skip bỏ qua, merge thay câu trả lời của tài liệu đã có,
+    report vẫn thêm; cả ba đều liệt kê trong duplicate_rows.
+    Upload nhỏ (tối đa INGEST_INCREMENTAL_INDEX_LIMIT dòng) được cập nhật index ngay,
+    upload lớn hơn sẽ tạo lại toàn bộ index bằng tác vụ nền.
+    """
+    fmt = upload_format(file.filename)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Vui lòng upload file {', '.join(UPLOAD_FORMATS)}.")
+    if dedup is not None and dedup not in DEDUP_POLICIES:
+        raise HTTPException(status_code=400, detail=f"dedup phải là một trong: {', '.join(DEDUP_POLICIES)}.")
 
-        import io
-        import pandas as pd
-        df = pd.read_excel(io.BytesIO(contents), header=None)
-    except Exception as e:
+    path = await run_in_threadpool(spool_upload, file.file, os.path.splitext(file.filename)[1])
+    try:
+        report, docs = await run_in_threadpool(
+            ingest_documents, path, fmt, db, dedup, progress_logger(f"upload {file.filename}")
+        )
+    except UnreadableFile as e:
         print(f"Lỗi đọc file: {str(e)}")
-        raise HTTPException(status_code=400, detail="Không thể đọc file Excel.")
+        raise HTTPException(status_code=400, detail="Không thể đọc file.")
+    except Exception as e:
+        # Lỗi ghi DB (đã rollback): lỗi phía server, không phải do file
+        print(f"Lỗi ghi dữ liệu từ file: {str(e)}")
+        raise HTTPException(status_code=500, detail="Lỗi ghi dữ liệu, vui lòng thử lại sau.")
+    finally:
+        remove_spooled(path)
 
-    docs = create_documents_from_excel(df, db)
-    return {"message": f"Đã thêm {len(docs)} bản ghi từ file Excel."}
+    result = {"message": f"Đã thêm {report.inserted} bản ghi từ file.", **report.to_dict()}
+    if not report.inserted and not report.merged:
+        return result
+    if docs is not None:
+        # Cập nhật index ngay cho các document mới (không cần gọi lại /train/start)
+        try:
+            result["indexed"] = await run_in_threadpool(add_documents_to_index, docs, db)
+        except Exception as e:
+            print(f"Lỗi cập nhật FAISS index: {str(e)}")
+            result["indexed"] = 0
+        return result
+    # Upload lớn: mã hoá lại toàn bộ trong tiến trình nền thay vì giữ request
+    try:
+        result["index_job_id"] = submit_job("index")["id"]
+    except JobConflict as e:
+        print(f"Không tạo được tác vụ index: {str(e)}")
+        result["index_job_id"] = None
+        result["message"] += " Đang có tác vụ index chạy, cần gọi lại /train/start sau khi tác vụ kết thúc."
+    return result
 
-@router.post("/start", summary="Xây dựng FAISS index từ dữ liệu đã upload")
+@router.post("/start", status_code=202, summary="Xây dựng lại toàn bộ FAISS index từ dữ liệu đã upload (tác vụ nền)")
 def start_training(db: Session = Depends(get_db)):
     """
-    Tạo chỉ mục FAISS dựa trên tất cả Document trong DB.
+    Tạo lại chỉ mục FAISS dựa trên tất cả Document trong DB (chỉ mã hoá các câu hỏi chưa có trong cache embedding).
+    Chạy trong tiến trình nền, trả về ngay job_id; theo dõi tại /jobs/{job_id}.
+    Lưu ý: upload và xoá đã tự cập nhật index, chỉ cần gọi khi muốn rebuild toàn bộ.
     """
-    success = rebuild_faiss_index(db)
-    if not success:
+    if db.query(Document.id).first() is None:
         raise HTTPException(status_code=400, detail="Không có dữ liệu để tạo index.")
-    return {"message": "Đã tạo FAISS index cho các câu hỏi.", "documents": len(get_all_documents(db))}
+    return start_job("index", "Đã bắt đầu tạo FAISS index.")
+
+@router.get("/index/versions", summary="Danh sách phiên bản FAISS index")
+def index_versions():
+    """
+    Các phiên bản FAISS index còn lưu (số phiên bản cũ được giữ theo FAISS_KEEP_VERSIONS).
+    """
+    return {"versions": list_index_versions()}
+
+@router.post("/index/rollback", summary="Quay lại phiên bản FAISS index trước đó")
+def index_rollback(version_id: str = Query(None, description="Phiên bản cần kích hoạt (mặc định: phiên bản liền trước)")):
+    """
+    Chuyển ngay index đang phục vụ về một phiên bản đã lưu, không cần build lại.
+    Document thêm/sửa sau phiên bản đó chỉ có lại trong index sau lần /train/start tiếp theo.
+    """
+    try:
+        version_id = rollback_index(version_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"message": f"Đã chuyển FAISS index về phiên bản {version_id}.", "version_id": version_id}
 
 @router.get("/documents", response_model=DocumentResponse, summary="Danh sách tài liệu huấn luyện (có phân trang)")
 def list_documents(
     db: Session = Depends(get_db),
-    page: int = Query(default=1, ge=1, description="Số trang"),
-    page_size: int = Query(default=100, ge=1, le=100, description="Số item trên mỗi trang")
+    page: int = Query(default=1, ge=1, description="Số trang (chỉ dùng khi không có cursor, nên dùng cursor)"),
+    page_size: int = Query(default=100, ge=1, le=100, description="Số item trên mỗi trang"),
+    cursor: Optional[str] = Query(None, description="Con trỏ trang tiếp theo (next_cursor của trang trước)"),
+    include_total: Optional[bool] = Query(None, description="Trả về tổng số bản ghi (mặc định: chỉ ở trang đầu)")
 ):
     """
-    Trả về danh sách các tài liệu (câu hỏi và hướng dẫn) đang có, có phân trang.
+    Trả về danh sách các tài liệu (câu hỏi và hướng dẫn) đang có, sắp theo id, có phân trang.
     
     Parameters:
-    - page: Số trang (bắt đầu từ 1)
+    - cursor: Lấy trang tiếp theo bằng next_cursor của trang trước (keyset, mọi trang nhanh như trang đầu)
+    - page: Số trang (bắt đầu từ 1), dùng OFFSET nên chậm dần ở các trang sâu
     - page_size: Số lượng item trên mỗi trang (1-100)
+    - include_total: Đếm tổng số bản ghi (được cache PAGINATION_COUNT_TTL_SECONDS giây)
     """
-    # Calculate offset
-    offset = (page - 1) * page_size
-    
-    # Get total count
-    total_records = db.query(Document).count()
-    
-    # Get paginated documents
-    docs = (db.query(Document)
-            .order_by(Document.id)
-            .offset(offset)
-            .limit(page_size)
-            .all())
-    
-    # Calculate total pages
-    total_pages = (total_records + page_size - 1) // page_size
-    
+    query = db.query(Document).order_by(Document.id)
+    if cursor:
+        try:
+            last = decode_cursor(cursor)
+            query = query.filter(Document.id > int(last["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="cursor không hợp lệ.")
+    elif page > 1:
+        query = query.offset((page - 1) * page_size)
+
+    # Lấy thêm một bản ghi để biết còn trang sau hay không
+    docs = query.limit(page_size + 1).all()
+    next_cursor = encode_cursor({"id": docs[page_size - 1].id}) if len(docs) > page_size else None
+
+    if include_total is None:
+        include_total = cursor is None and page == 1
+    total_records = (
+        count_cache.get("documents", lambda: db.query(func.count(Document.id)).scalar())
+        if include_total else None
+    )
+
     return {
-        "items": docs,
-        "pagination": {
-            "page": page,
-            "page_size": page_size,
-            "total_records": total_records,
-            "total_pages": total_pages
-        }
+        "items": docs[:page_size],
+        "pagination": page_info(page_size, next_cursor, total_records, page=None if cursor else page)
     }
 
-@router.get("/export-excel", summary="Xuất toàn bộ tài liệu huấn luyện ra Excel")
+@router.get("/export-excel", summary="Xuất toàn bộ tài liệu huấn luyện ra Excel, CSV hoặc JSONL")
 def export_documents_to_excel(
     db: Session = Depends(get_db),
+    format: str = Query("xlsx", description=f"Định dạng file ({', '.join(EXPORT_FORMATS)})"),
 ):
     """
-    Export toàn bộ danh sách tài liệu huấn luyện ra file Excel.
+    Export toàn bộ danh sách tài liệu huấn luyện. Dữ liệu được đọc theo từng lô và gửi dần
+    (streaming), bộ nhớ không tăng theo số tài liệu.
     """
-    try:
-        # Lấy toàn bộ documents
-        documents = db.query(Document).order_by(Document.id).all()
-        
-        if not documents:
-            raise HTTPException(
-                status_code=404,
-                detail="Không có dữ liệu để export"
-            )
-
-        # Chuyển đổi thành DataFrame
-        data = [{
-            "ID": doc.id,
-            "Câu hỏi": doc.question,
-            "Câu trả lời": doc.answer
-        } for doc in documents]
-        
-        df = pd.DataFrame(data)
-        
-        # Tạo buffer cho file Excel
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Tài liệu huấn luyện')
-            
-            # Tự động điều chỉnh độ rộng cột
-            worksheet = writer.sheets['Tài liệu huấn luyện']
-            for idx, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).apply(len).max(),
-                    len(col)
-                )
-                # Add a little extra width to the column
-                worksheet.column_dimensions[chr(65 + idx)].width = max_length + 2
-
-        buffer.seek(0)
-        
-        # Tạo tên file với timestamp
-        filename = f"training_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return FileResponse(
-            buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=filename
-        )
-
-    except Exception as e:
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format phải là một trong: {', '.join(EXPORT_FORMATS)}.")
+    if db.query(Document.id).first() is None:
         raise HTTPException(
-            status_code=500,
-            detail=f"Lỗi khi export dữ liệu: {str(e)}"
+            status_code=404,
+            detail="Không có dữ liệu để export"
         )
 
+    content = export_stream(
+        lambda session: session.query(Document.id, Document.question, Document.answer).order_by(Document.id),
+        DOCUMENT_EXPORT_COLUMNS,
+        format,
+        sheet_name="Tài liệu huấn luyện",
+    )
+    filename = export_filename("training_documents", format)
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.delete("/{document_id}", summary="Xóa tài liệu huấn luyện theo ID")
 def delete_document_endpoint(document_id: int, db: Session = Depends(get_db)):
     """
-    Xoá tài liệu huấn luyện (Document) theo ID.
-    Lưu ý: Sau khi xóa, có thể cần gọi lại /train/start để xây dựng lại index FAISS.
+    Xoá tài liệu huấn luyện (Document) theo ID, đồng thời xoá khỏi index FAISS.
+    Index được cập nhật trước khi xoá trong DB: nếu cập nhật index lỗi, document vẫn còn nguyên (có thể xoá lại).
     """
-    success = delete_document(document_id, db)
-    if not success:
+    doc = db.query(Document).get(document_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="Document không tồn tại.")
-    # Có thể rebuild FAISS index ở đây hoặc yêu cầu client gọi lại /train/start.
+    row = (doc.id, doc.question, doc.answer)
+    remove_documents_from_index([document_id])
+    try:
+        delete_document(document_id, db)
+    except Exception:
+        db.rollback()
+        # Không xoá được trong DB: đưa document trở lại index
+        try:
+            add_documents_to_index([row], db)
+        except Exception as e:
+            print(f"Lỗi khôi phục document {document_id} vào FAISS index: {str(e)}")
+        raise
     return {"message": f"Đã xoá document với id = {document_id}."}
 
 @router.delete("/clear-all", summary="Xóa toàn bộ tài liệu huấn luyện")
@@ -187,6 +243,7 @@ def delete_all_documents(
         # Xóa toàn bộ records
         count = db.query(Document).delete()
         db.commit()
+        reset_faiss_index()
         
         return {
             "status": "success",
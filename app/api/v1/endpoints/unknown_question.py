@@ -1,20 +1,26 @@
 from fastapi import APIRouter, Depends, Query, HTTPException, Header
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.models.unknown_question import UnknownQuestion
 from typing import List, Optional
 from datetime import datetime, date
-from sqlalchemy import desc
+from sqlalchemy import desc, func, tuple_
 from pydantic import BaseModel
-import pandas as pd
-from io import BytesIO
 
-from app.schemas.unknown_question import UnknownQuestionOut, UnknownQuestionResponse
+from app.schemas.unknown_question import UnknownQuestionOut, UnknownQuestionResponse, UnknownQuestionClusterResponse
 from app.models.document import Document
+from app.models.unknown_question_cluster import UnknownQuestionCluster
+from app.api.v1.endpoints.jobs import start_job
+from app.services.export_service import EXPORT_FORMATS, export_filename, export_stream
+from app.services.unknown_cluster_service import clear_clusters
+from app.utils.pagination import count_cache, decode_cursor, encode_cursor, page_info
 
 router = APIRouter(prefix="/unknown_question", tags=["Các câu hỏi khác nằm ngoài phạm vi huấn luyện"])
 
+# Cột của file export: (khoá JSONL, tiêu đề cột, độ rộng cột Excel)
+UNKNOWN_QUESTION_EXPORT_COLUMNS = [("id", "ID", 10), ("question", "Câu hỏi", 80), ("timestamp", "Thời gian", 20)]
+
 def parse_date(date_str: Optional[str]) -> Optional[date]:
     """Định dạng thời gian MM-DD-YYYY hoặc MM/DD/YYYY"""
     if not date_str:
@@ -36,17 +42,21 @@ def parse_date(date_str: Optional[str]) -> Optional[date]:
 @router.get("/questions", response_model=UnknownQuestionResponse, summary="Lấy danh sách câu hỏi chưa có câu trả lời")
 def get_unanswered_questions(
     db: Session = Depends(get_db),
-    page: int = Query(default=1, ge=1, description="Số trang"),
+    page: int = Query(default=1, ge=1, description="Số trang (chỉ dùng khi không có cursor, nên dùng cursor)"),
     page_size: int = Query(default=100, ge=1, le=100, description="Số item trên mỗi trang"),
     start_date: Optional[str] = Query(None, description="Ngày bắt đầu (MM-DD-YYYY hoặc MM/DD/YYYY)"),
-    end_date: Optional[str] = Query(None, description="Ngày kết thúc (MM-DD-YYYY hoặc MM/DD/YYYY)")
+    end_date: Optional[str] = Query(None, description="Ngày kết thúc (MM-DD-YYYY hoặc MM/DD/YYYY)"),
+    cursor: Optional[str] = Query(None, description="Con trỏ trang tiếp theo (next_cursor của trang trước)"),
+    include_total: Optional[bool] = Query(None, description="Trả về tổng số bản ghi (mặc định: chỉ ở trang đầu)")
 ):
     """
-    Lấy danh sách câu hỏi chưa có câu trả lời với phân trang và lọc theo ngày
-    - **page**: Số trang (bắt đầu từ 1)
+    Lấy danh sách câu hỏi chưa có câu trả lời (mới nhất trước) với phân trang và lọc theo ngày
+    - **cursor**: Lấy trang tiếp theo bằng next_cursor của trang trước (keyset theo thời gian, id; mọi trang nhanh như trang đầu)
+    - **page**: Số trang (bắt đầu từ 1), dùng OFFSET nên chậm dần ở các trang sâu
     - **page_size**: Số câu hỏi trên mỗi trang
     - **start_date**: Lọc từ ngày (MM-DD-YYYY hoặc MM/DD/YYYY)
     - **end_date**: Lọc đến ngày (MM-DD-YYYY hoặc MM/DD/YYYY)
+    - **include_total**: Đếm tổng số câu hỏi theo bộ lọc (được cache PAGINATION_COUNT_TTL_SECONDS giây)
     """
     query = db.query(UnknownQuestion)
     
@@ -58,86 +68,131 @@ def get_unanswered_questions(
         query = query.filter(UnknownQuestion.timestamp >= datetime.combine(parsed_start_date, datetime.min.time()))
     if parsed_end_date:
         query = query.filter(UnknownQuestion.timestamp <= datetime.combine(parsed_end_date, datetime.max.time()))
-    
-    # Tính tổng số records để phân trang
-    total_records = query.count()
-    
-    # Áp dụng phân trang và sắp xếp
-    questions = (query
-                .order_by(desc(UnknownQuestion.timestamp))
-                .offset((page - 1) * page_size)
-                .limit(page_size)
-                .all())
-    
-    # Tính toán thông tin phân trang
-    total_pages = (total_records + page_size - 1) // page_size
+
+    # Tổng số theo bộ lọc (không tính con trỏ), chỉ đếm khi cần và được cache
+    if include_total is None:
+        include_total = cursor is None and page == 1
+    total_records = (
+        count_cache.get(
+            ("unknown_questions", parsed_start_date, parsed_end_date),
+            lambda: query.with_entities(func.count(UnknownQuestion.id)).scalar()
+        )
+        if include_total else None
+    )
+
+    # Sắp xếp theo (timestamp, id) giảm dần, dùng index ix_unknown_questions_timestamp_id
+    query = query.order_by(desc(UnknownQuestion.timestamp), desc(UnknownQuestion.id))
+    if cursor:
+        try:
+            last = decode_cursor(cursor, datetime_keys=("timestamp",))
+            query = query.filter(
+                tuple_(UnknownQuestion.timestamp, UnknownQuestion.id) < tuple_(last["timestamp"], int(last["id"]))
+            )
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="cursor không hợp lệ.")
+    elif page > 1:
+        query = query.offset((page - 1) * page_size)
+
+    # Lấy thêm một bản ghi để biết còn trang sau hay không
+    questions = query.limit(page_size + 1).all()
+    next_cursor = None
+    if len(questions) > page_size:
+        last = questions[page_size - 1]
+        next_cursor = encode_cursor({"timestamp": last.timestamp, "id": last.id})
     
     return {
-        "items": questions,
-        "pagination": {
-            "page": page,
-            "page_size": page_size,
-            "total_records": total_records,
-            "total_pages": total_pages
-        }
+        "items": questions[:page_size],
+        "pagination": page_info(page_size, next_cursor, total_records, page=None if cursor else page)
     }
 
-@router.get("/export-excel", summary="Xuất toàn bộ câu hỏi chưa trả lời ra Excel")
+@router.get("/export-excel", summary="Xuất toàn bộ câu hỏi chưa trả lời ra Excel, CSV hoặc JSONL")
 def export_to_excel(
     db: Session = Depends(get_db),
+    format: str = Query("xlsx", description=f"Định dạng file ({', '.join(EXPORT_FORMATS)})"),
 ):
     """
-    Export toàn bộ danh sách câu hỏi ra file Excel.
+    Export toàn bộ danh sách câu hỏi (mới nhất trước). Dữ liệu được đọc theo từng lô và gửi dần
+    (streaming), bộ nhớ không tăng theo số câu hỏi.
     """
-    try:
-        # Lấy toàn bộ dữ liệu và sắp xếp theo thời gian mới nhất
-        questions = db.query(UnknownQuestion).order_by(desc(UnknownQuestion.timestamp)).all()
-        
-        if not questions:
-            raise HTTPException(
-                status_code=404,
-                detail="Không có dữ liệu để export"
-            )
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format phải là một trong: {', '.join(EXPORT_FORMATS)}.")
+    if db.query(UnknownQuestion.id).first() is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Không có dữ liệu để export"
+        )
 
-        # Chuyển đổi dữ liệu sang DataFrame
-        data = [{
-            "ID": q.id,
-            "Câu hỏi": q.question,
-            "Thời gian": q.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        } for q in questions]
-        
-        df = pd.DataFrame(data)
-        
-        # Tạo và định dạng file Excel
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Câu hỏi chưa trả lời')
-            
-            # Tự động điều chỉnh độ rộng cột
-            worksheet = writer.sheets['Câu hỏi chưa trả lời']
-            for idx, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).apply(len).max(),
-                    len(col)
-                )
-                worksheet.column_dimensions[chr(65 + idx)].width = max_length + 2
+    content = export_stream(
+        lambda session: (session.query(UnknownQuestion.id, UnknownQuestion.question, UnknownQuestion.timestamp)
+                         .order_by(desc(UnknownQuestion.timestamp))),
+        UNKNOWN_QUESTION_EXPORT_COLUMNS,
+        format,
+        sheet_name="Câu hỏi chưa trả lời",
+    )
+    filename = export_filename("unknown_questions", format)
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
-        buffer.seek(0)
-        
-        # Tạo tên file với timestamp
-        filename = f"unknown_questions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return FileResponse(
-            buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=filename
-        )
+@router.get("/clusters", response_model=UnknownQuestionClusterResponse, summary="Các nhóm câu hỏi chưa trả lời (phổ biến nhất trước)")
+def get_clusters(
+    db: Session = Depends(get_db),
+    page: int = Query(default=1, ge=1, description="Số trang"),
+    page_size: int = Query(default=50, ge=1, le=200, description="Số nhóm trên mỗi trang"),
+    min_count: int = Query(default=1, ge=1, description="Chỉ lấy nhóm có ít nhất min_count câu hỏi"),
+    order_by: str = Query(default="count", description="Sắp xếp theo count (số câu hỏi) hoặc last_seen (mới nhất)")
+):
+    """
+    Các nhóm câu hỏi tương tự nhau: số câu hỏi, câu hỏi đại diện (gần tâm nhóm nhất), thời điểm đầu tiên/gần nhất.
+    Kết quả được tính sẵn bởi tác vụ phân cụm (POST /unknown_question/clusters/rebuild), không tính lại mỗi request.
+    """
+    if order_by not in ("count", "last_seen"):
+        raise HTTPException(status_code=400, detail="order_by phải là count hoặc last_seen.")
+    query = db.query(UnknownQuestionCluster).filter(UnknownQuestionCluster.count >= min_count)
+    total_records = count_cache.get(
+        ("unknown_question_clusters", min_count),
+        lambda: query.with_entities(func.count(UnknownQuestionCluster.id)).scalar()
+    )
+    order = desc(UnknownQuestionCluster.count) if order_by == "count" else desc(UnknownQuestionCluster.last_seen)
+    clusters = (query
+                .order_by(order, UnknownQuestionCluster.id)
+                .offset((page - 1) * page_size)
+                .limit(page_size)
+                .all())
+    unclustered = count_cache.get(
+        "unknown_questions_unclustered",
+        lambda: db.query(func.count(UnknownQuestion.id)).filter(UnknownQuestion.cluster_id.is_(None)).scalar()
+    )
+    return {
+        "items": clusters,
+        "unclustered": unclustered,
+        "pagination": page_info(page_size, None, total_records, page=page)
+    }
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Lỗi khi export dữ liệu: {str(e)}"
-        )
+@router.get("/clusters/{cluster_id}/questions", response_model=List[UnknownQuestionOut], summary="Các câu hỏi trong một nhóm")
+def get_cluster_questions(
+    cluster_id: int,
+    db: Session = Depends(get_db),
+    limit: int = Query(default=100, ge=1, le=1000, description="Số câu hỏi tối đa (mới nhất trước)")
+):
+    if db.query(UnknownQuestionCluster.id).filter(UnknownQuestionCluster.id == cluster_id).first() is None:
+        raise HTTPException(status_code=404, detail="Nhóm câu hỏi không tồn tại.")
+    return (db.query(UnknownQuestion)
+            .filter(UnknownQuestion.cluster_id == cluster_id)
+            .order_by(desc(UnknownQuestion.timestamp), desc(UnknownQuestion.id))
+            .limit(limit)
+            .all())
+
+@router.post("/clusters/rebuild", status_code=202, summary="Phân cụm câu hỏi chưa trả lời (tác vụ nền)")
+def rebuild_clusters(full: bool = Query(False, description="Phân cụm lại toàn bộ bằng k-means thay vì chỉ gán các câu hỏi mới")):
+    """
+    Mặc định chỉ phân cụm các câu hỏi mới (gán vào nhóm gần nhất hoặc tạo nhóm mới),
+    full=true phân cụm lại toàn bộ (tối đa UNKNOWN_CLUSTER_K nhóm).
+    Chạy trong tiến trình nền, trả về ngay job_id; theo dõi tại /jobs/{job_id}.
+    """
+    return start_job("unknown_clusters", "Đã bắt đầu phân cụm câu hỏi.", {"full": full})
 
 @router.delete("/clear-all", summary="Xóa toàn bộ câu hỏi chưa trả lời")
 def delete_all_questions(
@@ -167,7 +222,8 @@ def delete_all_questions(
         )
     
     try:
-        # Xóa toàn bộ records
+        # Xóa toàn bộ records (cùng các nhóm câu hỏi)
+        clear_clusters(db)
         count = db.query(UnknownQuestion).delete()
         db.commit()
         
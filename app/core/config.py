@@ -8,6 +8,97 @@ class Settings(BaseSettings):
     POSTGRES_SERVER: str = Field(..., env='POSTGRES_SERVER')
     POSTGRES_PORT: str = Field(..., env='POSTGRES_PORT')
     POSTGRES_DB: str = Field(..., env='POSTGRES_DB')
+    DATABASE_URL: str = Field("", env='DATABASE_URL')  # URL SQLAlchemy đầy đủ, thay cho POSTGRES_* nếu được đặt (ví dụ sqlite:///bench.db cho benchmark)
+
+    # Micro-batching cho bộ mã hoá câu hỏi (/chat/v1, /chat/v2)
+    EMBED_BATCH_MAX_SIZE: int = Field(32, env='EMBED_BATCH_MAX_SIZE')  # Số câu hỏi tối đa trong một batch
+    EMBED_BATCH_WAIT_MS: float = Field(5.0, env='EMBED_BATCH_WAIT_MS')  # Thời gian chờ gom batch (ms)
+
+    # Backend mô hình embedding
+    EMBED_BACKEND: str = Field("torch", env='EMBED_BACKEND')  # torch | onnx | onnx-int8 (cần export trước)
+    EMBED_ONNX_THREADS: int = Field(0, env='EMBED_ONNX_THREADS')  # Số luồng intra-op của ONNX Runtime (0 = mặc định)
+    EMBED_ONNX_MIN_COSINE: float = Field(0.99, env='EMBED_ONNX_MIN_COSINE')  # Cosine tối thiểu so với embedding fp32 gốc
+
+    # Dynamic batching cho bộ sinh câu trả lời ViT5 (/chat/v2, /chat/v3)
+    GEN_BATCH_MAX_SIZE: int = Field(8, env='GEN_BATCH_MAX_SIZE')  # Số prompt tối đa trong một lần generate
+    GEN_BATCH_WAIT_MS: float = Field(10.0, env='GEN_BATCH_WAIT_MS')  # Thời gian chờ gom batch (ms)
+
+    # Backend và profile giải mã của ViT5
+    GEN_BACKEND: str = Field("torch", env='GEN_BACKEND')  # torch | torch-int8 | onnx (cần optimum[onnxruntime])
+    GEN_STREAM_PROFILE: str = Field("greedy", env='GEN_STREAM_PROFILE')  # Giải mã khi streaming (/chat/v2/stream, /chat/v3/stream): greedy | sample
+    GEN_ROUTE_PROFILES: str = Field("v2:beam4,v3:beam4", env='GEN_ROUTE_PROFILES')  # route:profile[:max_new_tokens], profile: greedy | beam2 | beam4
+
+    # Quản lý mô hình theo worker
+    WORKER_MODELS: str = Field("embed,generator", env='WORKER_MODELS')  # Mô hình worker phục vụ: embed (v1), generator (v3), cả hai (v2)
+    MODEL_WARMUP: bool = Field(False, env='MODEL_WARMUP')  # Nạp trước mô hình khi khởi động thay vì ở lần gọi đầu tiên
+    MODEL_PRELOAD: bool = Field(False, env='MODEL_PRELOAD')  # Nạp mô hình khi import app (trước khi gunicorn fork worker)
+
+    # FAISS index
+    FAISS_INDEX_TYPE: str = Field("flat", env='FAISS_INDEX_TYPE')  # flat | ivf | hnsw | ivfpq
+    FAISS_NLIST: int = Field(0, env='FAISS_NLIST')  # Số centroid IVF (0 = tự chọn ~4*sqrt(N))
+    FAISS_NPROBE: int = Field(16, env='FAISS_NPROBE')  # Số centroid được quét khi tìm kiếm (IVF)
+    FAISS_HNSW_M: int = Field(32, env='FAISS_HNSW_M')  # Số liên kết mỗi nút (HNSW)
+    FAISS_EF_CONSTRUCTION: int = Field(200, env='FAISS_EF_CONSTRUCTION')  # Độ rộng tìm kiếm khi xây đồ thị (HNSW)
+    FAISS_EF_SEARCH: int = Field(64, env='FAISS_EF_SEARCH')  # Độ rộng tìm kiếm khi truy vấn (HNSW)
+    FAISS_PQ_M: int = Field(48, env='FAISS_PQ_M')  # Số sub-quantizer (IVF-PQ)
+    FAISS_PQ_NBITS: int = Field(8, env='FAISS_PQ_NBITS')  # Số bit mỗi sub-quantizer (IVF-PQ)
+    FAISS_MMAP: bool = Field(False, env='FAISS_MMAP')  # Memory-map file index (dùng chung giữa các worker)
+    FAISS_RELOAD_CHECK_SECONDS: float = Field(2.0, env='FAISS_RELOAD_CHECK_SECONDS')  # Chu kỳ kiểm tra phiên bản index do worker khác cập nhật
+    FAISS_KEEP_VERSIONS: int = Field(3, env='FAISS_KEEP_VERSIONS')  # Số phiên bản index cũ (tạo bởi rebuild) được giữ lại để rollback
+    FAISS_KEEP_INCREMENTAL_VERSIONS: int = Field(3, env='FAISS_KEEP_INCREMENTAL_VERSIONS')  # Số phiên bản cũ tạo bởi thêm/sửa/xoá document được giữ lại (tính riêng)
+    THRESH_STRICT: float = Field(40, env='THRESH_STRICT')  # Ngưỡng khoảng cách L2 khớp hoàn toàn (/chat/v1)
+    THRESH_SUGGEST: float = Field(70, env='THRESH_SUGGEST')  # Ngưỡng khoảng cách L2 để gợi ý câu hỏi (/chat/v1)
+
+    # Executor suy luận riêng cho /chat (giới hạn hàng đợi, từ chối sớm khi quá tải)
+    INFERENCE_WORKERS: int = Field(8, env='INFERENCE_WORKERS')  # Số luồng xử lý request chat
+    INFERENCE_QUEUE_SIZE: int = Field(32, env='INFERENCE_QUEUE_SIZE')  # Số request được chờ thêm khi mọi luồng bận
+    INFERENCE_TORCH_THREADS: int = Field(0, env='INFERENCE_TORCH_THREADS')  # Số luồng intra-op của torch (0 = mặc định)
+    INFERENCE_ROUTE_LIMITS: str = Field("v1:64,v2:16,v3:16", env='INFERENCE_ROUTE_LIMITS')  # Giới hạn đồng thời theo route
+
+    # Ghi lịch sử chat kiểu write-behind (không chờ commit trong request)
+    CHAT_LOG_WRITE_BEHIND: bool = Field(True, env='CHAT_LOG_WRITE_BEHIND')  # False = ghi đồng bộ như trước
+    CHAT_LOG_BUFFER_SIZE: int = Field(10000, env='CHAT_LOG_BUFFER_SIZE')  # Số bản ghi tối đa trong hàng đợi
+    CHAT_LOG_FLUSH_SIZE: int = Field(500, env='CHAT_LOG_FLUSH_SIZE')  # Số bản ghi mỗi lần bulk insert
+    CHAT_LOG_FLUSH_INTERVAL_MS: float = Field(1000, env='CHAT_LOG_FLUSH_INTERVAL_MS')  # Chu kỳ ghi tối đa (ms)
+
+    # Import dữ liệu (/train/upload, /fine_tune/upload)
+    INGEST_CHUNK_SIZE: int = Field(5000, env='INGEST_CHUNK_SIZE')  # Số dòng mỗi lần bulk insert/COPY
+    INGEST_INCREMENTAL_INDEX_LIMIT: int = Field(5000, env='INGEST_INCREMENTAL_INDEX_LIMIT')  # Upload lớn hơn: tạo lại index bằng tác vụ nền
+    INGEST_MAX_REJECTS_REPORTED: int = Field(100, env='INGEST_MAX_REJECTS_REPORTED')  # Số dòng lỗi/trùng tối đa được liệt kê trong kết quả
+    INGEST_DEDUP_POLICY: str = Field("skip", env='INGEST_DEDUP_POLICY')  # Câu hỏi trùng khi upload tài liệu: skip, merge hoặc report
+    INGEST_NEAR_DUP_DISTANCE: float = Field(0, env='INGEST_NEAR_DUP_DISTANCE')  # Ngưỡng khoảng cách L2 coi là gần trùng (0 = chỉ lọc trùng chính xác)
+    EXPORT_BATCH_SIZE: int = Field(2000, env='EXPORT_BATCH_SIZE')  # Số dòng đọc mỗi lần khi export (server-side cursor)
+    PAGINATION_COUNT_TTL_SECONDS: float = Field(60, env='PAGINATION_COUNT_TTL_SECONDS')  # Thời gian cache tổng số bản ghi của các trang danh sách
+
+    # Phân cụm câu hỏi chưa trả lời (tác vụ nền, /unknown_question/clusters)
+    UNKNOWN_CLUSTER_K: int = Field(200, env='UNKNOWN_CLUSTER_K')  # Số cụm tối đa khi phân cụm lại từ đầu (k-means)
+    UNKNOWN_CLUSTER_TRAIN_SIZE: int = Field(50000, env='UNKNOWN_CLUSTER_TRAIN_SIZE')  # Số câu hỏi mẫu để huấn luyện k-means
+    UNKNOWN_CLUSTER_MAX_DISTANCE: float = Field(70, env='UNKNOWN_CLUSTER_MAX_DISTANCE')  # Khoảng cách L2 tối đa tới tâm cụm, xa hơn thì tạo cụm mới
+    UNKNOWN_CLUSTER_BATCH_SIZE: int = Field(2000, env='UNKNOWN_CLUSTER_BATCH_SIZE')  # Số câu hỏi đọc và gán cụm mỗi lô
+    UNKNOWN_CLUSTER_ENCODE_BATCH: int = Field(64, env='UNKNOWN_CLUSTER_ENCODE_BATCH')  # Batch size khi mã hoá câu hỏi
+
+    # Fine-tune ViT5 (/fine_tune/start)
+    FINE_TUNE_MAX_LENGTH: int = Field(256, env='FINE_TUNE_MAX_LENGTH')  # Số token tối đa của câu đầu vào và câu đích khi tokenize
+    FINE_TUNE_REPLAY_RATIO: float = Field(1.0, env='FINE_TUNE_REPLAY_RATIO')  # Fine-tune tăng dần: số dòng cũ ôn lại / số dòng mới
+    FINE_TUNE_LORA_R: int = Field(8, env='FINE_TUNE_LORA_R')  # Hạng của ma trận LoRA
+    FINE_TUNE_LORA_ALPHA: int = Field(16, env='FINE_TUNE_LORA_ALPHA')  # Hệ số nhân của LoRA
+    FINE_TUNE_LORA_DROPOUT: float = Field(0.05, env='FINE_TUNE_LORA_DROPOUT')  # Dropout của LoRA
+    FINE_TUNE_LORA_LEARNING_RATE: float = Field(5e-4, env='FINE_TUNE_LORA_LEARNING_RATE')  # Tốc độ học khi chỉ huấn luyện adapter
+    FINE_TUNE_LORA_MERGE: bool = Field(True, env='FINE_TUNE_LORA_MERGE')  # Gộp adapter vào checkpoint sau khi huấn luyện (False: phiên bản chỉ chứa adapter)
+    MODEL_KEEP_VERSIONS: int = Field(3, env='MODEL_KEEP_VERSIONS')  # Số phiên bản mô hình cũ được giữ lại để rollback
+    MODEL_RELOAD_CHECK_SECONDS: float = Field(5.0, env='MODEL_RELOAD_CHECK_SECONDS')  # Chu kỳ kiểm tra phiên bản mô hình do worker/tác vụ khác promote
+
+    # Tác vụ nền (/train/start, /fine_tune/start) chạy trong tiến trình riêng
+    JOB_TORCH_THREADS: int = Field(2, env='JOB_TORCH_THREADS')  # Số luồng torch của tiến trình tác vụ (0 = mặc định)
+    JOB_NICE: int = Field(10, env='JOB_NICE')  # Độ ưu tiên thấp hơn worker phục vụ chat (nice)
+    JOB_CPUS: str = Field("", env='JOB_CPUS')  # Giới hạn CPU cho tác vụ, ví dụ "0-3" (rỗng = tất cả)
+
+    # Cache câu trả lời theo câu hỏi đã chuẩn hoá
+    ANSWER_CACHE_SIZE: int = Field(10000, env='ANSWER_CACHE_SIZE')  # Số câu trả lời tối đa (0 = tắt cache)
+    ANSWER_CACHE_TTL_SECONDS: float = Field(3600, env='ANSWER_CACHE_TTL_SECONDS')  # Thời gian sống của một câu trả lời
+    ANSWER_CACHE_STRIP_DIACRITICS: bool = Field(False, env='ANSWER_CACHE_STRIP_DIACRITICS')  # Bỏ dấu tiếng Việt khi chuẩn hoá
+    ANSWER_CACHE_PREWARM_SIZE: int = Field(0, env='ANSWER_CACHE_PREWARM_SIZE')  # Số câu hỏi phổ biến nhất nạp trước khi khởi động (0 = tắt; mỗi worker tự nạp mô hình để chạy)
+    ANSWER_CACHE_PREWARM_ROUTES: str = Field("v1", env='ANSWER_CACHE_PREWARM_ROUTES')  # Các route được nạp trước (v1,v2,v3)
 
     class Config:
         env_file = '.env'
@@ -3,14 +3,18 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-DATABASE_URL = (
+DATABASE_URL = settings.DATABASE_URL or (
     f"postgresql://{settings.POSTGRES_USER}:"
     f"{settings.POSTGRES_PASSWORD}@"
     f"{settings.POSTGRES_SERVER}:{settings.POSTGRES_PORT}/"
     f"{settings.POSTGRES_DB}"
 )
 
-engine = create_engine(DATABASE_URL)
+# SQLite (benchmark): connection được dùng từ nhiều luồng (executor suy luận, ghi lịch sử chat nền)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 30} if DATABASE_URL.startswith("sqlite") else {}
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
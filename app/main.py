@@ -1,6 +1,21 @@
 # app/main.py
+import gc
+import os
+import threading
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI
-from app.api.v1.endpoints import chat, train, fine_tune, unknown_question
+from app.api.v1.endpoints import chat, train, fine_tune, unknown_question, jobs
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.chat_service import prewarm_answer_cache
+from app.services.index_service import get_faiss_index
+from app.services.chat_log_service import chat_log_writer
+from app.services.model_service import model_manager
+from app.services.model_registry_service import get_serving_stats
+from app.utils.helpers import get_pss_mb, get_rss_mb
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI(title="Chatbot AI")
@@ -9,6 +24,7 @@ app.include_router(chat.router)
 app.include_router(train.router)
 app.include_router(fine_tune.router)
 app.include_router(unknown_question.router)
+app.include_router(jobs.router)
 
 # Cấu hình CORS
 app.add_middleware(
@@ -17,4 +33,71 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Cho phép tất cả methods
     allow_headers=["*"],  # Cho phép tất cả headers
-)
\ No newline at end of file
+)
+
+# Thông tin khởi động của worker (thời gian khởi động, bộ nhớ)
+startup_info = {}
+
+# Model cần cho từng route chat
+ROUTE_MODELS = {"v1": ("embed",), "v2": ("embed", "generator"), "v3": ("generator",)}
+
+# Chạy nhiều worker (gunicorn --preload): nạp mô hình ngay khi import app, trước khi fork,
+# để các worker dùng chung trọng số theo cơ chế copy-on-write thay vì mỗi worker một bản.
+# gc.freeze() đưa các đối tượng đã nạp ra khỏi GC, tránh GC ghi vào trang nhớ dùng chung.
+# Không chạy suy luận trước khi fork (thread pool của torch không an toàn khi fork).
+if settings.MODEL_PRELOAD:
+    model_manager.warmup()
+    gc.freeze()
+
+def _prewarm_answer_cache():
+    routes = [
+        route.strip() for route in settings.ANSWER_CACHE_PREWARM_ROUTES.split(",")
+        if route.strip() in ROUTE_MODELS and all(model_manager.is_enabled(m) for m in ROUTE_MODELS[route.strip()])
+    ]
+    if get_faiss_index() is None:
+        # Chưa có index: v1, v2 không trả lời được, không nạp mô hình embedding vô ích
+        routes = [route for route in routes if "embed" not in ROUTE_MODELS[route]]
+    if not routes:
+        return
+    db = SessionLocal()
+    try:
+        warmed = prewarm_answer_cache(db, routes, settings.ANSWER_CACHE_PREWARM_SIZE)
+        print(f"Đã nạp trước {warmed} câu trả lời vào cache ({', '.join(routes)})")
+    except Exception as e:
+        print(f"Lỗi nạp trước cache câu trả lời: {str(e)}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def on_startup():
+    if settings.MODEL_WARMUP and not settings.MODEL_PRELOAD:
+        model_manager.warmup()
+    if settings.ANSWER_CACHE_SIZE > 0 and settings.ANSWER_CACHE_PREWARM_SIZE > 0:
+        # Nạp cache ở luồng nền để không làm chậm quá trình khởi động
+        threading.Thread(target=_prewarm_answer_cache, name="answer-cache-prewarm", daemon=True).start()
+    startup_info["startup_seconds"] = round(time.perf_counter() - _import_started, 3)
+    startup_info["rss_mb_at_startup"] = get_rss_mb()
+    print(
+        f"Worker sẵn sàng sau {startup_info['startup_seconds']}s, "
+        f"RSS {startup_info['rss_mb_at_startup']} MB, mô hình: {model_manager.stats()}"
+    )
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Ghi nốt lịch sử chat còn trong hàng đợi write-behind
+    chat_log_writer.stop()
+
+@app.get("/health", summary="Trạng thái worker")
+def health():
+    """
+    Thời gian khởi động, bộ nhớ thường trú (RSS), bộ nhớ PSS (tính cả phần dùng chung giữa các worker)
+    và các mô hình đã nạp của worker.
+    """
+    return {
+        **startup_info,
+        "pid": os.getpid(),
+        "rss_mb": get_rss_mb(),
+        "pss_mb": get_pss_mb(),
+        "models": model_manager.stats(),
+        "generator_version": get_serving_stats(),
+    }
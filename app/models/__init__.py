@@ -2,4 +2,5 @@ from .chat_history import *
 from .document import *
 from .fine_tune_data import *
 from .user import *
-from .unknown_question import *
\ No newline at end of file
+from .unknown_question import *
+from .unknown_question_cluster import *
\ No newline at end of file
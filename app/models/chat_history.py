@@ -1,6 +1,6 @@
 # app/models/chat_history.py
 from datetime import datetime
-from sqlalchemy import Column, Integer, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, Text, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 
@@ -12,3 +12,8 @@ class ChatHistory(Base):
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Lịch sử hội thoại của một user theo thời gian
+        Index("ix_chat_history_user_id_timestamp", "user_id", "timestamp"),
+    )
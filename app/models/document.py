@@ -1,5 +1,5 @@
 # app/models/document.py
-from sqlalchemy import Column, Integer, Text
+from sqlalchemy import Column, Integer, String, Text
 from app.db.base import Base
 
 class Document(Base):
@@ -7,3 +7,4 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text, nullable=False)   # Câu hỏi (đầu vào từ Excel)
     answer = Column(Text, nullable=False)     # Hướng dẫn/đáp án tương ứng
+    question_hash = Column(String(64), index=True)  # Hash câu hỏi đã chuẩn hoá (lọc trùng khi upload)
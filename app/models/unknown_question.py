@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, DateTime
+from sqlalchemy import Column, Integer, Text, DateTime, Index, ForeignKey
 from app.db.base import Base
 from datetime import datetime
 
@@ -6,4 +6,10 @@ class UnknownQuestion(Base):
     __tablename__ = "unknown_questions"
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)  # Không NULL: dùng cho phân trang keyset (timestamp, id)
+    cluster_id = Column(Integer, ForeignKey("unknown_question_clusters.id", ondelete="SET NULL"), index=True)  # Cụm câu hỏi (None: chưa phân cụm)
+
+    __table_args__ = (
+        # Phân trang keyset và lọc theo thời gian (mới nhất trước)
+        Index("ix_unknown_questions_timestamp_id", "timestamp", "id"),
+    )
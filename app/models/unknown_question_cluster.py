@@ -0,0 +1,14 @@
+# app/models/unknown_question_cluster.py
+from datetime import datetime
+from sqlalchemy import Column, Integer, Float, Text, DateTime
+from app.db.base import Base
+
+class UnknownQuestionCluster(Base):
+    __tablename__ = "unknown_question_clusters"
+    id = Column(Integer, primary_key=True, index=True)
+    representative = Column(Text, nullable=False)             # Câu hỏi gần tâm cụm nhất
+    representative_distance = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0, index=True)  # Số câu hỏi trong cụm
+    first_seen = Column(DateTime)                             # Thời điểm câu hỏi đầu tiên / mới nhất của cụm
+    last_seen = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -1,13 +1,15 @@
 from pydantic import BaseModel
-from typing import Generic, TypeVar, List
+from typing import Generic, TypeVar, List, Optional
 
 T = TypeVar('T')
 
 class PaginationInfo(BaseModel):
-    page: int
+    page: Optional[int] = None              # Chỉ có khi phân trang theo số trang
     page_size: int
-    total_records: int
-    total_pages: int
+    total_records: Optional[int] = None     # Chỉ có khi yêu cầu tổng số (include_total)
+    total_pages: Optional[int] = None
+    next_cursor: Optional[str] = None       # Truyền vào cursor để lấy trang tiếp theo
+    has_more: bool = False
 
 class PaginationResponse(BaseModel, Generic[T]):
     items: List[T]
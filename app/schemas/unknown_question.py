@@ -1,6 +1,8 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+
+from app.schemas.common import PaginationInfo
 
 class UnknownQuestionOut(BaseModel):
     id: int
@@ -10,12 +12,22 @@ class UnknownQuestionOut(BaseModel):
     class Config:
         orm_mode = True
 
-class PaginationInfo(BaseModel):
-    page: int
-    page_size: int
-    total_records: int
-    total_pages: int
-
 class UnknownQuestionResponse(BaseModel):
     items: List[UnknownQuestionOut]
-    pagination: PaginationInfo
\ No newline at end of file
+    pagination: PaginationInfo
+
+class UnknownQuestionClusterOut(BaseModel):
+    id: int
+    representative: str
+    count: int
+    first_seen: Optional[datetime]
+    last_seen: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+class UnknownQuestionClusterResponse(BaseModel):
+    items: List[UnknownQuestionClusterOut]
+    unclustered: int            # Số câu hỏi chưa được phân cụm (chờ tác vụ phân cụm tiếp theo)
+    pagination: PaginationInfo
@@ -0,0 +1,102 @@
+# app/services/answer_cache_service.py
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.chat_history import ChatHistory
+from app.services.index_service import get_index_version
+from app.services.model_service import model_manager
+from app.utils.helpers import normalize_text
+
+
+class AnswerCache:
+    """
+    Cache LRU có thời gian sống (TTL) cho câu trả lời của chatbot, an toàn giữa các luồng.
+    max_size = 0 thì tắt cache.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()   # key -> (thời điểm hết hạn, giá trị)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+answer_cache = AnswerCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL_SECONDS)
+
+
+def make_cache_key(route: str, message: str):
+    """
+    Khoá cache: route + phiên bản index + phiên bản mô hình sinh + câu hỏi đã chuẩn hoá.
+    Khi index được rebuild/cập nhật hoặc mô hình được fine-tune, khoá cũ không còn được dùng.
+    """
+    return (
+        route,
+        get_index_version(),
+        model_manager.version("generator"),
+        normalize_text(message, strip_diacritics=settings.ANSWER_CACHE_STRIP_DIACRITICS),
+    )
+
+
+def cached_answer(route: str, message: str, compute):
+    """Lấy câu trả lời từ cache, nếu chưa có thì gọi compute() và lưu lại."""
+    key = make_cache_key(route, message)
+    value = answer_cache.get(key)
+    if value is None:
+        value = compute()
+        answer_cache.put(key, value)
+    return value
+
+
+def get_frequent_questions(db: Session, limit: int):
+    """Các câu hỏi được hỏi nhiều nhất trong ChatHistory."""
+    rows = (db.query(ChatHistory.question, func.count(ChatHistory.id).label("total"))
+            .group_by(ChatHistory.question)
+            .order_by(func.count(ChatHistory.id).desc())
+            .limit(limit)
+            .all())
+    return [row.question for row in rows]
@@ -0,0 +1,174 @@
+# app/services/answer_store_service.py
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+# Tên các file của kho câu hỏi/câu trả lời (nằm cạnh FAISS index)
+IDS_FILE = "answer_store.ids.npy"
+OFFSETS_FILE = "answer_store.offsets.npy"
+BLOB_FILE = "answer_store.blob.bin"
+META_FILE = "answer_store.meta.json"
+DELTA_FILE = "answer_store.delta.jsonl"
+STORE_FILES = (IDS_FILE, OFFSETS_FILE, BLOB_FILE, META_FILE, DELTA_FILE)
+
+
+class AnswerStore:
+    """
+    Kho (câu hỏi, câu trả lời) chỉ đọc theo document id, được tạo cùng lúc với FAISS index
+    để luồng chat không cần truy vấn DB cho mỗi kết quả tìm kiếm.
+
+    - ids.npy: document id (int64, tăng dần), offsets.npy: vị trí câu hỏi/câu trả lời thứ i trong blob
+      (2N+1 phần tử), blob.bin: nội dung UTF-8. Tất cả được memory-map.
+    - meta.json ghi build_id của index tương ứng; kho chỉ được dùng khi khớp build_id của index.
+    - delta.jsonl ghi các thay đổi tăng dần (thêm/sửa/xoá) sau lần build, được nạp vào bộ nhớ.
+    """
+
+    def __init__(self, directory, build_id=None):
+        self.directory = Path(directory)
+        self.build_id = build_id
+        self._ids = np.empty(0, dtype="int64")
+        self._offsets = np.zeros(1, dtype="int64")
+        self._blob = b""
+        self._overlay = {}      # document id -> (question, answer) hoặc None nếu đã xoá
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def write(cls, directory, build_id, rows):
+        """Ghi kho mới từ danh sách (id, question, answer). Trả về AnswerStore đã nạp."""
+        directory = Path(directory)
+        rows = sorted(rows, key=lambda row: row[0])
+        ids = np.asarray([row[0] for row in rows], dtype="int64")
+        offsets = np.zeros(2 * len(rows) + 1, dtype="int64")
+
+        # Ghi ra file tạm rồi đổi tên: không ghi đè file đang được worker khác memory-map
+        position = 0
+        with open(directory / (BLOB_FILE + ".tmp"), "wb") as f:
+            for i, (_, question, answer) in enumerate(rows):
+                for j, text in enumerate((question, answer)):
+                    data = text.encode("utf-8")
+                    f.write(data)
+                    position += len(data)
+                    offsets[2 * i + j + 1] = position
+        with open(directory / (IDS_FILE + ".tmp"), "wb") as f:
+            np.save(f, ids)
+        with open(directory / (OFFSETS_FILE + ".tmp"), "wb") as f:
+            np.save(f, offsets)
+        for name in (BLOB_FILE, IDS_FILE, OFFSETS_FILE):
+            os.replace(directory / (name + ".tmp"), directory / name)
+        if (directory / DELTA_FILE).exists():
+            os.remove(directory / DELTA_FILE)
+        # meta.json được ghi sau cùng: kho chỉ hợp lệ khi đã ghi xong toàn bộ
+        with open(directory / (META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump({"build_id": build_id, "count": len(rows)}, f)
+        os.replace(directory / (META_FILE + ".tmp"), directory / META_FILE)
+        return cls.load(directory, build_id)
+
+    @classmethod
+    def load(cls, directory, build_id):
+        """Nạp kho nếu khớp build_id của index, ngược lại trả về kho rỗng (mọi truy vấn sẽ dùng DB)."""
+        store = cls(directory, build_id)
+        try:
+            with open(store.directory / META_FILE, encoding="utf-8") as f:
+                meta = json.load(f)
+            if not build_id or meta.get("build_id") != build_id:
+                return store
+            ids = np.load(store.directory / IDS_FILE, mmap_mode="r")
+            offsets = np.load(store.directory / OFFSETS_FILE, mmap_mode="r")
+            blob = b""
+            if offsets[-1] > 0:
+                with open(store.directory / BLOB_FILE, "rb") as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            store._ids, store._offsets, store._blob = ids, offsets, blob
+            store._load_delta()
+        except (OSError, ValueError) as e:
+            print(f"Không nạp được kho câu trả lời: {str(e)}")
+            return cls(directory, build_id)
+        return store
+
+    def _load_delta(self):
+        path = self.directory / DELTA_FILE
+        if not path.exists():
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item.get("deleted"):
+                    self._overlay[item["id"]] = None
+                else:
+                    self._overlay[item["id"]] = (item["question"], item["answer"])
+
+    def apply_delta(self, upserts=(), deletes=()):
+        """Ghi nhận thay đổi tăng dần: upserts là (id, question, answer), deletes là các id."""
+        lines = []
+        for doc_id, question, answer in upserts:
+            self._overlay[int(doc_id)] = (question, answer)
+            lines.append({"id": int(doc_id), "question": question, "answer": answer})
+        for doc_id in deletes:
+            self._overlay[int(doc_id)] = None
+            lines.append({"id": int(doc_id), "deleted": True})
+        if lines and (self.directory / META_FILE).exists():
+            with open(self.directory / DELTA_FILE, "a", encoding="utf-8") as f:
+                for item in lines:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def get(self, doc_id: int):
+        """Trả về (question, answer) hoặc None nếu không có trong kho."""
+        doc_id = int(doc_id)
+        if doc_id in self._overlay:
+            row = self._overlay[doc_id]
+        else:
+            pos = int(np.searchsorted(self._ids, doc_id))
+            if pos < len(self._ids) and self._ids[pos] == doc_id:
+                start, middle, end = self._offsets[2 * pos], self._offsets[2 * pos + 1], self._offsets[2 * pos + 2]
+                row = (
+                    bytes(self._blob[start:middle]).decode("utf-8"),
+                    bytes(self._blob[middle:end]).decode("utf-8"),
+                )
+            else:
+                row = None
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def stats(self) -> dict:
+        return {
+            "build_id": self.build_id,
+            "entries": len(self._ids),
+            "overlay": len(self._overlay),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def remove_store_files(directory):
+    for name in STORE_FILES:
+        path = Path(directory) / name
+        if path.exists():
+            os.remove(path)
+
+
+def link_store_files(source, target):
+    """
+    Dùng lại kho của phiên bản index trước cho phiên bản mới: các file chỉ đọc được hard link
+    (không tốn thêm dung lượng), delta.jsonl được sao chép vì sẽ được ghi thêm.
+    """
+    for name in STORE_FILES:
+        src, dst = Path(source) / name, Path(target) / name
+        if not src.exists():
+            continue
+        if name == DELTA_FILE:
+            shutil.copyfile(src, dst)
+            continue
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
@@ -0,0 +1,131 @@
+# app/services/chat_log_service.py
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.chat_history import ChatHistory
+from app.models.unknown_question import UnknownQuestion
+from app.models.user import User
+
+
+class ChatLogWriter:
+    """
+    Ghi ChatHistory và UnknownQuestion theo kiểu write-behind: request chat chỉ đưa bản ghi vào
+    hàng đợi (có giới hạn), luồng nền gom lại và ghi bằng bulk insert khi đủ flush_size bản ghi
+    hoặc sau flush_interval_ms. Khi hàng đợi đầy, bản ghi bị bỏ và được đếm vào dropped.
+    """
+
+    def __init__(self, session_factory, max_buffer: int, flush_size: int, flush_interval_ms: float):
+        self.session_factory = session_factory
+        self.max_buffer = max_buffer
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0.01, flush_interval_ms / 1000.0)
+        self._init_state()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self):
+        self._queue = queue.Queue(maxsize=self.max_buffer)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._worker, name="chat-log-writer", daemon=True)
+                    self._thread.start()
+
+    def _put(self, kind: str, values: dict):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((kind, values))
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def log_chat(self, user_id: int, question: str, answer: str):
+        """Ghi lịch sử chat (chỉ được lưu nếu user tồn tại, giống hành vi cũ)."""
+        if user_id is None:
+            return
+        self._put("history", {"user_id": user_id, "question": question, "answer": answer, "timestamp": datetime.utcnow()})
+
+    def log_unknown(self, question: str):
+        """Ghi câu hỏi chưa có câu trả lời (chính xác)."""
+        self._put("unknown", {"question": question, "timestamp": datetime.utcnow()})
+
+    def _worker(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        histories = [values for kind, values in batch if kind == "history"]
+        unknowns = [values for kind, values in batch if kind == "unknown"]
+        db = self.session_factory()
+        try:
+            if histories:
+                # Một truy vấn cho cả batch thay vì kiểm tra user ở mỗi request
+                user_ids = {values["user_id"] for values in histories}
+                existing = {row.id for row in db.query(User.id).filter(User.id.in_(user_ids))}
+                histories = [values for values in histories if values["user_id"] in existing]
+            if histories:
+                db.execute(insert(ChatHistory), histories)
+            if unknowns:
+                db.execute(insert(UnknownQuestion), unknowns)
+            db.commit()
+            self.written += len(histories) + len(unknowns)
+            self.flushes += 1
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            print(f"Lỗi ghi lịch sử chat: {str(e)}")
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 10.0):
+        """Dừng luồng nền sau khi ghi hết các bản ghi còn trong hàng đợi (gọi khi tắt ứng dụng)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+        }
+
+
+chat_log_writer = ChatLogWriter(
+    SessionLocal,
+    max_buffer=settings.CHAT_LOG_BUFFER_SIZE,
+    flush_size=settings.CHAT_LOG_FLUSH_SIZE,
+    flush_interval_ms=settings.CHAT_LOG_FLUSH_INTERVAL_MS,
+)
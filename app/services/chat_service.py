@@ -1,6 +1,5 @@
 # app/services/chat_service.py
 from sqlalchemy.orm import Session
-import faiss
 import numpy as np
 from app.services.user_service import get_or_create_user
 from app.models.chat_history import ChatHistory
@@ -8,231 +7,354 @@ from app.models.document import Document
 from app.models.user import User
 from app.models.fine_tune_data import FineTuneData
 from app.models.unknown_question import UnknownQuestion
+import os
+import shutil
+import time
 from datetime import datetime
-import pickle
-import torch
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
 from pathlib import Path
-
-# Đường dẫn file lưu FAISS index và mapping
-INDEX_FILE = "data/faiss_index/faiss.index"
-MAPPING_FILE = "data/faiss_index/mapping.pkl"
-
-# Đường dẫn file lưu dư liệu fine-tune
-FINE_TUNE_FILE = "data/fine_tune/"
-
-# Khởi tạo mô hình embedding (có thể thực hiện 1 lần khi module được load)
-from sentence_transformers import SentenceTransformer
-embed_model = SentenceTransformer('VoVanPhuc/sup-SimCSE-VietNamese-phobert-base')
-
-# Khởi tạo mô hình (ưu tiên load checkpoint fine-tune nếu có)
-# from transformers import T5Tokenizer, T5ForConditionalGeneration
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-from transformers import Trainer, TrainingArguments, DataCollatorForSeq2Seq
-
-if Path(FINE_TUNE_FILE).exists() and (Path(FINE_TUNE_FILE) / "pytorch_model.bin").exists():
-    tokenizer = AutoTokenizer .from_pretrained(FINE_TUNE_FILE)
-    model = AutoModelForSeq2SeqLM .from_pretrained(FINE_TUNE_FILE)
-else:
-    model_name = "VietAI/vit5-base"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-
-# Hàm load index và mapping nếu đã tạo trước đó
-def load_faiss_index():
-    try:
-        index = faiss.read_index(INDEX_FILE)
-        with open(MAPPING_FILE, 'rb') as f:
-            id_map = pickle.load(f)
-        return index, id_map
-    except Exception as e:
-        return None, None
-
-# Thư mục chứa FAISS index
-faiss_index, faiss_id_map = load_faiss_index()
-
-def rebuild_faiss_index(db: Session):
+from app.core.config import settings
+from app.services.model_service import FINE_TUNE_FILE, get_embed_model
+from app.services.chat_log_service import chat_log_writer
+from app.services.model_registry_service import create_version, discard_version, read_current, read_version_meta, register_version, resolve_version
+from app.services.answer_cache_service import cached_answer, answer_cache, get_frequent_questions, make_cache_key
+from app.services.index_service import get_distance_thresholds, get_document_text, get_faiss_index, get_index_stats, rebuild_faiss_index, search_index
+from app.services.fine_tune_dataset_service import (FINE_TUNE_DATASET_DIR, TokenizedSeq2SeqDataset, build_tokenized_dataset,
+                                                    read_train_state, select_incremental_rows)
+from app.services.generation_service import STREAM_PROFILES, generate_answer, get_generation_stats, stream_generate, stream_stats
+from app.utils.batching import MicroBatcher
+
+# Các mô hình (SentenceTransformer, ViT5) được nạp khi dùng lần đầu qua model_manager,
+# torch/transformers cũng chỉ được import khi cần để module load nhanh.
+
+# Số kết quả lấy ra cho mỗi câu hỏi trong batch (v1 dùng 3, v2 dùng 1)
+SEARCH_TOP_K = 3
+
+# Chế độ fine-tune: full (toàn bộ dữ liệu) | incremental (dữ liệu mới + ôn lại một phần dữ liệu cũ)
+FINE_TUNE_MODES = ("full", "incremental")
+
+def _encode_and_search_batch(messages):
     """
-    Tạo lại FAISS index từ tất cả Document trong DB.
-    Lưu index ra file và lưu mapping id.
-    Tự động nạp lại index sau khi rebuild.
+    Mã hoá một batch câu hỏi bằng một lần gọi embed_model.encode
+    và tìm kiếm FAISS bằng một lần gọi search trên toàn bộ ma trận.
+    Trả về (D, I) dạng 2 chiều (1 dòng) cho từng câu hỏi.
     """
-    global faiss_index, faiss_id_map
-
-    try:
-        docs = db.query(Document).all()
-        texts = [doc.question for doc in docs]
-        ids = [doc.id for doc in docs]
-        if not texts:
-            return False
-
-        # Tạo vectors bằng mô hình embedding
-        vectors = embed_model.encode(texts, convert_to_numpy=True)
-        dim = vectors.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(vectors.astype('float32'))
-
-        # Lưu index và mapping
-        faiss.write_index(index, INDEX_FILE)
-        with open(MAPPING_FILE, 'wb') as f:
-            pickle.dump(ids, f)
-
-        # Nạp lại index và mapping vào biến global
-        faiss_index, faiss_id_map = load_faiss_index()
-        
-        return True
-    except Exception as e:
-        print(f"Lỗi quá trình faiss dữ liệu: {str(e)}")
-        return False
-
-def rebuild_fine_tune(db: Session):
+    embed_model = get_embed_model()
+    query_vecs = embed_model.encode(messages, convert_to_numpy=True, batch_size=len(messages))
+    D, I = search_index(query_vecs.astype('float32'), SEARCH_TOP_K)
+    return [(D[i:i + 1], I[i:i + 1]) for i in range(len(messages))]
+
+# Hàng đợi mã hoá dùng chung: gom các câu hỏi đến đồng thời thành một batch
+search_batcher = MicroBatcher(
+    _encode_and_search_batch,
+    max_batch_size=settings.EMBED_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBED_BATCH_WAIT_MS,
+    name="embed-search-batcher",
+)
+
+def get_chat_stats():
+    """Thống kê hàng đợi (queue depth), kích thước batch và cache câu trả lời."""
+    return {
+        "embed_search": search_batcher.stats(),
+        "generation": get_generation_stats(),
+        "answer_cache": answer_cache.stats(),
+        "index": get_index_stats(),
+        "chat_log": chat_log_writer.stats(),
+    }
+
+def rebuild_fine_tune(db: Session, progress_callback=None, mode: str = "full", lora: bool = False, promote: bool = True):
     """
-    Fine-tune mô hình ViT5-base với dữ liệu đã upload từ FineTuneData.
-    Lưu checkpoint vào thư mục FINE_TUNE_FILE.
+    Fine-tune mô hình ViT5-base với dữ liệu đã upload từ FineTuneData, bắt đầu từ phiên bản đang phục vụ.
+    Kết quả được lưu thành một phiên bản mới trong kho phiên bản (model_registry_service) và
+    được đưa vào phục vụ nếu promote=True (các worker tự chuyển sang trong nền).
+    Dữ liệu được tokenize một lần thành dataset memory-map, batch được pad động và gom theo độ dài.
+    - mode="full": huấn luyện trên toàn bộ dữ liệu; mode="incremental": tiếp tục từ checkpoint gần nhất, chỉ huấn luyện
+      các dòng mới kể từ lần trước cộng một mẫu dòng cũ (FINE_TUNE_REPLAY_RATIO). Chưa có checkpoint thì chạy full.
+    - lora=True: chỉ huấn luyện adapter LoRA (cần peft); adapter được gộp vào checkpoint (FINE_TUNE_LORA_MERGE)
+      hoặc phiên bản chỉ chứa adapter, được gộp vào mô hình nền khi nạp.
+    progress_callback(**tiến độ) được gọi sau mỗi bước huấn luyện (step, max_steps, epoch, loss)
+    và sau mỗi epoch (epoch_seconds);
+    exception ném ra từ callback sẽ dừng quá trình huấn luyện.
+    Trả về meta của phiên bản mới, False nếu không có dữ liệu (mới) để huấn luyện.
     """
+    if mode not in FINE_TUNE_MODES:
+        raise ValueError(f"mode không hợp lệ: {mode} (hỗ trợ: {', '.join(FINE_TUNE_MODES)})")
 
-    docs = db.query(FineTuneData).all()
-    # Sử dụng trường 'answers' làm câu hỏi, 'target' làm câu trả lời theo ngữ cảnh
-    questions = [doc.answer for doc in docs]
-    targets = [doc.target for doc in docs]
-    if not questions or not targets:
+    # Sử dụng trường 'answer' làm câu hỏi, 'target' làm câu trả lời theo ngữ cảnh
+    if db.query(FineTuneData.id).first() is None:
         return False
 
-    global tokenizer, model
-
-    # Chuẩn bị dataset cho Trainer
-    class QADataset(torch.utils.data.Dataset):
-        def __init__(self, questions, targets, tokenizer, max_length=256):
-            self.questions = questions
-            self.targets = targets
-            self.tokenizer = tokenizer
-            self.max_length = max_length
-
-        def __len__(self):
-            return len(self.questions)
-
-        def __getitem__(self, idx):
-            input_enc = self.tokenizer(
-                self.questions[idx],
-                truncation=True,
-                padding="max_length",
-                max_length=self.max_length,
-                return_tensors="pt"
-            )
-            target_enc = self.tokenizer(
-                self.targets[idx],
-                truncation=True,
-                padding="max_length",
-                max_length=self.max_length,
-                return_tensors="pt"
-            )
-            return {
-                "input_ids": input_enc.input_ids.squeeze(),
-                "attention_mask": input_enc.attention_mask.squeeze(),
-                "labels": target_enc.input_ids.squeeze()
-            }
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, Trainer, TrainerCallback, TrainingArguments, DataCollatorForSeq2Seq
+
+    current = read_current()
+    source, adapter = resolve_version(current)
+    # Dòng dữ liệu cuối cùng đã huấn luyện: trong meta của phiên bản (hoặc checkpoint cũ ở FINE_TUNE_FILE)
+    state = read_version_meta(current) if current else read_train_state(FINE_TUNE_FILE)
+    if mode == "incremental" and not (state or {}).get("last_row_id"):
+        print("Chưa có checkpoint fine-tune, chuyển sang fine-tune toàn bộ dữ liệu")
+        mode = "full"
+
+    # Luôn huấn luyện bản torch fp32 (không phụ thuộc GEN_BACKEND của mô hình đang phục vụ)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModelForSeq2SeqLM.from_pretrained(source)
+    if lora:
+        from peft import LoraConfig, PeftModel, TaskType, get_peft_model
+
+        if mode == "incremental" and adapter:
+            # Tiếp tục huấn luyện adapter chưa gộp
+            model = PeftModel.from_pretrained(model, adapter, is_trainable=True)
+        else:
+            model = get_peft_model(model, LoraConfig(
+                task_type=TaskType.SEQ_2_SEQ_LM,
+                r=settings.FINE_TUNE_LORA_R,
+                lora_alpha=settings.FINE_TUNE_LORA_ALPHA,
+                lora_dropout=settings.FINE_TUNE_LORA_DROPOUT,
+                target_modules=["q", "v"], # Chiếu query/value trong các lớp attention của T5
+            ))
+        model.print_trainable_parameters()
+    elif adapter:
+        # Huấn luyện toàn bộ trọng số trên mô hình đang phục vụ (đã gộp adapter)
+        from peft import PeftModel
+        model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+
+    # Tokenize một lần (dùng lại nếu dữ liệu không đổi), đọc bằng memory-map trong các epoch
+    dataset_meta = build_tokenized_dataset(db, tokenizer)
+    if dataset_meta is None:
+        return False
+    positions, new_rows, replay_rows = None, dataset_meta["rows"], 0
+    if mode == "incremental":
+        positions, new_rows, replay_rows = select_incremental_rows(
+            FINE_TUNE_DATASET_DIR, state["last_row_id"], settings.FINE_TUNE_REPLAY_RATIO
+        )
+        if not new_rows:
+            print("Không có dữ liệu fine-tune mới kể từ lần trước")
+            return False
+    dataset = TokenizedSeq2SeqDataset(positions=positions)
+    print(f"Dữ liệu fine-tune ({mode}{', LoRA' if lora else ''}): {len(dataset)} dòng "
+          f"({new_rows} mới, {replay_rows} ôn lại), {dataset_meta['input_tokens']} token đầu vào, "
+          f"{dataset_meta['label_tokens']} token nhãn")
 
-    dataset = QADataset(questions, targets, tokenizer)
+    # Adapter chưa gộp được lưu thành phiên bản chỉ chứa adapter, còn lại là checkpoint đầy đủ
+    merged = not lora or settings.FINE_TUNE_LORA_MERGE
+    version_id, version_dir = create_version()
+    trainer_dir = os.path.join(version_dir, "trainer")
 
     # Thiết lập tham số huấn luyện
     training_args = TrainingArguments(
-        output_dir=FINE_TUNE_FILE, # Thư mục lưu checkpoint sau khi fine-tune.
+        output_dir=trainer_dir, # Thư mục lưu checkpoint trung gian trong lúc fine-tune.
         num_train_epochs=3, #Số epoch huấn luyện (mặc định 1).
         per_device_train_batch_size=4, # Batch size cho mỗi thiết bị (mặc định 4).
+        group_by_length=True, # Gom các dòng có độ dài gần nhau vào cùng batch (ít phải pad).
         save_steps=10, #Lưu checkpoint sau mỗi số bước nhất định (mặc định 10).
         save_total_limit=2, # Số lượng checkpoint tối đa lưu trữ (mặc định 2).
         logging_steps=5, # Số bước giữa mỗi lần log (mặc định 5).
-        learning_rate=5e-5, # Tốc độ học (mặc định 5e-5).
+        learning_rate=settings.FINE_TUNE_LORA_LEARNING_RATE if lora else 5e-5, # Tốc độ học (mặc định 5e-5, adapter LoRA cần cao hơn).
         remove_unused_columns=False, # Không loại bỏ các cột không dùng (để tránh lỗi với Trainer).
         report_to=[], # Không gửi log tới bất kỳ hệ thống nào (chạy offline).
         fp16=torch.cuda.is_available(), # Sử dụng FP16 nếu có GPU hỗ trợ.
         overwrite_output_dir=True # Ghi đè thư mục output nếu đã tồn tại.
     )
 
-    data_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
+    # Pad động theo dòng dài nhất của batch; token pad trong nhãn được đặt -100 (không tính loss)
+    data_collator = DataCollatorForSeq2Seq(tokenizer, model=model, label_pad_token_id=-100, pad_to_multiple_of=8)
 
+    class ProgressCallback(TrainerCallback):
+        # Báo tiến độ (bước, epoch, loss, thời gian từng epoch) cho tác vụ nền
+        def __init__(self):
+            self.loss = None
+            self.epoch_start = None
+            self.epoch_seconds = []
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            if logs and "loss" in logs:
+                self.loss = logs["loss"]
+
+        def on_epoch_begin(self, args, state, control, **kwargs):
+            self.epoch_start = time.perf_counter()
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            seconds = round(time.perf_counter() - self.epoch_start, 1)
+            self.epoch_seconds.append(seconds)
+            print(f"Fine-tune epoch {len(self.epoch_seconds)}: {seconds}s, loss={self.loss}")
+            if progress_callback:
+                progress_callback(epoch_seconds=list(self.epoch_seconds))
+
+        def on_step_end(self, args, state, control, **kwargs):
+            if progress_callback:
+                progress_callback(step=state.global_step, max_steps=state.max_steps, epoch=round(state.epoch or 0, 3), loss=self.loss)
+
+    progress = ProgressCallback()
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=dataset,
         data_collator=data_collator,
-        tokenizer=tokenizer
+        tokenizer=tokenizer,
+        callbacks=[progress]
     )
 
-    trainer.train()
-    # Lưu checkpoint cuối cùng
-    trainer.save_model(FINE_TUNE_FILE) # model.save_pretrained(FINE_TUNE_FILE)
-    tokenizer.save_pretrained(FINE_TUNE_FILE)
-
-    return True
-
-def get_answer_from_documents_v1(user_id: int, message: str, db: Session):
-    global faiss_index, faiss_id_map
-
-    # Các ngưỡng khoảng cách
-    THRESH_STRICT = 40
-    THRESH_SUGGEST = 70
-
     try:
-        query_vec = embed_model.encode([message], convert_to_numpy=True)
-        k = 3
-        D, I = faiss_index.search(query_vec.astype('float32'), k)
-
-        # Trường hợp 1: Khớp hoàn toàn
-        if D[0][0] < THRESH_STRICT:
-            idx = I[0][0]
-            doc_id = faiss_id_map[idx]
-            doc = db.query(Document).get(doc_id)
-            answer = doc.answer
-        # Trường hợp 2: Khớp vừa phải
-        elif D[0][0] < THRESH_SUGGEST:
-            suggestions = []
-            for idx in I[0]:
-                if idx < len(faiss_id_map):
-                    doc_id = faiss_id_map[idx]
-                    doc = db.query(Document).get(doc_id)
-                    if doc:
-                        suggestions.append(doc.question)
-            answer = (
-                "Tôi chưa chắc chắn về câu hỏi của bạn. Bạn có muốn hỏi một trong các câu sau không?\n"
-                + "\n".join(f"- {q}" for q in suggestions)
-            )
-            
-            # Lưu câu hỏi chưa có câu trả lời chính xác
-            unanswered = UnknownQuestion(
-                question=message,
-                timestamp=datetime.utcnow()
-            )
-            db.add(unanswered)
-            
-        # Trường hợp 3: Không phù hợp
+        trainer.train()
+        if lora and not merged:
+            # Chỉ lưu trọng số adapter (vài MB); mô hình nền giữ nguyên
+            trainer.save_model(version_dir)
         else:
-            answer = "Chưa có dữ liệu được đào tạo liên quan câu hỏi của bạn. Câu hỏi của bạn đã được ghi nhận vào hệ thống." + \
-                    "Vui lòng hỏi lại sau khi tôi được cập nhật thêm!" + \
-                    "Trong khi đó, bạn có muốn biết thêm thông tin gì khác không?"
-            
-            # Lưu câu hỏi chưa có câu trả lời
-            unanswered = UnknownQuestion(
+            if lora:
+                model = model.merge_and_unload()
+            # Lưu checkpoint cuối cùng
+            model.save_pretrained(version_dir)
+            tokenizer.save_pretrained(version_dir)
+        shutil.rmtree(trainer_dir, ignore_errors=True)
+    except BaseException:
+        discard_version(version_id)
+        raise
+
+    meta = {
+        "mode": mode,
+        "lora": lora,
+        "merged": merged,
+        "parent": current,
+        "rows": len(dataset),
+        "new_rows": new_rows,
+        "replay_rows": replay_rows,
+        "last_row_id": dataset_meta["last_row_id"],
+        "total_rows": dataset_meta["rows"],
+        "loss": progress.loss,
+        "epoch_seconds": progress.epoch_seconds,
+    }
+    if not merged:
+        # Phiên bản chỉ chứa adapter: mô hình nền (phiên bản đầy đủ được giữ lại khi dọn phiên bản cũ)
+        meta["base"] = source
+        meta["base_version"] = (read_version_meta(current).get("base_version") if adapter else current) if current else None
+    return register_version(version_id, meta, promote=promote)
+
+def _save_chat_history(user_id: int, message: str, answer: str, db: Session):
+    """Lưu lịch sử chat nếu có user_id hợp lệ."""
+    if settings.CHAT_LOG_WRITE_BEHIND:
+        chat_log_writer.log_chat(user_id, message, answer)
+    elif user_id is not None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user:
+            history = ChatHistory(
+                user_id=user_id,
                 question=message,
+                answer=answer,
                 timestamp=datetime.utcnow()
             )
-            db.add(unanswered)
+            db.add(history)
+
+def _save_unknown_question(message: str, db: Session):
+    """Lưu câu hỏi chưa có câu trả lời (chính xác)."""
+    if settings.CHAT_LOG_WRITE_BEHIND:
+        chat_log_writer.log_unknown(message)
+    else:
+        unanswered = UnknownQuestion(
+            question=message,
+            timestamp=datetime.utcnow()
+        )
+        db.add(unanswered)
+
+def _commit_logs(db: Session):
+    """Commit bản ghi lịch sử khi ghi đồng bộ (write-behind thì luồng nền tự commit)."""
+    if not settings.CHAT_LOG_WRITE_BEHIND:
+        db.commit()
+
+def _get_document(doc_id: int, db: Session):
+    """
+    (question, answer) của document: lấy từ kho đi kèm index (không truy vấn DB),
+    chỉ truy vấn DB khi không có trong kho.
+    """
+    row = get_document_text(doc_id)
+    if row is None:
+        doc = db.query(Document).get(int(doc_id))
+        if doc:
+            row = (doc.question, doc.answer)
+    return row
+
+def _answer_v1(message: str, db: Session):
+    """
+    Tìm câu trả lời v1 từ FAISS + Document.
+    Trả về (câu trả lời, có phải câu hỏi chưa có câu trả lời chính xác hay không).
+    """
+    # Các ngưỡng khoảng cách (hiệu chỉnh theo loại index)
+    THRESH_STRICT, THRESH_SUGGEST = get_distance_thresholds()
+
+    D, I = search_batcher.run(message)
+
+    # Trường hợp 1: Khớp hoàn toàn
+    if D[0][0] < THRESH_STRICT:
+        question, answer = _get_document(int(I[0][0]), db)
+        return answer.strip(), False
+    # Trường hợp 2: Khớp vừa phải
+    elif D[0][0] < THRESH_SUGGEST:
+        suggestions = []
+        for doc_id in I[0]:
+            if doc_id != -1:
+                row = _get_document(doc_id, db)
+                if row:
+                    suggestions.append(row[0])
+        answer = (
+            "Tôi chưa chắc chắn về câu hỏi của bạn. Bạn có muốn hỏi một trong các câu sau không?\n"
+            + "\n".join(f"- {q}" for q in suggestions)
+        )
+        return answer.strip(), True
+    # Trường hợp 3: Không phù hợp
+    else:
+        answer = "Chưa có dữ liệu được đào tạo liên quan câu hỏi của bạn. Câu hỏi của bạn đã được ghi nhận vào hệ thống." + \
+                "Vui lòng hỏi lại sau khi tôi được cập nhật thêm!" + \
+                "Trong khi đó, bạn có muốn biết thêm thông tin gì khác không?"
+        return answer.strip(), True
+
+# Câu trả lời khi không tìm được ngữ cảnh cho v2
+NO_CONTEXT_ANSWER = "Xin lỗi, tôi chưa có câu trả lời phù hợp."
+
+def _prompt_v2(message: str, db: Session):
+    """Prompt v2: câu hỏi kèm câu trả lời thô (top-1). None nếu không tìm được ngữ cảnh."""
+    # Tìm kiếm top-1 kết quả phù hợp nhất
+    k = 1
+    D, I = search_batcher.run(message)
+    D, I = D[:, :k], I[:, :k]
+
+    doc_context = None
+    for doc_id in I[0]:
+        if doc_id != -1:
+            row = _get_document(doc_id, db)
+            if row:
+                doc_context = row[1]
+                break
+
+    if not doc_context:
+        return None
+
+    # Sinh lại câu trả lời tự nhiên bằng ViT5 dựa trên câu hỏi và câu trả lời thô
+    return f"Câu hỏi: {message}\nCâu trả lời thô: {doc_context}\n Chỉ dựa vào câu trả lời thô được cung cấp, hãy diễn đạt lại câu trả lời cho tự nhiên:"
+
+def _prompt_v3(message: str):
+    return f"Câu hỏi: {message}\n Trả lời:"
+
+def _answer_v2(message: str, db: Session):
+    """Tìm câu trả lời thô (top-1) rồi diễn đạt lại bằng ViT5."""
+    input_text = _prompt_v2(message, db)
+    if input_text is None:
+        return NO_CONTEXT_ANSWER
+    return generate_answer("v2", input_text)
+
+def _answer_v3(message: str):
+    """Sinh câu trả lời trực tiếp từ mô hình đã fine-tune."""
+    return generate_answer("v3", _prompt_v3(message))
+
+def get_answer_from_documents_v1(user_id: int, message: str, db: Session):
+    try:
+        answer, unknown = cached_answer("v1", message, lambda: _answer_v1(message, db))
+
+        # Lưu câu hỏi chưa có câu trả lời (chính xác)
+        if unknown:
+            _save_unknown_question(message, db)
 
         # Lưu lịch sử chat
-        if user_id is not None:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                history = ChatHistory(
-                    user_id=user_id,
-                    question=message,
-                    answer=answer.strip(),
-                    timestamp=datetime.utcnow()
-                )
-                db.add(history)
-                
-        db.commit()
-        return answer.strip()
+        _save_chat_history(user_id, message, answer, db)
+        _commit_logs(db)
+        return answer
         
     except Exception as e:
         print(f"{str(e)}")
@@ -240,80 +362,108 @@ def get_answer_from_documents_v1(user_id: int, message: str, db: Session):
     
 
 def get_answer_from_documents_v2(user_id: int, message: str, db: Session):
-    global faiss_index, faiss_id_map, tokenizer, model
-
     try:
-        if faiss_index is None or faiss_id_map is None:
+        if get_faiss_index() is None:
             success = rebuild_faiss_index(db)
             if not success:
                 return "Chưa có dữ liệu được đào tạo liên quan câu hỏi của bạn. Vui lòng hỏi lại sau khi tôi được cập nhật thêm!"
-            faiss_index, faiss_id_map = load_faiss_index()
-
-        # Tìm kiếm top-1 kết quả phù hợp nhất
-        query_vec = embed_model.encode([message], convert_to_numpy=True)
-        k = 1
-        D, I = faiss_index.search(query_vec.astype('float32'), k)
-
-        answer = ""
-        doc_context = None
-        for idx in I[0]:
-            if idx < len(faiss_id_map):
-                doc_id = faiss_id_map[idx]
-                doc = db.query(Document).get(doc_id)
-                if doc:
-                    doc_context = doc.answer
-                    break
-
-        if not doc_context:
-            answer = "Xin lỗi, tôi chưa có câu trả lời phù hợp."
-        else:
-            # Sinh lại câu trả lời tự nhiên bằng ViT5 dựa trên câu hỏi và câu trả lời thô
-            input_text = f"Câu hỏi: {message}\nCâu trả lời thô: {doc_context}\n Chỉ dựa vào câu trả lời thô được cung cấp, hãy diễn đạt lại câu trả lời cho tự nhiên:"
-            input_ids = tokenizer.encode(input_text, return_tensors="pt", max_length=256, truncation=True)
-            output_ids = model.generate(input_ids, max_length=128, num_beams=4, early_stopping=True)
-            answer = tokenizer.decode(output_ids[0], skip_special_tokens=True)
+
+        answer = cached_answer("v2", message, lambda: _answer_v2(message, db))
 
         # Lưu lịch sử chat nếu có user_id hợp lệ
-        if user_id is not None:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                history = ChatHistory(
-                    user_id=user_id,
-                    question=message,
-                    answer=answer.strip(),
-                    timestamp=datetime.utcnow()
-                )
-                db.add(history)
-                db.commit()
-        
-        return answer.strip()
+        _save_chat_history(user_id, message, answer, db)
+        _commit_logs(db)
+        return answer
     except Exception as e:
         print(f"{str(e)}")
         return "Đã xảy ra lỗi khi tìm kiếm câu trả lời. Vui lòng thử lại sau."
     
 def get_answer_from_documents_v3(user_id: int, message: str, db: Session):
-    global faiss_index, faiss_id_map, tokenizer, model
     try: 
         # Sử dụng dữ liệu fine-tune, tìm câu trả lời
-        input_text = f"Câu hỏi: {message}\n Trả lời:"
-        input_ids = tokenizer.encode(input_text, return_tensors="pt", max_length=256, truncation=True)
-        output_ids = model.generate(input_ids, max_length=128, num_beams=4, early_stopping=True)
-        answer = tokenizer.decode(output_ids[0], skip_special_tokens=True)
+        answer = cached_answer("v3", message, lambda: _answer_v3(message))
 
         # Lưu lịch sử chat nếu có user_id hợp lệ
-        if user_id is not None:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                history = ChatHistory(
-                    user_id=user_id,
-                    question=message,
-                    answer=answer.strip(),
-                    timestamp=datetime.utcnow()
-                )
-                db.add(history)
-                db.commit()
-        
-        return answer.strip()
+        _save_chat_history(user_id, message, answer, db)
+        _commit_logs(db)
+        return answer
     except Exception as e:
         print(f"{str(e)}")
         return "Đã xảy ra lỗi khi tìm kiếm câu trả lời. Vui lòng thử lại sau."
+
+def stream_answer(route: str, user_id: int, message: str, db: Session):
+    """
+    Trả lời dạng streaming cho v2/v3, sinh ra các cặp (event, data):
+    ("token", đoạn text) ngay khi được sinh, ("done", {answer, ttft_ms, total_ms}) khi kết thúc,
+    hoặc ("error", thông báo). Câu trả lời đầy đủ được lưu lịch sử chat khi stream hoàn tất.
+    """
+    start = time.perf_counter()
+    ttft = None
+    completed = False
+    try:
+        # Streaming dùng giải mã greedy/sampling nên được cache riêng với câu trả lời beam search, theo từng profile.
+        # Profile lấy mẫu ngẫu nhiên (sample) không được cache: mỗi người dùng nhận một câu trả lời được sinh riêng
+        profile = settings.GEN_STREAM_PROFILE
+        cacheable = not STREAM_PROFILES.get(profile, {}).get("do_sample")
+        key = make_cache_key(f"{route}-stream-{profile}", message)
+        answer = answer_cache.get(key) if cacheable else None
+        prompt = None
+        if answer is None:
+            if route == "v2":
+                if get_faiss_index() is None and not rebuild_faiss_index(db):
+                    answer = "Chưa có dữ liệu được đào tạo liên quan câu hỏi của bạn. Vui lòng hỏi lại sau khi tôi được cập nhật thêm!"
+                else:
+                    prompt = _prompt_v2(message, db)
+                    answer = None if prompt else NO_CONTEXT_ANSWER
+            else:
+                prompt = _prompt_v3(message)
+
+        if answer is not None:
+            ttft = time.perf_counter() - start
+            yield "token", answer
+        else:
+            parts = []
+            for text in stream_generate(prompt):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(text)
+                yield "token", text
+            answer = "".join(parts).strip()
+            if cacheable:
+                answer_cache.put(key, answer)
+
+        total = time.perf_counter() - start
+        stream_stats.record(ttft if ttft is not None else total, total)
+        _save_chat_history(user_id, message, answer, db)
+        _commit_logs(db)
+        completed = True
+        yield "done", {"answer": answer, "ttft_ms": round((ttft or total) * 1000, 1), "total_ms": round(total * 1000, 1)}
+    except Exception as e:
+        print(f"{str(e)}")
+        yield "error", "Đã xảy ra lỗi khi tìm kiếm câu trả lời. Vui lòng thử lại sau."
+    finally:
+        if not completed:
+            # Client ngắt kết nối hoặc lỗi: không lưu câu trả lời dở dang
+            stream_stats.record_abort()
+
+def prewarm_answer_cache(db: Session, routes, limit: int):
+    """
+    Nạp trước cache câu trả lời từ các câu hỏi phổ biến nhất trong ChatHistory.
+    Không ghi lịch sử chat hay câu hỏi chưa trả lời. Dừng ở lỗi đầu tiên. Trả về số câu trả lời đã nạp.
+    """
+    compute = {
+        "v1": lambda message: _answer_v1(message, db),
+        "v2": lambda message: _answer_v2(message, db),
+        "v3": _answer_v3,
+    }
+    warmed = 0
+    for message in get_frequent_questions(db, limit):
+        for route in routes:
+            try:
+                cached_answer(route, message, lambda: compute[route](message))
+                warmed += 1
+            except Exception as e:
+                # Lỗi thường lặp lại với mọi câu hỏi (chưa có index, mô hình lỗi...): không thử tiếp
+                print(f"Lỗi nạp trước cache ({route}): {str(e)}")
+                return warmed
+    return warmed
@@ -0,0 +1,125 @@
+# app/services/dedup_service.py
+import faiss
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.document import Document
+from app.utils.helpers import question_hash
+
+# Cách xử lý câu hỏi trùng khi upload:
+# skip (bỏ dòng trùng), merge (câu trả lời mới thay cho câu trả lời đã có), report (vẫn thêm, chỉ liệt kê)
+DEDUP_POLICIES = ("skip", "merge", "report")
+
+# Số láng giềng xét khi tìm câu gần trùng giữa các dòng trong cùng một khối
+CHUNK_NEIGHBORS = 16
+
+
+class DocumentDeduplicator:
+    """
+    Lọc câu hỏi trùng khi import Document (gọi cho từng khối dòng trước khi ghi):
+    - trùng chính xác: cùng question_hash với Document đã có (kể cả các dòng vừa ghi của cùng file)
+      hoặc với dòng trước đó trong khối;
+    - gần trùng (khi near_distance > 0): khoảng cách embedding tới câu hỏi gần nhất trong FAISS index
+      đang phục vụ hoặc tới dòng trước đó trong cùng khối không vượt quá near_distance.
+    """
+
+    def __init__(self, policy: str = None, near_distance: float = None):
+        self.policy = (policy or settings.INGEST_DEDUP_POLICY).lower()
+        if self.policy not in DEDUP_POLICIES:
+            raise ValueError(f"Cách xử lý trùng không hợp lệ: {self.policy} (hỗ trợ: {', '.join(DEDUP_POLICIES)})")
+        self.near_distance = settings.INGEST_NEAR_DUP_DISTANCE if near_distance is None else near_distance
+        self._merges = {}
+
+    def _duplicate(self, report, line, values, kind, target, document_id=None, distance=None):
+        """Ghi nhận dòng trùng với target (dòng trong khối hoặc id Document). True nếu vẫn thêm dòng."""
+        report.duplicate(line, kind, document_id, distance)
+        if self.policy == "report":
+            return True
+        if self.policy == "merge":
+            report.merged += 1
+            if isinstance(target, dict):
+                target["answer"] = values["answer"]
+            else:
+                self._merges[target] = values["answer"]
+        return False
+
+    def _exact(self, db: Session, lines, rows, report):
+        hashes = {values["question_hash"] for values in rows}
+        existing = dict(
+            db.query(Document.question_hash, Document.id).filter(Document.question_hash.in_(hashes))
+        )
+        # accepted: (dòng, giá trị, đã bị ghi nhận trùng hay chưa)
+        accepted, pending = [], {}
+        for line, values in zip(lines, rows):
+            h = values["question_hash"]
+            if h in pending:
+                if not self._duplicate(report, line, values, "exact", pending[h]):
+                    continue
+            elif h in existing:
+                if not self._duplicate(report, line, values, "exact", existing[h], document_id=existing[h]):
+                    continue
+            else:
+                pending[h] = values
+                accepted.append((line, values, False))
+                continue
+            accepted.append((line, values, True))
+        return accepted
+
+    def _near(self, accepted, report):
+        from app.services.index_service import find_nearest_documents
+
+        vectors, distances, doc_ids = find_nearest_documents([values["question"] for _, values, _ in accepted])
+        # Láng giềng trong cùng khối (các dòng mới chưa có trong index)
+        chunk_index = faiss.IndexFlatL2(vectors.shape[1])
+        chunk_index.add(vectors)
+        D, I = chunk_index.search(vectors, min(CHUNK_NEIGHBORS, len(accepted)))
+
+        result, kept = [], set()
+        for i, (line, values, reported) in enumerate(accepted):
+            if reported:
+                # Trùng chính xác đã được ghi nhận (policy report): không ghi nhận lần nữa
+                result.append((line, values, True))
+                continue
+            local = next(
+                ((d, j) for d, j in zip(D[i], I[i]) if 0 <= j < i and j in kept and d <= self.near_distance),
+                None,
+            )
+            if doc_ids[i] >= 0 and distances[i] <= self.near_distance:
+                doc_id = int(doc_ids[i])
+                insert = self._duplicate(report, line, values, "near", doc_id, document_id=doc_id, distance=float(distances[i]))
+            elif local is not None:
+                target = accepted[local[1]][1]
+                insert = self._duplicate(report, line, values, "near", target, distance=float(local[0]))
+            else:
+                insert = True
+            if insert:
+                kept.add(i)
+                result.append((line, values, False))
+        return result
+
+    def _apply_merges(self, db: Session):
+        """Cập nhật câu trả lời của các Document bị gộp. Trả về các bộ (id, question, answer) cần cập nhật index."""
+        updated = []
+        for doc_id, answer in self._merges.items():
+            updated += db.execute(
+                update(Document)
+                .where(Document.id == doc_id)
+                .values(answer=answer)
+                .returning(Document.id, Document.question, Document.answer)
+            ).all()
+        self._merges.clear()
+        return [tuple(row) for row in updated]
+
+    def __call__(self, db: Session, lines, rows, report):
+        """
+        Lọc một khối dòng (dict question/answer, thêm question_hash).
+        Trả về (các dòng cần thêm, các bộ (id, question, answer) đã được cập nhật do gộp).
+        """
+        for values in rows:
+            values["question_hash"] = question_hash(values["question"])
+        accepted = self._exact(db, lines, rows, report)
+        if accepted and self.near_distance > 0:
+            accepted = self._near(accepted, report)
+        updated = self._apply_merges(db)
+        return [values for _, values, _ in accepted], updated
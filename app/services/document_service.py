@@ -1,22 +1,25 @@
 # app/services/document_service.py
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.models.document import Document
+from app.services.dedup_service import DocumentDeduplicator
+from app.services.ingest_service import ingest_file
 
-def create_documents_from_excel(df, db: Session):
+def ingest_documents(path: str, fmt: str, db: Session, dedup_policy: str = None, progress_callback=None):
     """
-    Tạo nhiều bản ghi Document từ DataFrame đọc được từ Excel.
+    Import Document từ file đã lưu tạm (Excel, CSV hoặc JSONL), đọc theo từng dòng và ghi theo khối.
     Cột đầu là question, cột thứ hai là answer.
+    Câu hỏi trùng (và gần trùng nếu bật INGEST_NEAR_DUP_DISTANCE) được xử lý theo dedup_policy
+    (mặc định INGEST_DEDUP_POLICY).
+    Trả về (IngestReport, danh sách (id, question, answer) đã ghi hoặc cập nhật,
+    None nếu vượt INGEST_INCREMENTAL_INDEX_LIMIT dòng).
     """
-    docs = []
-    for index, row in df.iterrows():
-        question = str(row[0]).strip()
-        answer = str(row[1]).strip()
-        if question and answer:
-            doc = Document(question=question, answer=answer)
-            db.add(doc)
-            docs.append(doc)
-    db.commit()
-    return docs
+    return ingest_file(
+        path, fmt, Document, ("question", "answer"), db,
+        keep_limit=settings.INGEST_INCREMENTAL_INDEX_LIMIT,
+        dedup=DocumentDeduplicator(dedup_policy),
+        progress_callback=progress_callback,
+    )
 
 def delete_document(doc_id: int, db: Session):
     doc = db.query(Document).get(doc_id)
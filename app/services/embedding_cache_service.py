@@ -0,0 +1,234 @@
+# app/services/embedding_cache_service.py
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá giữa các luồng trong tiến trình
+    fcntl = None
+
+import numpy as np
+
+from app.services.model_service import get_embed_model, get_embed_model_tag
+
+# Thư mục lưu cache vector (hash nội dung -> vector float32)
+EMBEDDING_CACHE_DIR = "data/embedding_cache"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+# Số segment tối đa trước khi gộp lại thành một
+MAX_SEGMENTS = 8
+
+
+def text_key(text: str) -> bytes:
+    """Khoá cache của một câu: sha1 của nội dung (đã bỏ khoảng trắng đầu/cuối)."""
+    return hashlib.sha1(text.strip().encode("utf-8")).digest()
+
+
+def _write_npy(path: Path, array):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class EmbeddingCache:
+    """
+    Cache vector embedding lưu trên đĩa, dùng chung cho rebuild index, phân cụm câu hỏi, các job batch.
+
+    - Mỗi segment gồm <tên>.keys.npy (uint8 N x 20, sha1) và <tên>.vectors.npy (float32 N x dim),
+      được nạp bằng memory-map nên không tốn RAM cho tới khi được đọc.
+    - meta.json ghi tên mô hình embedding, số chiều và danh sách segment hoàn chỉnh.
+      Khi mô hình embedding thay đổi, cache cũ tự động bị bỏ qua.
+    - Vector mới được giữ trong bộ nhớ cho tới khi gọi save(), mỗi lần save ghi thêm một segment.
+    """
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, max_segments: int = MAX_SEGMENTS):
+        self.cache_dir = Path(cache_dir)
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._model_tag = None
+        self.hits = 0
+        self.misses = 0
+
+    def _reset(self, model_tag):
+        self._model_tag = model_tag
+        self._dim = None
+        self._segment_names = []
+        self._segments = []         # danh sách mảng vector (memory-map)
+        self._rows = {}             # key -> (số thứ tự segment, dòng); segment -1 là vector chưa lưu
+        self._pending_keys = []
+        self._pending_vectors = []
+
+    def _ensure_loaded(self):
+        model_tag = get_embed_model_tag()
+        if self._model_tag == model_tag:
+            return
+        self._reset(model_tag)
+
+        try:
+            with open(self.cache_dir / META_FILE, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        if meta.get("model") != model_tag:
+            # Mô hình embedding đã đổi: bỏ qua toàn bộ cache cũ
+            return
+
+        self._dim = meta.get("dim")
+        for name in meta.get("segments", []):
+            try:
+                keys = np.load(self.cache_dir / f"{name}.keys.npy")
+                vectors = np.load(self.cache_dir / f"{name}.vectors.npy", mmap_mode="r")
+            except (OSError, ValueError):
+                continue
+            if len(keys) != len(vectors) or vectors.shape[1] != self._dim:
+                continue
+            seg_no = len(self._segments)
+            self._segment_names.append(name)
+            self._segments.append(vectors)
+            for row, key in enumerate(keys):
+                self._rows[key.tobytes()] = (seg_no, row)
+
+    def _vector(self, location):
+        seg_no, row = location
+        if seg_no == -1:
+            return self._pending_vectors[row]
+        return self._segments[seg_no][row]
+
+    def encode(self, texts, batch_size: int = 64, progress_callback=None):
+        """
+        Trả về ma trận float32 (len(texts) x dim), chỉ mã hoá các câu chưa có trong cache.
+        progress_callback(số câu đã mã hoá, tổng số câu cần mã hoá) được gọi sau mỗi batch.
+        """
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            self._ensure_loaded()
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            embed_model = get_embed_model()
+            miss_keys = list(missing)
+            miss_texts = list(missing.values())
+            encoded = []
+            for start in range(0, len(miss_texts), batch_size):
+                chunk = miss_texts[start:start + batch_size]
+                encoded.append(embed_model.encode(chunk, convert_to_numpy=True, batch_size=batch_size).astype("float32"))
+                if progress_callback:
+                    progress_callback(min(start + batch_size, len(miss_texts)), len(miss_texts))
+            new_vectors = np.concatenate(encoded)
+
+            with self._lock:
+                self._dim = new_vectors.shape[1]
+                for key, vector in zip(miss_keys, new_vectors):
+                    if key not in self._rows:
+                        self._rows[key] = (-1, len(self._pending_vectors))
+                        self._pending_keys.append(key)
+                        self._pending_vectors.append(vector)
+
+        with self._lock:
+            if not keys:
+                return np.empty((0, self._dim or 0), dtype="float32")
+            return np.stack([self._vector(self._rows[key]) for key in keys]).astype("float32", copy=False)
+
+    @contextmanager
+    def _file_lock(self):
+        """Khoá ghi cache giữa các tiến trình (các worker và tiến trình tác vụ dùng chung thư mục cache)."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self.cache_dir / META_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """
+        Ghi các vector mới thành một segment, gộp segment khi có quá nhiều.
+        meta.json được đọc lại trong khoá nên segment do tiến trình khác ghi thêm không bị mất.
+        """
+        with self._lock:
+            if self._model_tag is None or not self._pending_keys:
+                return
+            with self._file_lock():
+                name = f"seg_{time.time_ns()}"
+                keys = np.frombuffer(b"".join(self._pending_keys), dtype=np.uint8).reshape(-1, 20)
+                _write_npy(self.cache_dir / f"{name}.keys.npy", keys)
+                _write_npy(self.cache_dir / f"{name}.vectors.npy", np.stack(self._pending_vectors))
+
+                meta = self._read_meta()
+                if meta.get("model") == self._model_tag and meta.get("dim") == self._dim:
+                    self._write_meta(meta.get("segments", []) + [name])
+                else:
+                    # Cache trên đĩa là của mô hình khác (hoặc chưa có): thay bằng segment mới
+                    self._write_meta([name])
+                    self._remove_segments(meta.get("segments", []))
+                self._reload()
+                if len(self._segment_names) > self.max_segments:
+                    self._compact()
+
+    def _write_meta(self, segment_names):
+        meta = {"model": self._model_tag, "dim": self._dim, "segments": segment_names}
+        tmp = self.cache_dir / (META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.cache_dir / META_FILE)
+
+    def _reload(self):
+        # Nạp lại từ đĩa để các vector vừa ghi cũng được memory-map
+        self._model_tag = None
+        self._ensure_loaded()
+
+    def _compact(self):
+        """Gộp tất cả segment thành một segment duy nhất. Gọi trong _file_lock()."""
+        name = f"seg_{time.time_ns()}"
+        keys = np.empty((len(self._rows), 20), dtype=np.uint8)
+        vectors = np.empty((len(self._rows), self._dim), dtype="float32")
+        for i, (key, location) in enumerate(self._rows.items()):
+            keys[i] = np.frombuffer(key, dtype=np.uint8)
+            vectors[i] = self._vector(location)
+        _write_npy(self.cache_dir / f"{name}.keys.npy", keys)
+        _write_npy(self.cache_dir / f"{name}.vectors.npy", vectors)
+
+        compacted = list(self._segment_names)
+        self._write_meta([name])
+        self._reload()
+        self._remove_segments(compacted)
+
+    def _remove_segments(self, names):
+        """Xoá file của các segment vừa bị thay thế (đã gộp hoặc của mô hình cũ). Gọi trong _file_lock()."""
+        for name in names:
+            for suffix in (".keys.npy", ".vectors.npy"):
+                (self.cache_dir / f"{name}{suffix}").unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": self._model_tag,
+                "entries": len(self._rows) if self._model_tag else 0,
+                "segments": len(self._segment_names) if self._model_tag else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,145 @@
+# app/services/executor_service.py
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+
+
+class ExecutorSaturated(Exception):
+    """Executor hoặc route đã đầy, request bị từ chối ngay (không xếp hàng thêm)."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+def parse_route_limits(value: str) -> dict:
+    """'v1:64,v2:16' -> {'v1': 64, 'v2': 16}"""
+    limits = {}
+    for item in value.split(","):
+        if ":" in item:
+            route, limit = item.split(":", 1)
+            limits[route.strip()] = int(limit)
+    return limits
+
+
+class InferenceExecutor:
+    """
+    Executor riêng cho các tác vụ suy luận (chat), tách khỏi threadpool mặc định của Starlette.
+    - workers: số luồng xử lý; queue_size: số request được phép chờ thêm khi mọi luồng đang bận.
+    - route_limits: số request tối đa (đang chạy + đang chờ) cho từng route.
+    - torch_threads: số luồng intra-op của torch cho cả tiến trình (0 = giữ mặc định).
+    Khi đầy, request bị từ chối ngay với 503 (executor đầy) hoặc 429 (route đầy) kèm Retry-After.
+    """
+
+    def __init__(self, workers: int, queue_size: int, route_limits: dict, torch_threads: int = 0):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.route_limits = route_limits
+        self.torch_threads = torch_threads
+        self._init_state()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._route_in_flight = {route: 0 for route in self.route_limits}
+        self.completed = 0
+        self.rejected = 0
+        self._avg_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.torch_threads > 0:
+                        import torch
+                        torch.set_num_threads(self.torch_threads)
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        return self._executor
+
+    def _retry_after(self) -> int:
+        # Ước lượng thời gian để hàng đợi hiện tại được xử lý hết
+        seconds = self._avg_seconds * max(1, self._in_flight) / self.workers
+        return min(30, max(1, math.ceil(seconds)))
+
+    def _acquire(self, route: str):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise ExecutorSaturated(503, self._retry_after(), "Hệ thống đang quá tải, vui lòng thử lại sau.")
+            limit = self.route_limits.get(route)
+            if limit is not None and self._route_in_flight.get(route, 0) >= limit:
+                self.rejected += 1
+                raise ExecutorSaturated(429, self._retry_after(), "Quá nhiều yêu cầu, vui lòng thử lại sau.")
+            self._in_flight += 1
+            self._route_in_flight[route] = self._route_in_flight.get(route, 0) + 1
+
+    def _release(self, route: str, seconds: float):
+        with self._lock:
+            self._in_flight -= 1
+            self._route_in_flight[route] -= 1
+            self.completed += 1
+            # Trung bình trượt thời gian xử lý, dùng cho Retry-After
+            self._avg_seconds = seconds if self.completed == 1 else 0.9 * self._avg_seconds + 0.1 * seconds
+
+    def reserve(self, route: str):
+        """
+        Giữ một chỗ của executor cho tác vụ chạy ngoài thread pool (ví dụ streaming), từ chối ngay
+        (ExecutorSaturated) nếu đã đầy. Trả về hàm release() phải được gọi đúng một lần khi tác vụ kết thúc.
+        """
+        self._acquire(route)
+        start = time.perf_counter()
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._release(route, time.perf_counter() - start)
+        return release
+
+    async def run(self, route: str, fn, *args):
+        """
+        Chạy fn(*args) trên executor, từ chối ngay (ExecutorSaturated) nếu đã đầy.
+        Chỗ được trả khi fn thực sự kết thúc (hoặc bị huỷ khi còn trong hàng đợi), kể cả khi client đã ngắt kết nối.
+        """
+        self._acquire(route)
+        start = time.perf_counter()
+        try:
+            context = contextvars.copy_context()
+            future = self._get_executor().submit(context.run, fn, *args)
+        except BaseException:
+            self._release(route, time.perf_counter() - start)
+            raise
+        future.add_done_callback(lambda _: self._release(route, time.perf_counter() - start))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self._in_flight,
+                "route_in_flight": dict(self._route_in_flight),
+                "route_limits": dict(self.route_limits),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_ms": round(self._avg_seconds * 1000, 1),
+            }
+
+
+inference_executor = InferenceExecutor(
+    workers=settings.INFERENCE_WORKERS,
+    queue_size=settings.INFERENCE_QUEUE_SIZE,
+    route_limits=parse_route_limits(settings.INFERENCE_ROUTE_LIMITS),
+    torch_threads=settings.INFERENCE_TORCH_THREADS,
+)
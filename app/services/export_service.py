@@ -0,0 +1,121 @@
+# app/services/export_service.py
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+
+# Định dạng export hỗ trợ và media type tương ứng
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+# Thư mục lưu tạm file Excel trong lúc ghi (xlsx là file zip, chỉ gửi được khi đã ghi xong)
+EXPORT_DIR = "data/exports"
+
+# Kích thước mỗi phần dữ liệu gửi cho client
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def iter_rows(build_query):
+    """
+    Đọc kết quả truy vấn theo từng lô EXPORT_BATCH_SIZE dòng bằng server-side cursor (yield_per),
+    không nạp toàn bộ vào bộ nhớ. build_query(db) trả về truy vấn các cột cần export.
+    Dùng session riêng, giữ kết nối trong suốt quá trình gửi file.
+    """
+    db = SessionLocal()
+    try:
+        for row in build_query(db).execution_options(yield_per=settings.EXPORT_BATCH_SIZE):
+            yield tuple(_value(value) for value in row)
+    finally:
+        db.close()
+
+
+def _csv_stream(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM để Excel nhận đúng UTF-8
+    writer.writerow([label for _, label, _ in columns])
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _jsonl_stream(columns, rows):
+    keys = [key for key, _, _ in columns]
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(keys, row)), ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(lines).encode("utf-8")
+            lines, size = [], 0
+    yield "".join(lines).encode("utf-8")
+
+
+def _xlsx_stream(columns, rows, sheet_name: str):
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.utils import get_column_letter
+
+    # write_only: từng dòng được ghi ngay ra file tạm của openpyxl, không giữ cả sheet trong bộ nhớ
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    # Độ rộng cột cố định theo cột (không phải duyệt toàn bộ dữ liệu để tính)
+    for idx, (_, _, width) in enumerate(columns, start=1):
+        sheet.column_dimensions[get_column_letter(idx)].width = width
+    sheet.append([label for _, label, _ in columns])
+    for row in rows:
+        sheet.append([ILLEGAL_CHARACTERS_RE.sub("", value) if isinstance(value, str) else value for value in row])
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_stream(build_query, columns, fmt: str, sheet_name: str = "Sheet1"):
+    """
+    Nội dung file export (iterator các khối bytes) theo định dạng fmt.
+    columns: các bộ (khoá JSONL, tiêu đề cột, độ rộng cột Excel) theo thứ tự cột của truy vấn.
+    CSV/JSONL được gửi ngay khi đọc xong mỗi khối; Excel được ghi ra file tạm rồi gửi dần.
+    """
+    rows = iter_rows(build_query)
+    if fmt == "csv":
+        return _csv_stream(columns, rows)
+    if fmt == "jsonl":
+        return _jsonl_stream(columns, rows)
+    if fmt == "xlsx":
+        return _xlsx_stream(columns, rows, sheet_name)
+    raise ValueError(f"Định dạng export không hỗ trợ: {fmt}")
+
+
+def export_filename(prefix: str, fmt: str) -> str:
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
@@ -1,22 +1,16 @@
 # app/services/fine_tune_data_service.py
 from sqlalchemy.orm import Session
 from app.models.fine_tune_data import FineTuneData
+from app.services.ingest_service import ingest_file
 
-def create_documents_from_excel(df, db: Session):
+def ingest_documents(path: str, fmt: str, db: Session, progress_callback=None):
     """
-    Tạo nhiều bản ghi Document từ DataFrame đọc được từ Excel.
+    Import FineTuneData từ file đã lưu tạm (Excel, CSV hoặc JSONL), đọc theo từng dòng và ghi theo khối.
     Cột đầu là answer, cột thứ hai là target (mong muốn theo các ngữ cảnh).
+    Trả về IngestReport.
     """
-    docs = []
-    for index, row in df.iterrows():
-        answer = str(row[0]).strip()
-        target = str(row[1]).strip()
-        if answer and target:
-            doc = FineTuneData(answer=answer, target=target)
-            db.add(doc)
-            docs.append(doc)
-    db.commit()
-    return docs
+    report, _ = ingest_file(path, fmt, FineTuneData, ("answer", "target"), db, progress_callback=progress_callback)
+    return report
 
 def delete_document(doc_id: int, db: Session):
     doc = db.query(FineTuneData).get(doc_id)
@@ -0,0 +1,169 @@
+# app/services/fine_tune_dataset_service.py
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.fine_tune_data import FineTuneData
+
+# Dữ liệu fine-tune đã tokenize: token (int32) của các dòng nối liền (input_ids.bin, labels.bin), vị trí bắt đầu
+# của từng dòng (*_offsets.npy) và id FineTuneData (ids.npy), đọc bằng memory-map;
+# meta.json ghi dấu dữ liệu/tokenizer để biết khi nào cần tạo lại
+FINE_TUNE_DATASET_DIR = "data/fine_tune_dataset"
+DATASET_META_FILE = "meta.json"
+DATASET_FORMAT = 2
+
+# Trạng thái lần fine-tune gần nhất của checkpoint cũ ở FINE_TUNE_FILE (id FineTuneData lớn nhất đã huấn luyện...);
+# các phiên bản trong kho phiên bản lưu thông tin này trong model_meta.json
+TRAIN_STATE_FILE = "train_state.json"
+
+# Số dòng đọc và tokenize mỗi lần
+TOKENIZE_BATCH_SIZE = 1000
+
+
+def _iter_rows(db: Session):
+    """Đọc (id, answer, target) theo từng lô (keyset theo id)."""
+    last_id = 0
+    while True:
+        rows = (db.query(FineTuneData.id, FineTuneData.answer, FineTuneData.target)
+                .filter(FineTuneData.id > last_id)
+                .order_by(FineTuneData.id)
+                .limit(TOKENIZE_BATCH_SIZE)
+                .all())
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def _fingerprint(db: Session, tokenizer, max_length: int) -> str:
+    """Dấu của dữ liệu fine-tune và tokenizer: giống nhau thì dùng lại dataset đã tokenize."""
+    digest = hashlib.sha1()
+    digest.update(f"{DATASET_FORMAT}|{tokenizer.name_or_path}|{len(tokenizer)}|{max_length}".encode("utf-8"))
+    for rows in _iter_rows(db):
+        for row in rows:
+            digest.update(f"{row.id}\x00{row.answer}\x00{row.target}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _read_meta(directory: str):
+    try:
+        with open(os.path.join(directory, DATASET_META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_tokenized_dataset(db: Session, tokenizer, max_length: int = None, directory: str = FINE_TUNE_DATASET_DIR):
+    """
+    Tokenize toàn bộ FineTuneData một lần (không pad) và lưu dạng memory-map.
+    Dùng lại dataset đã có nếu dữ liệu và tokenizer không đổi. Trả về meta của dataset (None nếu không có dữ liệu).
+    """
+    max_length = max_length or settings.FINE_TUNE_MAX_LENGTH
+    fingerprint = _fingerprint(db, tokenizer, max_length)
+    meta = _read_meta(directory)
+    if meta and meta.get("fingerprint") == fingerprint:
+        return meta
+
+    start = time.perf_counter()
+    tmp_dir = directory.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Tokenize theo lô (không pad), ghi nối tiếp ra file: không giữ toàn bộ token trong bộ nhớ
+    lengths = {"input_ids": [], "labels": []}
+    row_ids = []
+    files = {name: open(os.path.join(tmp_dir, f"{name}.bin"), "wb") for name in lengths}
+    try:
+        for rows in _iter_rows(db):
+            encoded = {
+                "input_ids": tokenizer([row.answer for row in rows], truncation=True, max_length=max_length)["input_ids"],
+                "labels": tokenizer(text_target=[row.target for row in rows], truncation=True, max_length=max_length)["input_ids"],
+            }
+            row_ids.extend(row.id for row in rows)
+            for name, sequences in encoded.items():
+                for ids in sequences:
+                    files[name].write(np.asarray(ids, dtype="int32").tobytes())
+                    lengths[name].append(len(ids))
+    finally:
+        for f in files.values():
+            f.close()
+    if not lengths["input_ids"]:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    for name, values in lengths.items():
+        np.save(os.path.join(tmp_dir, f"{name}_offsets.npy"), np.concatenate([[0], np.cumsum(values)]).astype("int64"))
+    np.save(os.path.join(tmp_dir, "ids.npy"), np.asarray(row_ids, dtype="int64"))
+
+    meta = {
+        "fingerprint": fingerprint,
+        "rows": len(row_ids),
+        "last_row_id": int(max(row_ids)),
+        "max_length": max_length,
+        "input_tokens": int(sum(lengths["input_ids"])),
+        "label_tokens": int(sum(lengths["labels"])),
+        "tokenize_seconds": round(time.perf_counter() - start, 2),
+    }
+    with open(os.path.join(tmp_dir, DATASET_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return meta
+
+
+def read_train_state(checkpoint_dir: str):
+    """Trạng thái lần fine-tune gần nhất lưu cùng checkpoint cũ (None nếu chưa có)."""
+    try:
+        with open(os.path.join(checkpoint_dir, TRAIN_STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def select_incremental_rows(directory: str, last_row_id: int, replay_ratio: float, seed: int = None):
+    """
+    Vị trí các dòng cho fine-tune tăng dần: mọi dòng có id > last_row_id (dữ liệu mới) cộng một mẫu ngẫu nhiên
+    replay_ratio * số dòng mới từ dữ liệu cũ (replay, tránh mô hình quên dữ liệu đã học).
+    Trả về (positions, số dòng mới, số dòng replay).
+    """
+    ids = np.load(os.path.join(directory, "ids.npy"))
+    new_positions = np.flatnonzero(ids > last_row_id)
+    old_positions = np.flatnonzero(ids <= last_row_id)
+    replay_count = min(len(old_positions), int(np.ceil(len(new_positions) * replay_ratio)))
+    replay_positions = np.random.default_rng(seed).choice(old_positions, size=replay_count, replace=False)
+    positions = np.sort(np.concatenate([new_positions, replay_positions]))
+    return positions, len(new_positions), replay_count
+
+
+class TokenizedSeq2SeqDataset:
+    """
+    Dataset cho Trainer đọc từ dữ liệu đã tokenize (memory-map, không tokenize lại mỗi epoch).
+    Mỗi phần tử chưa pad; DataCollatorForSeq2Seq pad theo dòng dài nhất của batch và đặt -100 cho nhãn pad.
+    positions: chỉ dùng các dòng ở các vị trí này (fine-tune tăng dần), mặc định toàn bộ.
+    """
+
+    def __init__(self, directory: str = FINE_TUNE_DATASET_DIR, positions=None):
+        self.input_ids = np.memmap(os.path.join(directory, "input_ids.bin"), dtype="int32", mode="r")
+        self.input_offsets = np.load(os.path.join(directory, "input_ids_offsets.npy"))
+        self.labels = np.memmap(os.path.join(directory, "labels.bin"), dtype="int32", mode="r")
+        self.label_offsets = np.load(os.path.join(directory, "labels_offsets.npy"))
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions) if self.positions is not None else len(self.input_offsets) - 1
+
+    def __getitem__(self, idx):
+        if self.positions is not None:
+            idx = int(self.positions[idx])
+        input_ids = self.input_ids[self.input_offsets[idx]:self.input_offsets[idx + 1]].tolist()
+        return {
+            "input_ids": input_ids,
+            "attention_mask": [1] * len(input_ids),
+            "labels": self.labels[self.label_offsets[idx]:self.label_offsets[idx + 1]].tolist(),
+        }
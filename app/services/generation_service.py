@@ -0,0 +1,342 @@
+# app/services/generation_service.py
+import functools
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá giữa các luồng trong tiến trình
+    fcntl = None
+
+from app.core.config import settings
+from app.services.model_registry_service import maybe_reload, resolve_version
+from app.services.model_service import get_generator
+from app.utils.batching import MicroBatcher
+
+# Backend sinh câu trả lời: torch (fp32), torch-int8 (lượng tử hoá động Linear), onnx (ONNX Runtime, có KV cache)
+GEN_BACKENDS = ("torch", "torch-int8", "onnx")
+
+# Thư mục lưu ViT5 đã export sang ONNX (encoder, decoder, decoder with past), mỗi mô hình nguồn
+# (checkpoint + adapter LoRA) một thư mục con theo khoá của nguồn
+ONNX_GENERATOR_DIR = "data/onnx_generator/"
+ONNX_LOCK_FILE = "data/onnx_generator/.lock"
+ONNX_SOURCE_FILE = "source.json"
+# Số bản export được giữ lại (phiên bản đang phục vụ và phiên bản trước đó)
+ONNX_KEEP_EXPORTS = 2
+
+_onnx_lock = threading.Lock()
+
+# Các profile giải mã. beam4 giữ nguyên cấu hình cũ (max_length=128)
+DECODING_PROFILES = {
+    "greedy": {"num_beams": 1, "max_length": 128},
+    "beam2": {"num_beams": 2, "max_length": 128, "early_stopping": True},
+    "beam4": {"num_beams": 4, "max_length": 128, "early_stopping": True},
+}
+
+# Profile giải mã khi streaming (chỉ hỗ trợ num_beams=1: mỗi bước sinh đúng một token)
+STREAM_PROFILES = {
+    "greedy": {"num_beams": 1, "max_new_tokens": 128},
+    "sample": {"num_beams": 1, "do_sample": True, "top_p": 0.9, "temperature": 0.7, "max_new_tokens": 128},
+}
+
+# Độ dài tối đa của prompt (token)
+MAX_INPUT_LENGTH = 256
+# Thời gian chờ tối đa giữa hai token khi streaming (giây)
+STREAM_TOKEN_TIMEOUT = 60
+
+
+def generator_source() -> str:
+    """Mô hình nền của phiên bản đang phục vụ trong kho phiên bản (checkpoint fine-tune nếu có, ngược lại là mô hình gốc)."""
+    return resolve_version()[0]
+
+
+def _source_stamp(source: str, names=("model.safetensors", "pytorch_model.bin")):
+    # Thời điểm sửa file trọng số: checkpoint fine-tune thay đổi thì phải export lại ONNX
+    for name in names:
+        path = Path(source) / name
+        if path.exists():
+            return path.stat().st_mtime_ns
+    return None
+
+
+@contextmanager
+def _onnx_export_lock():
+    """Khoá export ONNX giữa các luồng và giữa các worker (flock trên ONNX_GENERATOR_DIR/.lock)."""
+    with _onnx_lock:
+        os.makedirs(ONNX_GENERATOR_DIR, exist_ok=True)
+        with open(ONNX_LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _export_onnx(source: str, adapter: str, tmp_dir: str):
+    """Export ViT5 (đã gộp adapter LoRA nếu có) sang ONNX vào tmp_dir."""
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    if adapter:
+        # ONNX không chạy được adapter riêng: gộp adapter vào trọng số nền rồi export bản đã gộp
+        from peft import PeftModel
+        from transformers import AutoModelForSeq2SeqLM
+
+        merged_dir = os.path.join(tmp_dir, "merged")
+        model = PeftModel.from_pretrained(AutoModelForSeq2SeqLM.from_pretrained(source), adapter).merge_and_unload()
+        model.save_pretrained(merged_dir)
+        del model
+        source = merged_dir
+    model = ORTModelForSeq2SeqLM.from_pretrained(source, export=True, use_cache=True)
+    model.save_pretrained(tmp_dir)
+    if adapter:
+        shutil.rmtree(source, ignore_errors=True)
+
+
+def _prune_onnx_exports(keep: str):
+    """Xoá các bản export cũ (giữ ONNX_KEEP_EXPORTS bản gần nhất) và thư mục tạm còn sót. Gọi trong _onnx_export_lock()."""
+    entries = [entry for entry in os.scandir(ONNX_GENERATOR_DIR) if entry.is_dir() and entry.name != keep]
+    stale = [entry for entry in entries if ".tmp-" in entry.name]
+    exports = sorted((entry for entry in entries if ".tmp-" not in entry.name), key=lambda entry: entry.stat().st_mtime)
+    for entry in stale + exports[:max(0, len(exports) - (ONNX_KEEP_EXPORTS - 1))]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _load_onnx_generator(source: str, adapter: str = None):
+    """
+    ViT5 chạy bằng ONNX Runtime qua optimum. Mỗi mô hình nguồn (checkpoint, adapter LoRA được gộp vào) được export
+    một lần vào thư mục riêng: ghi vào thư mục tạm trong khoá rồi đổi tên, worker khác không đọc phải bản export dở.
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    marker = {
+        "source": source, "stamp": _source_stamp(source),
+        "adapter": adapter, "adapter_stamp": _source_stamp(adapter, ("adapter_model.safetensors", "adapter_model.bin")) if adapter else None,
+    }
+    key = hashlib.sha1(json.dumps(marker, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    export_dir = os.path.join(ONNX_GENERATOR_DIR, key)
+
+    if not os.path.exists(os.path.join(export_dir, ONNX_SOURCE_FILE)):
+        with _onnx_export_lock():
+            # Worker khác có thể đã export xong trong lúc chờ khoá
+            if not os.path.exists(os.path.join(export_dir, ONNX_SOURCE_FILE)):
+                print(f"Export ViT5 sang ONNX ({source}{f' + {adapter}' if adapter else ''} -> {export_dir})")
+                tmp_dir = f"{export_dir}.tmp-{uuid.uuid4().hex[:8]}"
+                try:
+                    _export_onnx(source, adapter, tmp_dir)
+                    with open(os.path.join(tmp_dir, ONNX_SOURCE_FILE), "w", encoding="utf-8") as f:
+                        json.dump(marker, f)
+                    os.rename(tmp_dir, export_dir)
+                except Exception:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    raise
+                _prune_onnx_exports(keep=key)
+    return ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+
+
+def load_generator(backend: str = None, source: str = None, adapter: str = None):
+    """
+    Nạp (tokenizer, model) ViT5 theo backend (mặc định GEN_BACKEND) từ source và adapter LoRA
+    (mặc định: phiên bản đang phục vụ).
+    """
+    from transformers import AutoTokenizer
+
+    backend = (backend or settings.GEN_BACKEND).lower()
+    if backend not in GEN_BACKENDS:
+        raise ValueError(f"GEN_BACKEND không hợp lệ: {backend} (hỗ trợ: {', '.join(GEN_BACKENDS)})")
+    if source is None:
+        source, adapter = resolve_version()
+    tokenizer = AutoTokenizer.from_pretrained(source)
+
+    if backend == "onnx":
+        return tokenizer, _load_onnx_generator(source, adapter)
+
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(source)
+    if adapter:
+        # Gộp adapter vào trọng số khi nạp: tốc độ sinh như mô hình thường
+        from peft import PeftModel
+        model = PeftModel.from_pretrained(model, adapter).merge_and_unload()
+    if backend == "torch-int8":
+        # Trọng số các lớp Linear lưu int8, activation lượng tử hoá lúc chạy (chỉ CPU)
+        model = torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+def parse_route_profiles(value: str) -> dict:
+    """
+    'v2:beam2:96,v3:greedy' -> {'v2': {...beam2, max_new_tokens: 96}, 'v3': {...greedy}}
+    Số thứ ba (tuỳ chọn) là max_new_tokens, thay cho max_length của profile.
+    """
+    profiles = {}
+    for item in value.split(","):
+        parts = [part.strip() for part in item.split(":")]
+        if len(parts) < 2:
+            continue
+        route, name = parts[0], parts[1]
+        if name not in DECODING_PROFILES:
+            raise ValueError(f"Profile giải mã không hợp lệ: {name} (hỗ trợ: {', '.join(DECODING_PROFILES)})")
+        profile = dict(DECODING_PROFILES[name])
+        if len(parts) > 2 and parts[2]:
+            profile.pop("max_length", None)
+            profile["max_new_tokens"] = int(parts[2])
+        profiles[route] = profile
+    return profiles
+
+
+ROUTE_PROFILES = parse_route_profiles(settings.GEN_ROUTE_PROFILES)
+
+
+def generate(tokenizer, model, prompts, profile: dict):
+    """Sinh câu trả lời cho một batch prompt (pad về cùng độ dài) bằng một lần gọi model.generate."""
+    import torch
+
+    enc = tokenizer(prompts, return_tensors="pt", padding=True, max_length=MAX_INPUT_LENGTH, truncation=True)
+    with torch.no_grad():
+        output_ids = model.generate(enc.input_ids, attention_mask=enc.attention_mask, **profile)
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def _generate_batch(prompts, profile):
+    maybe_reload()
+    tokenizer, model = get_generator()
+    return generate(tokenizer, model, prompts, profile)
+
+
+# Mỗi profile giải mã một bộ gom batch (chỉ gom các prompt có cùng tham số generate)
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _profile_key(profile: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in sorted(profile.items()))
+
+
+def get_route_profile(route: str) -> dict:
+    return ROUTE_PROFILES.get(route, DECODING_PROFILES["beam4"])
+
+
+def get_generation_batcher(route: str) -> MicroBatcher:
+    profile = get_route_profile(route)
+    key = _profile_key(profile)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(key)
+            if batcher is None:
+                batcher = MicroBatcher(
+                    functools.partial(_generate_batch, profile=profile),
+                    max_batch_size=settings.GEN_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.GEN_BATCH_WAIT_MS,
+                    name=f"generation-batcher[{key}]",
+                )
+                _batchers[key] = batcher
+    return batcher
+
+
+def generate_answer(route: str, prompt: str) -> str:
+    """Sinh câu trả lời cho một prompt theo profile giải mã của route (được gom batch với các request khác)."""
+    return get_generation_batcher(route).run(prompt).strip()
+
+
+def stream_generate(prompt: str):
+    """
+    Sinh câu trả lời cho một prompt theo profile GEN_STREAM_PROFILE, trả về iterator các đoạn text
+    ngay khi được sinh (model.generate chạy ở luồng riêng). Đóng iterator sớm (client ngắt kết nối)
+    sẽ dừng quá trình sinh ở bước tiếp theo.
+    """
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+    if settings.GEN_STREAM_PROFILE not in STREAM_PROFILES:
+        raise ValueError(f"GEN_STREAM_PROFILE không hợp lệ: {settings.GEN_STREAM_PROFILE} (hỗ trợ: {', '.join(STREAM_PROFILES)})")
+    maybe_reload()
+    tokenizer, model = get_generator()
+    streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT)
+    stop = threading.Event()
+    errors = []
+
+    class StopOnDisconnect(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return stop.is_set()
+
+    enc = tokenizer([prompt], return_tensors="pt", max_length=MAX_INPUT_LENGTH, truncation=True)
+
+    def run():
+        try:
+            with torch.no_grad():
+                model.generate(
+                    enc.input_ids,
+                    attention_mask=enc.attention_mask,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([StopOnDisconnect()]),
+                    **STREAM_PROFILES[settings.GEN_STREAM_PROFILE],
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    threading.Thread(target=run, name="generation-stream", daemon=True).start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+
+class StreamStats:
+    """Thời gian tới token đầu tiên (TTFT) và tổng thời gian của các lượt trả lời streaming gần nhất."""
+
+    def __init__(self, window: int = 1000):
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.aborted = 0
+
+    def record(self, ttft: float, total: float):
+        with self._lock:
+            self._ttft.append(ttft)
+            self._total.append(total)
+            self.completed += 1
+
+    def record_abort(self):
+        with self._lock:
+            self.aborted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            ttft, total = list(self._ttft), list(self._total)
+        result = {"completed": self.completed, "aborted": self.aborted}
+        for name, values in (("ttft", ttft), ("total", total)):
+            if values:
+                result[f"{name}_ms_p50"] = round(float(np.percentile(values, 50)) * 1000, 1)
+                result[f"{name}_ms_p95"] = round(float(np.percentile(values, 95)) * 1000, 1)
+        return result
+
+
+stream_stats = StreamStats()
+
+
+def get_generation_stats() -> dict:
+    return {
+        "backend": settings.GEN_BACKEND,
+        "route_profiles": {route: _profile_key(profile) for route, profile in ROUTE_PROFILES.items()},
+        "batchers": {key: batcher.stats() for key, batcher in _batchers.items()},
+        "streaming": {"profile": settings.GEN_STREAM_PROFILE, **stream_stats.stats()},
+    }
@@ -0,0 +1,690 @@
+# app/services/index_service.py
+import json
+import math
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá giữa các luồng trong tiến trình
+    fcntl = None
+
+import faiss
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.document import Document
+from app.services.answer_store_service import AnswerStore, link_store_files, remove_store_files
+from app.services.embedding_cache_service import embedding_cache
+
+# Thư mục lưu FAISS index: mỗi lần build/cập nhật tạo một phiên bản versions/<version_id>/
+# (faiss.index, index_meta.json và kho câu trả lời); CURRENT chứa version_id đang phục vụ
+INDEX_DIR = "data/faiss_index"
+VERSIONS_DIR = "data/faiss_index/versions"
+CURRENT_FILE = "data/faiss_index/CURRENT"
+LOCK_FILE = "data/faiss_index/.lock"
+INDEX_FILE_NAME = "faiss.index"
+# Thông tin đi kèm index (loại index, độ lệch khoảng cách do nén vector, build_id)
+INDEX_META_FILE_NAME = "index_meta.json"
+# Index định dạng cũ nằm trực tiếp trong INDEX_DIR (chỉ đọc, được thay bằng phiên bản ở lần ghi đầu tiên)
+LEGACY_INDEX_FILE = "data/faiss_index/faiss.index"
+LEGACY_INDEX_META_FILE = "data/faiss_index/index_meta.json"
+# Mapping vị trí -> document id của index định dạng cũ (IndexFlatL2)
+MAPPING_FILE = "data/faiss_index/mapping.pkl"
+
+# Các loại index hỗ trợ
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# Khoá cho các thao tác ghi index (tìm kiếm dùng snapshot bất biến, không cần khoá)
+_index_lock = threading.RLock()
+# Tránh nhiều luồng cùng nạp lại phiên bản do worker khác kích hoạt
+_reload_lock = threading.Lock()
+
+
+def _pq_subquantizers(dim: int, m: int) -> int:
+    # Số sub-quantizer phải chia hết số chiều vector
+    while m > 1 and dim % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors, ids, index_type: str = None, nlist: int = None, hnsw_m: int = None, pq_m: int = None):
+    """
+    Tạo index theo loại cấu hình (FAISS_INDEX_TYPE) từ ma trận vector và document id tương ứng.
+    - flat: quét toàn bộ (chính xác), ivf: IVF-Flat, hnsw: đồ thị HNSW, ivfpq: IVF + nén Product Quantization.
+    Khi dữ liệu quá ít để huấn luyện IVF, dùng flat.
+    Trả về (index, meta), meta gồm loại index và độ lệch khoảng cách (distance_offset) dùng để hiệu chỉnh ngưỡng.
+    """
+    index_type = (index_type or settings.FAISS_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"FAISS_INDEX_TYPE không hợp lệ: {index_type} (hỗ trợ: {', '.join(INDEX_TYPES)})")
+    n, dim = vectors.shape
+    ids = np.asarray(ids, dtype='int64')
+
+    if index_type in ("ivf", "ivfpq"):
+        # Mặc định khoảng 4*sqrt(N) centroid, mỗi centroid cần ít nhất ~39 vector để huấn luyện
+        nlist = min(nlist or settings.FAISS_NLIST or int(4 * math.sqrt(n)), n // 39)
+        if nlist < 1:
+            index_type = "flat"
+    meta = {"type": index_type, "distance_offset": 0.0}
+
+    if index_type == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+    elif index_type == "ivfpq":
+        m = _pq_subquantizers(dim, pq_m or settings.FAISS_PQ_M)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, m, settings.FAISS_PQ_NBITS)
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m or settings.FAISS_HNSW_M)
+        hnsw.hnsw.efConstruction = settings.FAISS_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+    if not index.is_trained:
+        # Huấn luyện centroid trên một mẫu ngẫu nhiên (tối đa 256 vector mỗi centroid)
+        sample_size = min(n, nlist * 256)
+        index.train(vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)])
+
+    index.add_with_ids(vectors, ids)
+
+    if index_type == "ivfpq":
+        # Khoảng cách PQ xấp xỉ ||x - q(y)||^2 ≈ ||x - y||^2 + ||y - q(y)||^2,
+        # nên ngưỡng khoảng cách được cộng thêm sai số nén trung bình
+        sample = vectors[:min(n, 2000)]
+        decoded = index.sa_decode(index.sa_encode(sample))
+        meta["distance_offset"] = float(np.mean(np.sum((sample - decoded) ** 2, axis=1)))
+
+    set_search_params(index)
+    return index, meta
+
+
+def _base_index(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Áp dụng tham số tìm kiếm: nprobe cho IVF, efSearch cho HNSW."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe or settings.FAISS_NPROBE
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search or settings.FAISS_EF_SEARCH
+
+
+def _supports_remove(index) -> bool:
+    return not isinstance(_base_index(index), faiss.IndexHNSW)
+
+
+def _rebuild_without(index, remove_ids):
+    """
+    HNSW không hỗ trợ xoá vector: tạo lại đồ thị từ các vector còn lại (lấy từ chính index,
+    không cần mã hoá lại). Trả về (index mới hoặc None nếu không còn vector, số vector đã xoá).
+    """
+    ids = faiss.vector_to_array(index.id_map)
+    keep = ~np.isin(ids, remove_ids)
+    removed = int(len(ids) - keep.sum())
+    if not removed:
+        return index, 0
+    if not keep.any():
+        return None, removed
+    vectors = np.vstack([index.index.reconstruct(int(i)) for i in np.nonzero(keep)[0]])
+    new_index, _ = build_index(vectors, ids[keep], index_type="hnsw")
+    return new_index, removed
+
+
+def _read_index(path):
+    # Memory-map (FAISS_MMAP): các worker cùng máy dùng chung trang nhớ của file index qua page cache
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP if settings.FAISS_MMAP else 0)
+
+
+def load_faiss_index(directory: str = INDEX_DIR):
+    """
+    Nạp index và thông tin đi kèm từ thư mục (một phiên bản, hoặc INDEX_DIR với index định dạng cũ).
+    Kết quả tìm kiếm trả về trực tiếp document id.
+    Index định dạng cũ (IndexFlatL2 + mapping.pkl theo vị trí) được chuyển sang IDMap
+    bằng các vector đã lưu sẵn trong index, không cần mã hoá lại.
+    """
+    try:
+        index = _read_index(os.path.join(directory, INDEX_FILE_NAME))
+    except Exception as e:
+        return None, {}
+
+    try:
+        with open(os.path.join(directory, INDEX_META_FILE_NAME), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {"type": "flat", "distance_offset": 0.0}
+
+    if not isinstance(index, faiss.IndexIDMap) and faiss.try_extract_index_ivf(index) is None:
+        try:
+            with open(MAPPING_FILE, 'rb') as f:
+                id_map = pickle.load(f)
+            vectors = index.reconstruct_n(0, index.ntotal)
+            converted = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+            converted.add_with_ids(vectors, np.asarray(id_map, dtype='int64'))
+            index = converted
+        except Exception as e:
+            return None, {}
+
+    set_search_params(index)
+    return index, meta
+
+
+class IndexSnapshot:
+    """
+    Một phiên bản index đang phục vụ: FAISS index, thông tin đi kèm và kho câu trả lời.
+    Không bị sửa sau khi được đưa vào phục vụ; mọi thay đổi tạo snapshot mới và thay thế
+    bằng một phép gán tham chiếu, các lượt tìm kiếm đang chạy dùng tiếp snapshot cũ.
+    """
+
+    def __init__(self, index=None, meta=None, store=None, version_id=None, directory=INDEX_DIR):
+        self.index = index
+        self.meta = meta or {}
+        self.store = store if store is not None else AnswerStore(directory)
+        self.version_id = version_id
+        self.directory = directory
+
+
+def _version_dir(version_id: str) -> str:
+    return os.path.join(VERSIONS_DIR, version_id)
+
+
+def _read_current():
+    try:
+        with open(CURRENT_FILE, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_current(version_id: str):
+    # Ghi file tạm rồi đổi tên: các worker khác luôn đọc được một phiên bản hoàn chỉnh
+    tmp = CURRENT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version_id)
+    os.replace(tmp, CURRENT_FILE)
+
+
+def _load_snapshot(version_id=None):
+    """Nạp phiên bản version_id, hoặc index định dạng cũ nằm trực tiếp trong INDEX_DIR nếu version_id là None."""
+    directory = _version_dir(version_id) if version_id else INDEX_DIR
+    index, meta = load_faiss_index(directory)
+    if index is None:
+        return IndexSnapshot(version_id=version_id, directory=directory)
+    store = AnswerStore.load(directory, meta.get("build_id"))
+    return IndexSnapshot(index, meta, store, version_id, directory)
+
+
+_snapshot = _load_snapshot(_read_current())
+_last_reload_check = time.monotonic()
+
+# Phiên bản index trong tiến trình, tăng mỗi khi index thay đổi (dùng để vô hiệu hoá cache câu trả lời)
+index_version = 0
+
+
+def get_faiss_index():
+    return _snapshot.index
+
+
+def get_index_version():
+    return index_version
+
+
+def get_index_stats():
+    """Thông tin index đang phục vụ và kho câu trả lời đi kèm."""
+    snapshot = _snapshot
+    return {
+        "version": index_version,
+        "version_id": snapshot.version_id,
+        "type": snapshot.meta.get("type"),
+        "build_id": snapshot.meta.get("build_id"),
+        "vectors": snapshot.index.ntotal if snapshot.index is not None else 0,
+        "answer_store": snapshot.store.stats(),
+    }
+
+
+def get_document_text(doc_id: int):
+    """(question, answer) của document từ kho đi kèm index, None nếu không có (cần truy vấn DB)."""
+    return _snapshot.store.get(doc_id)
+
+
+def get_distance_thresholds():
+    """
+    Ngưỡng khoảng cách (khớp hoàn toàn, gợi ý) cho index hiện tại.
+    Ngưỡng gốc THRESH_STRICT/THRESH_SUGGEST áp dụng cho khoảng cách L2 chính xác (flat, ivf, hnsw);
+    với ivfpq được cộng thêm sai số nén đo lúc build.
+    """
+    offset = _snapshot.meta.get("distance_offset", 0.0)
+    return settings.THRESH_STRICT + offset, settings.THRESH_SUGGEST + offset
+
+
+def _swap(snapshot):
+    global _snapshot, index_version
+    _snapshot = snapshot
+    index_version += 1
+
+
+@contextmanager
+def _write_lock():
+    """
+    Khoá ghi index: giữa các luồng (RLock) và giữa các tiến trình/worker (flock trên INDEX_DIR/.lock).
+    Tìm kiếm không cần khoá. Không gọi lồng nhau (flock trên file mở lại sẽ tự chặn chính tiến trình).
+    """
+    with _index_lock:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Luôn áp dụng thay đổi lên phiên bản mới nhất (có thể do worker khác tạo)
+                if _read_current() != _snapshot.version_id:
+                    _reload_current()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _reload_current():
+    version_id = _read_current()
+    if version_id is None:
+        _swap(_load_snapshot(None) if _snapshot.version_id is not None else IndexSnapshot())
+        return
+    snapshot = _load_snapshot(version_id)
+    if snapshot.index is not None:
+        _swap(snapshot)
+
+
+def _maybe_reload():
+    """Chuyển sang phiên bản index do worker/tiến trình khác kích hoạt (kiểm tra tối đa mỗi FAISS_RELOAD_CHECK_SECONDS)."""
+    global _last_reload_check
+
+    now = time.monotonic()
+    if now - _last_reload_check < settings.FAISS_RELOAD_CHECK_SECONDS:
+        return
+    _last_reload_check = now
+    if _read_current() == _snapshot.version_id or not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        _reload_current()
+    finally:
+        _reload_lock.release()
+
+
+def _verify(snapshot, expected_total: int, probe_ids=None, probe_vectors=None):
+    """Kiểm tra phiên bản vừa ghi trước khi đưa vào phục vụ."""
+    if snapshot.index is None:
+        raise RuntimeError("Không đọc lại được FAISS index vừa ghi.")
+    if snapshot.index.ntotal != expected_total:
+        raise RuntimeError(f"FAISS index có {snapshot.index.ntotal} vector, cần {expected_total}.")
+    if probe_vectors is not None and len(probe_vectors):
+        _, I = snapshot.index.search(probe_vectors, 1)
+        if (I[:, 0] < 0).any():
+            raise RuntimeError("FAISS index vừa ghi không trả về kết quả tìm kiếm.")
+        if snapshot.store.build_id and any(snapshot.store.get(doc_id) is None for doc_id in probe_ids):
+            raise RuntimeError("Kho câu trả lời vừa ghi không khớp với index.")
+
+
+def _publish(index, meta, rows=None, base=None, upserts=(), deletes=(), probe_ids=None, probe_vectors=None):
+    """
+    Ghi index thành một phiên bản mới (thư mục tạm rồi đổi tên), kiểm tra, ghi CURRENT
+    rồi thay snapshot đang phục vụ. Kho câu trả lời được ghi mới từ rows, hoặc dùng lại
+    của snapshot base kèm delta (upserts/deletes). Gọi trong _write_lock().
+    """
+    version_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    directory = _version_dir(version_id)
+    tmp_dir = directory + ".tmp"
+    meta = {
+        **meta, "version_id": version_id, "count": int(index.ntotal), "created_at": datetime.utcnow().isoformat(),
+        # rebuild: build toàn bộ từ DB; incremental: thêm/sửa/xoá document trên phiên bản trước
+        "kind": "rebuild" if rows is not None else "incremental",
+    }
+    os.makedirs(tmp_dir)
+    try:
+        faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE_NAME))
+        with open(os.path.join(tmp_dir, INDEX_META_FILE_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        if rows is not None:
+            AnswerStore.write(tmp_dir, meta["build_id"], rows)
+        elif base is not None:
+            link_store_files(base.store.directory, tmp_dir)
+            if upserts or len(deletes):
+                AnswerStore.load(tmp_dir, meta.get("build_id")).apply_delta(upserts=upserts, deletes=deletes)
+        os.rename(tmp_dir, directory)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    snapshot = _load_snapshot(version_id)
+    try:
+        _verify(snapshot, int(index.ntotal), probe_ids, probe_vectors)
+    except Exception:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    _write_current(version_id)
+    _swap(snapshot)
+    _prune_versions()
+    return snapshot
+
+
+def _prune_versions():
+    """
+    Giữ phiên bản đang phục vụ, FAISS_KEEP_VERSIONS phiên bản rebuild cũ gần nhất và
+    FAISS_KEEP_INCREMENTAL_VERSIONS phiên bản incremental cũ gần nhất, xoá phần còn lại.
+    Tính riêng hai loại để các lần thêm/xoá document lẻ không đẩy phiên bản rebuild ra khỏi khả năng rollback.
+    """
+    current = _read_current()
+    old = [v for v in _list_version_ids() if v != current]
+    rebuilds = [v for v in old if _read_version_meta(v).get("kind") != "incremental"]
+    incrementals = [v for v in old if v not in rebuilds]
+    expired = (
+        rebuilds[:max(0, len(rebuilds) - settings.FAISS_KEEP_VERSIONS)]
+        + incrementals[:max(0, len(incrementals) - settings.FAISS_KEEP_INCREMENTAL_VERSIONS)]
+    )
+    for version_id in expired:
+        # Worker đang memory-map file của phiên bản bị xoá vẫn đọc được cho tới khi chuyển phiên bản
+        shutil.rmtree(_version_dir(version_id), ignore_errors=True)
+
+
+def _list_version_ids():
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    # Tên phiên bản bắt đầu bằng thời gian tạo nên sắp xếp theo tên là theo thời gian
+    return sorted(
+        name for name in os.listdir(VERSIONS_DIR)
+        if not name.endswith(".tmp") and os.path.isdir(_version_dir(name))
+    )
+
+
+def _read_version_meta(version_id: str) -> dict:
+    try:
+        with open(os.path.join(_version_dir(version_id), INDEX_META_FILE_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def list_index_versions():
+    """Các phiên bản index còn lưu trên đĩa (cũ nhất trước)."""
+    current = _read_current()
+    versions = []
+    for version_id in _list_version_ids():
+        meta = _read_version_meta(version_id)
+        versions.append({
+            "version_id": version_id,
+            "current": version_id == current,
+            "kind": meta.get("kind", "rebuild"),
+            "type": meta.get("type"),
+            "vectors": meta.get("count"),
+            "created_at": meta.get("created_at"),
+        })
+    return versions
+
+
+def rollback_index(version_id: str = None):
+    """
+    Chuyển index đang phục vụ về phiên bản version_id (mặc định: phiên bản liền trước phiên bản hiện tại).
+    Document thêm/sửa sau phiên bản đó sẽ không có trong index cho tới lần rebuild tiếp theo.
+    Trả về version_id đã kích hoạt; ValueError nếu không có phiên bản phù hợp.
+    """
+    with _write_lock():
+        versions = _list_version_ids()
+        current = _snapshot.version_id
+        if version_id is None:
+            older = [v for v in versions if current is None or v < current]
+            if not older:
+                raise ValueError("Không có phiên bản index cũ hơn để quay lại.")
+            version_id = older[-1]
+        elif version_id not in versions:
+            raise ValueError(f"Không tìm thấy phiên bản index: {version_id}")
+
+        snapshot = _load_snapshot(version_id)
+        if snapshot.index is None:
+            raise ValueError(f"Không đọc được phiên bản index: {version_id}")
+        _write_current(version_id)
+        _swap(snapshot)
+        return version_id
+
+
+def _encode(texts, progress_callback=None):
+    """Lấy vector từ cache embedding, chỉ mã hoá các câu mới hoặc đã sửa."""
+    vectors = embedding_cache.encode(texts, progress_callback=progress_callback)
+    embedding_cache.save()
+    return vectors
+
+
+def search_index(vectors, k: int):
+    """
+    Tìm k document gần nhất cho mỗi vector. I chứa document id (-1 nếu không đủ kết quả).
+    Không cần khoá: snapshot đang phục vụ không bị sửa, rebuild chỉ thay tham chiếu.
+    """
+    _maybe_reload()
+    index = _snapshot.index
+    if index is None:
+        raise RuntimeError("Chưa có FAISS index, vui lòng gọi /train/start để tạo index.")
+    return index.search(vectors, k)
+
+
+def find_nearest_documents(texts):
+    """
+    Mã hoá texts (qua cache embedding, lần build/cập nhật index sau không phải mã hoá lại)
+    và tìm document gần nhất trong index đang phục vụ.
+    Trả về (vectors, khoảng cách, document id); id = -1 nếu chưa có index.
+    Khoảng cách đã trừ sai số nén (ivfpq) để so sánh được với ngưỡng của khoảng cách L2 chính xác.
+    """
+    vectors = _encode(texts)
+    _maybe_reload()
+    snapshot = _snapshot
+    if snapshot.index is None or snapshot.index.ntotal == 0:
+        return vectors, np.full(len(texts), np.inf, dtype='float32'), np.full(len(texts), -1, dtype='int64')
+    D, I = snapshot.index.search(vectors, 1)
+    return vectors, D[:, 0] - snapshot.meta.get("distance_offset", 0.0), I[:, 0]
+
+
+def _probe(ids, vectors, n: int = 8):
+    # Một vài vector mẫu để kiểm tra phiên bản mới trước khi đưa vào phục vụ
+    return ids[:n], vectors[:n]
+
+
+def rebuild_faiss_index(db: Session, progress_callback=None):
+    """
+    Tạo lại FAISS index (loại index theo FAISS_INDEX_TYPE) từ tất cả Document trong DB.
+    Vector của các câu hỏi không đổi được lấy lại từ cache embedding.
+    Index mới được ghi thành một phiên bản riêng, kiểm tra rồi mới thay phiên bản đang phục vụ;
+    chat vẫn tìm kiếm trên phiên bản cũ trong suốt quá trình build.
+    progress_callback(số câu đã mã hoá, tổng số câu cần mã hoá) được gọi sau mỗi batch.
+    """
+    try:
+        docs = db.query(Document.id, Document.question, Document.answer).all()
+        texts = [doc.question for doc in docs]
+        ids = np.asarray([doc.id for doc in docs], dtype='int64')
+        if not texts:
+            return False
+
+        # Tạo vectors bằng mô hình embedding
+        vectors = _encode(texts, progress_callback)
+        index, meta = build_index(vectors, ids)
+        meta["build_id"] = uuid.uuid4().hex
+
+        probe_ids, probe_vectors = _probe(ids, vectors)
+        with _write_lock():
+            _publish(
+                index, meta, rows=[(doc.id, doc.question, doc.answer) for doc in docs],
+                probe_ids=probe_ids, probe_vectors=probe_vectors,
+            )
+
+        return True
+    except Exception as e:
+        print(f"Lỗi quá trình faiss dữ liệu: {str(e)}")
+        return False
+
+
+def _writable(index):
+    """Bản sao của index đang phục vụ để thêm/xoá (index đang phục vụ không bị sửa)."""
+    index = faiss.deserialize_index(faiss.serialize_index(index))
+    set_search_params(index)
+    return index
+
+
+class _Mutation:
+    """Một thay đổi index đang chờ: thêm/sửa (upserts + vectors) hoặc xoá (deletes)."""
+
+    def __init__(self, upserts=(), vectors=None, deletes=None):
+        self.upserts = list(upserts)
+        self.vectors = vectors
+        self.deletes = deletes
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Các thay đổi chờ được gộp vào phiên bản index tiếp theo
+_pending_mutations = []
+_pending_lock = threading.Lock()
+
+
+def _apply_mutation(mutation):
+    """
+    Đưa thay đổi vào index. Các thay đổi đến trong lúc một phiên bản khác đang được ghi được gộp lại:
+    luồng giữ khoá ghi áp dụng tất cả thay đổi đang chờ thành một phiên bản duy nhất
+    (một bản sao index, một lần ghi, với HNSW một lần tạo lại đồ thị).
+    Trả về kết quả của thay đổi (None nếu chưa có index).
+    """
+    with _pending_lock:
+        _pending_mutations.append(mutation)
+    with _write_lock():
+        with _pending_lock:
+            batch = list(_pending_mutations)
+            _pending_mutations.clear()
+        if batch:
+            try:
+                _apply_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            finally:
+                for item in batch:
+                    item.done.set()
+    # Thay đổi đã được luồng khác áp dụng cùng batch của nó
+    mutation.done.wait()
+    if mutation.error is not None:
+        raise mutation.error
+    return mutation.result
+
+
+def _apply_batch(batch):
+    """Áp dụng lần lượt các thay đổi lên một bản sao của index đang phục vụ và ghi một phiên bản mới. Gọi trong _write_lock()."""
+    base = _snapshot
+    if base.index is None:
+        # Index vừa bị xoá (bởi worker khác): thêm cần tạo lại toàn bộ (result None), xoá không có gì để làm
+        for item in batch:
+            item.result = None if item.deletes is None else 0
+        return
+
+    # HNSW không xoá được vector: chỉ theo dõi id còn lại, tạo lại đồ thị một lần cho cả batch
+    hnsw = not _supports_remove(base.index)
+    index = None if hnsw else _writable(base.index)
+    alive = set(faiss.vector_to_array(base.index.id_map).tolist()) if hnsw else None
+    upserts = {}    # id -> ((id, question, answer), vector), thay đổi sau cùng thắng
+    deleted = set()
+    changed = False
+    for item in batch:
+        if item.deletes is not None:
+            ids = [int(i) for i in item.deletes]
+            if hnsw:
+                item.result = sum(1 for i in set(ids) if i in alive)
+                alive.difference_update(ids)
+            else:
+                item.result = int(index.remove_ids(np.asarray(ids, dtype='int64')))
+            for doc_id in ids:
+                upserts.pop(doc_id, None)
+            deleted.update(ids)
+            changed = changed or item.result > 0
+        else:
+            ids = np.asarray([doc_id for doc_id, _, _ in item.upserts], dtype='int64')
+            if hnsw:
+                alive.update(ids.tolist())
+            else:
+                # Xoá vector cũ cùng id (nếu có) để tránh trùng khi cập nhật
+                index.remove_ids(ids)
+                index.add_with_ids(item.vectors, ids)
+            for doc, vector in zip(item.upserts, item.vectors):
+                upserts[doc[0]] = (doc, vector)
+                deleted.discard(doc[0])
+            item.result = len(item.upserts)
+            changed = True
+    if not changed:
+        return
+
+    upsert_ids = np.asarray(list(upserts), dtype='int64')
+    upsert_vectors = np.stack([vector for _, vector in upserts.values()]) if upserts else None
+    if hnsw:
+        index, _ = _rebuild_without(base.index, np.asarray(list(deleted | set(upserts)), dtype='int64'))
+        if index is base.index:
+            index = _writable(index)
+        if index is None and upserts:
+            index, _ = build_index(upsert_vectors, upsert_ids, index_type="hnsw")
+        elif upserts:
+            index.add_with_ids(upsert_vectors, upsert_ids)
+
+    if index is None or index.ntotal == 0:
+        _reset()
+        return
+    probe_ids, probe_vectors = _probe(upsert_ids, upsert_vectors) if upserts else (None, None)
+    _publish(
+        index, base.meta, base=base, upserts=[doc for doc, _ in upserts.values()],
+        deletes=np.asarray(sorted(deleted), dtype='int64'), probe_ids=probe_ids, probe_vectors=probe_vectors,
+    )
+
+
+def add_documents_to_index(docs, db: Session):
+    """
+    Mã hoá và thêm các Document mới (hoặc đã sửa) vào index theo id (tạo phiên bản index mới,
+    gộp với các thay đổi đồng thời khác).
+    docs: các Document hoặc bộ (id, question, answer).
+    Nếu chưa có index, tạo mới toàn bộ từ DB.
+    Trả về số document đã được đưa vào index.
+    """
+    docs = [doc if isinstance(doc, tuple) else (doc.id, doc.question, doc.answer) for doc in docs]
+    if not docs:
+        return 0
+    if _snapshot.index is None:
+        return len(docs) if rebuild_faiss_index(db) else 0
+
+    vectors = _encode([question for _, question, _ in docs])
+    added = _apply_mutation(_Mutation(upserts=docs, vectors=vectors))
+    if added is None:
+        # Index vừa bị xoá bởi worker khác: tạo mới toàn bộ
+        return len(docs) if rebuild_faiss_index(db) else 0
+    return added
+
+
+def remove_documents_from_index(doc_ids):
+    """Xoá các document khỏi index theo id (tạo phiên bản index mới, gộp với các thay đổi đồng thời khác). Trả về số vector đã xoá."""
+    ids = np.asarray(list(doc_ids), dtype='int64')
+    if not len(ids):
+        return 0
+    return _apply_mutation(_Mutation(deletes=ids))
+
+
+def reset_faiss_index():
+    """Xoá toàn bộ index và mọi phiên bản đã lưu (khi xoá hết Document)."""
+    with _write_lock():
+        _reset()
+
+
+def _reset():
+    _swap(IndexSnapshot())
+    for path in (CURRENT_FILE, LEGACY_INDEX_FILE, LEGACY_INDEX_META_FILE, MAPPING_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    remove_store_files(INDEX_DIR)
+    shutil.rmtree(VERSIONS_DIR, ignore_errors=True)
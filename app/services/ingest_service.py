@@ -0,0 +1,303 @@
+# app/services/ingest_service.py
+import csv
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+# Thư mục lưu tạm file upload (đọc theo từng dòng, không nạp cả file vào bộ nhớ)
+UPLOAD_DIR = "data/uploads"
+
+# Định dạng file upload hỗ trợ
+UPLOAD_FORMATS = {
+    ".xlsx": "xlsx",
+    ".xlsm": "xlsx",
+    ".xls": "xls",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+}
+
+# Kích thước mỗi lần đọc khi lưu tạm file upload
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def upload_format(filename: str):
+    """Định dạng file theo phần mở rộng, None nếu không hỗ trợ."""
+    return UPLOAD_FORMATS.get(os.path.splitext(filename or "")[1].lower())
+
+
+def spool_upload(upload_file, suffix: str = "") -> str:
+    """Ghi file upload (UploadFile.file) ra file tạm trên đĩa theo từng khối. Trả về đường dẫn file tạm."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        shutil.copyfileobj(upload_file, f, SPOOL_CHUNK_SIZE)
+    return path
+
+
+def _iter_xlsx(path):
+    from openpyxl import load_workbook
+
+    # read_only: đọc dần từng dòng thay vì nạp toàn bộ workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for line, row in enumerate(workbook.worksheets[0].iter_rows(values_only=True), start=1):
+            yield line, row
+    finally:
+        workbook.close()
+
+
+def _iter_xls(path):
+    # Định dạng .xls cũ không đọc được bằng openpyxl: dùng pandas (nạp cả sheet)
+    import pandas as pd
+
+    df = pd.read_excel(path, header=None)
+    for line, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        yield line, row
+
+
+def _iter_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for line, row in enumerate(csv.reader(f), start=1):
+            yield line, row
+
+
+def _iter_jsonl(path, fields):
+    with open(path, encoding="utf-8-sig") as f:
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                item = json.loads(text)
+            except ValueError:
+                yield line, None
+                continue
+            # Mỗi dòng là [cột 1, cột 2] hoặc object có các khoá theo tên cột
+            yield line, [item.get(name) for name in fields] if isinstance(item, dict) else item
+
+
+def iter_rows(path: str, fmt: str, fields):
+    """Đọc file theo từng dòng, sinh ra (số dòng, dãy giá trị các cột)."""
+    if fmt == "xlsx":
+        return _iter_xlsx(path)
+    if fmt == "xls":
+        return _iter_xls(path)
+    if fmt == "csv":
+        return _iter_csv(path)
+    if fmt == "jsonl":
+        return _iter_jsonl(path, fields)
+    raise ValueError(f"Định dạng file không hỗ trợ: {fmt}")
+
+
+class UnreadableFile(Exception):
+    """File upload không đọc được (sai định dạng, file hỏng, sai encoding). Lỗi ghi DB không thuộc loại này."""
+
+
+def _read_errors():
+    """Các lỗi do nội dung file khi đọc (không gồm lỗi hệ thống/DB)."""
+    errors = [ValueError, KeyError, csv.Error, zipfile.BadZipFile]
+    try:
+        from openpyxl.utils.exceptions import InvalidFileException
+        errors.append(InvalidFileException)
+    except ImportError:
+        pass
+    try:
+        from xlrd import XLRDError
+        errors.append(XLRDError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def read_rows(path: str, fmt: str, fields):
+    """Như iter_rows, nhưng lỗi đọc nội dung file được báo bằng UnreadableFile."""
+    errors = _read_errors()
+    try:
+        rows = iter_rows(path, fmt, fields)
+    except errors as e:
+        raise UnreadableFile(str(e)) from e
+    while True:
+        # Chỉ bắt lỗi khi đọc dòng tiếp theo, không bắt lỗi của phần xử lý/ghi DB giữa các dòng
+        try:
+            item = next(rows)
+        except StopIteration:
+            return
+        except errors as e:
+            raise UnreadableFile(str(e)) from e
+        yield item
+
+
+def _cell(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value).strip()
+
+
+def _validate(row, fields):
+    """Trả về (dict giá trị theo tên cột, None) hoặc (None, lý do bị loại)."""
+    if row is None:
+        return None, "Dòng không đọc được"
+    if not isinstance(row, (list, tuple)) or len(row) < len(fields):
+        return None, f"Thiếu cột (cần {len(fields)} cột: {', '.join(fields)})"
+    values = {name: _cell(value) for name, value in zip(fields, row)}
+    empty = [name for name, value in values.items() if not value]
+    if empty:
+        return None, f"Cột trống: {', '.join(empty)}"
+    return values, None
+
+
+def _copy_rows(db: Session, model, columns, rows):
+    """Ghi bằng COPY của PostgreSQL (nhanh nhất, không trả về id)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in rows:
+        writer.writerow([values[name] for name in columns])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _bulk_insert(db: Session, model, rows, returning: bool):
+    """Ghi một khối bản ghi (dict theo tên cột). returning=True trả về id theo thứ tự bản ghi."""
+    if returning:
+        # executemany + RETURNING (insertmanyvalues) không đảm bảo thứ tự nếu không yêu cầu rõ
+        return list(db.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows).scalars())
+    if db.get_bind().dialect.name == "postgresql":
+        _copy_rows(db, model, list(rows[0]), rows)
+    else:
+        db.execute(insert(model), rows)
+    return None
+
+
+class IngestReport:
+    """
+    Kết quả import: số dòng đã ghi, số dòng bị loại và lý do, số dòng trùng
+    (giới hạn số dòng lỗi/trùng được liệt kê).
+    """
+
+    def __init__(self, max_rejects: int):
+        self.max_rejects = max_rejects
+        self.rows = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []
+        self.duplicates = 0
+        self.merged = 0
+        self.duplicate_rows = []
+        self.seconds = 0.0
+
+    def reject(self, line: int, reason: str):
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({"line": line, "reason": reason})
+
+    def duplicate(self, line: int, kind: str, document_id=None, distance=None):
+        """kind: exact (trùng chính xác) hoặc near (gần trùng, kèm khoảng cách)."""
+        self.duplicates += 1
+        if len(self.duplicate_rows) < self.max_rejects:
+            row = {"line": line, "kind": kind, "document_id": document_id}
+            if distance is not None:
+                row["distance"] = round(distance, 3)
+            self.duplicate_rows.append(row)
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+            "duplicates": self.duplicates,
+            "merged": self.merged,
+            "duplicate_rows": self.duplicate_rows,
+            "seconds": round(self.seconds, 2),
+        }
+
+
+def ingest_file(path: str, fmt: str, model, fields, db: Session, keep_limit: int = 0, dedup=None, progress_callback=None):
+    """
+    Import file vào bảng của model theo từng khối INGEST_CHUNK_SIZE dòng (bulk insert hoặc COPY).
+    fields: tên cột tương ứng với các cột của file (theo thứ tự).
+    keep_limit: nếu tổng số dòng không vượt quá giới hạn này, trả về danh sách (id, giá trị...) đã ghi
+    (dùng để cập nhật index ngay); vượt quá thì trả về None.
+    dedup(db, số dòng, các dòng, report) lọc mỗi khối trước khi ghi, trả về (các dòng cần thêm,
+    các bộ (id, giá trị...) đã được cập nhật) — xem DocumentDeduplicator.
+    progress_callback(số dòng đã đọc, số dòng đã ghi) được gọi sau mỗi khối.
+    Toàn bộ file được ghi trong một transaction. Trả về (IngestReport, danh sách bản ghi hoặc None).
+    UnreadableFile nếu không đọc được file; lỗi ghi DB được rollback và ném lại nguyên vẹn.
+    """
+    report = IngestReport(settings.INGEST_MAX_REJECTS_REPORTED)
+    start = time.perf_counter()
+    kept = [] if keep_limit > 0 else None
+    chunk, lines = [], []
+
+    def flush():
+        nonlocal kept
+        rows, updated = dedup(db, lines, chunk, report) if dedup else (chunk, [])
+        returning = kept is not None
+        ids = _bulk_insert(db, model, rows, returning) if rows else []
+        if returning:
+            kept.extend((doc_id, *(values[name] for name in fields)) for doc_id, values in zip(ids, rows))
+            kept.extend(updated)
+            if len(kept) > keep_limit:
+                kept = None
+        report.inserted += len(rows)
+        chunk.clear()
+        lines.clear()
+        if progress_callback:
+            progress_callback(report.rows, report.inserted)
+
+    try:
+        for line, row in read_rows(path, fmt, fields):
+            report.rows += 1
+            values, reason = _validate(row, fields)
+            if reason:
+                report.reject(line, reason)
+                continue
+            chunk.append(values)
+            lines.append(line)
+            if len(chunk) >= settings.INGEST_CHUNK_SIZE:
+                flush()
+        if chunk:
+            flush()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report.seconds = time.perf_counter() - start
+    if kept is not None:
+        # Một bản ghi có thể vừa được thêm vừa được cập nhật (gộp) trong cùng file: giữ bản cuối
+        kept = list({row[0]: row for row in kept}.values())
+    return report, kept
+
+
+def progress_logger(name: str, interval: float = 2.0):
+    """progress_callback ghi log tiến độ import (tối đa mỗi interval giây)."""
+    last = [time.monotonic()]
+
+    def log(rows: int, inserted: int):
+        now = time.monotonic()
+        if now - last[0] >= interval:
+            last[0] = now
+            print(f"[{name}] Đã đọc {rows} dòng, đã ghi {inserted} dòng")
+    return log
+
+
+def remove_spooled(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,342 @@
+# app/services/job_service.py
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá giữa các luồng trong tiến trình
+    fcntl = None
+
+from app.core.config import settings
+
+# Trạng thái tác vụ: data/jobs/<job_id>.json (ghi bởi tiến trình tác vụ), <job_id>.cancel là cờ yêu cầu huỷ
+JOBS_DIR = "data/jobs"
+LOCK_FILE = "data/jobs/.lock"
+
+# Các loại tác vụ nền, mỗi loại chỉ chạy tối đa một tác vụ cùng lúc
+JOB_KINDS = ("index", "fine_tune", "unknown_clusters")
+ACTIVE_STATUSES = ("queued", "running")
+
+# Khoảng cách tối thiểu giữa hai lần ghi tiến độ (giây)
+PROGRESS_INTERVAL = 0.5
+
+# Tiến trình tác vụ do worker này khởi chạy (job_id -> Popen)
+_processes = {}
+_lock = threading.Lock()
+
+
+class JobConflict(Exception):
+    """Đã có tác vụ cùng loại đang chạy."""
+
+    def __init__(self, job):
+        super().__init__(f"Đang có tác vụ {job['kind']} chạy ({job['id']}).")
+        self.job = job
+
+
+class JobCancelled(Exception):
+    """Tác vụ bị huỷ theo yêu cầu (được ném ra từ callback tiến độ)."""
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _cancel_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.cancel")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _write_job(job: dict):
+    # Ghi file tạm rồi đổi tên: người đọc luôn thấy trạng thái hoàn chỉnh
+    tmp = _status_path(job["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp, _status_path(job["id"]))
+
+
+def _read_job(job_id: str):
+    try:
+        with open(_status_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _refresh(job):
+    """Đánh dấu thất bại nếu tiến trình tác vụ đã kết thúc mà không cập nhật trạng thái (bị kill, hết bộ nhớ...)."""
+    if job and job["status"] in ACTIVE_STATUSES and job.get("pid") and not _pid_alive(job["pid"]):
+        job = _read_job(job["id"]) or job
+        if job["status"] in ACTIVE_STATUSES:
+            job.update(status="failed", error="Tiến trình tác vụ kết thúc bất thường.", finished_at=_now())
+            _write_job(job)
+    return job
+
+
+@contextmanager
+def _submit_lock():
+    # Khoá giữa các worker để kiểm tra "một tác vụ mỗi loại" và tạo tác vụ là một bước
+    with _lock:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def list_jobs(kind: str = None, limit: int = 50):
+    """Các tác vụ gần nhất (mới nhất trước)."""
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    jobs = []
+    for name in os.listdir(JOBS_DIR):
+        if name.endswith(".json"):
+            job = _refresh(_read_job(name[:-len(".json")]))
+            if job and (kind is None or job["kind"] == kind):
+                jobs.append(job)
+    jobs.sort(key=lambda job: job["created_at"], reverse=True)
+    return jobs[:limit]
+
+
+def get_job(job_id: str):
+    """Trạng thái và tiến độ của tác vụ, None nếu không tồn tại."""
+    return _refresh(_read_job(job_id))
+
+
+def submit_job(kind: str, options: dict = None) -> dict:
+    """
+    Tạo và chạy tác vụ nền trong một tiến trình riêng. Trả về thông tin tác vụ (có id) ngay lập tức.
+    options: tham số của tác vụ (lưu cùng trạng thái tác vụ).
+    JobConflict nếu đã có tác vụ cùng loại đang chạy.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Loại tác vụ không hợp lệ: {kind}")
+    with _submit_lock():
+        for job in list_jobs(kind):
+            if job["status"] in ACTIVE_STATUSES:
+                raise JobConflict(job)
+
+        job = {
+            "id": f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            "kind": kind,
+            "options": options or {},
+            "status": "queued",
+            "progress": {},
+            "result": None,
+            "error": None,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "pid": None,
+        }
+        _write_job(job)
+        # Tiến trình Python mới hoàn toàn (không thừa hưởng luồng/trạng thái torch của worker), ở session riêng
+        # và không do multiprocessing quản lý: worker tắt/khởi động lại/redeploy không giết hay chờ tác vụ đang chạy
+        # (trạng thái tác vụ mồ côi được theo dõi qua pid)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.services.job_service", job["id"], kind], start_new_session=True,
+        )
+        job["pid"] = process.pid
+        _record_pid(job["id"], process.pid)
+        _processes[job["id"]] = process
+
+    threading.Thread(target=_watch, args=(job["id"], process), name=f"job-watch-{job['id']}", daemon=True).start()
+    return job
+
+
+def _record_pid(job_id: str, pid: int):
+    """Ghi pid khi tác vụ còn "queued"; không ghi đè trạng thái tiến trình tác vụ đã tự cập nhật (running, failed...)."""
+    job = _read_job(job_id)
+    if job is not None and job["status"] == "queued" and not job.get("pid"):
+        job["pid"] = pid
+        _write_job(job)
+
+
+def cancel_job(job_id: str, force: bool = False):
+    """
+    Yêu cầu huỷ tác vụ: tác vụ dừng ở lần cập nhật tiến độ tiếp theo (sau batch/bước huấn luyện hiện tại).
+    force=True gửi SIGTERM cho tiến trình tác vụ. Trả về trạng thái tác vụ, None nếu không tồn tại.
+    """
+    job = get_job(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        return job
+    open(_cancel_path(job_id), "w").close()
+    if force and _pid_alive(job.get("pid")):
+        os.kill(job["pid"], signal.SIGTERM)
+    return job
+
+
+def _watch(job_id: str, process):
+    """Chờ tiến trình tác vụ kết thúc (thu dọn tiến trình con) rồi áp dụng kết quả cho worker này."""
+    process.wait()
+    _processes.pop(job_id, None)
+    job = _refresh(_read_job(job_id))
+    if job and job["kind"] == "fine_tune" and job["status"] == "succeeded":
+        from app.services.model_registry_service import maybe_reload
+
+        # Chuyển ngay sang phiên bản vừa promote (worker khác tự kiểm tra mỗi MODEL_RELOAD_CHECK_SECONDS)
+        maybe_reload(force=True)
+
+
+# ---------------------------------------------------------------------------
+# Phần chạy trong tiến trình tác vụ
+# ---------------------------------------------------------------------------
+
+def _limit_resources():
+    """Giới hạn tài nguyên của tiến trình tác vụ để không tranh CPU với luồng chat."""
+    if settings.JOB_TORCH_THREADS > 0:
+        # Phải đặt trước khi import torch
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[name] = str(settings.JOB_TORCH_THREADS)
+    if settings.JOB_NICE and hasattr(os, "nice"):
+        os.nice(settings.JOB_NICE)
+    if settings.JOB_CPUS and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, _parse_cpus(settings.JOB_CPUS))
+
+
+def _parse_cpus(value: str):
+    """'0-3,6' -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for item in value.split(","):
+        item = item.strip()
+        if "-" in item:
+            start, end = item.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        elif item:
+            cpus.add(int(item))
+    return cpus
+
+
+class _Reporter:
+    """Ghi tiến độ của tác vụ (giới hạn tần suất) và kiểm tra yêu cầu huỷ."""
+
+    def __init__(self, job):
+        self.job = job
+        self._last_write = 0.0
+
+    def __call__(self, **progress):
+        self.job["progress"].update(progress)
+        now = time.monotonic()
+        if now - self._last_write >= PROGRESS_INTERVAL:
+            self._last_write = now
+            _write_job(self.job)
+        if os.path.exists(_cancel_path(self.job["id"])):
+            raise JobCancelled()
+
+
+def _index_job(report):
+    from app.db.session import SessionLocal
+    from app.services.index_service import get_index_stats, rebuild_faiss_index
+
+    db = SessionLocal()
+    try:
+        report(stage="encode")
+        success = rebuild_faiss_index(
+            db, progress_callback=lambda done, total: report(stage="encode", batches_encoded=done, texts_to_encode=total),
+        )
+    finally:
+        db.close()
+    if not success:
+        raise RuntimeError("Không có dữ liệu để tạo index hoặc tạo index thất bại.")
+    stats = get_index_stats()
+    return {"version_id": stats["version_id"], "type": stats["type"], "vectors": stats["vectors"]}
+
+
+def _fine_tune_job(report):
+    from app.db.session import SessionLocal
+    from app.services.chat_service import rebuild_fine_tune
+
+    options = report.job.get("options", {})
+    db = SessionLocal()
+    try:
+        report(stage="train")
+        result = rebuild_fine_tune(
+            db, progress_callback=report, mode=options.get("mode", "full"), lora=bool(options.get("lora")),
+            promote=options.get("promote", True),
+        )
+    finally:
+        db.close()
+    if not result:
+        raise RuntimeError("Không có dữ liệu (mới) để fine-tune.")
+    return result
+
+
+def _unknown_clusters_job(report):
+    from app.db.session import SessionLocal
+    from app.services.unknown_cluster_service import cluster_unknown_questions
+
+    full = bool(report.job.get("options", {}).get("full"))
+    db = SessionLocal()
+    try:
+        report(stage="cluster")
+        return cluster_unknown_questions(
+            db, full=full, progress_callback=lambda done, total: report(stage="cluster", questions_done=done, questions_total=total),
+        )
+    finally:
+        db.close()
+
+
+_JOB_FUNCTIONS = {"index": _index_job, "fine_tune": _fine_tune_job, "unknown_clusters": _unknown_clusters_job}
+
+
+def _terminate(signum, frame):
+    raise JobCancelled()
+
+
+def _run_job(job_id: str, kind: str):
+    """Điểm vào của tiến trình tác vụ."""
+    _limit_resources()
+    # cancel_job(force=True): dừng ngay nhưng vẫn ghi trạng thái "cancelled"
+    signal.signal(signal.SIGTERM, _terminate)
+    # Cùng khoá với submit_job: không ghi "running" trước khi tiến trình cha ghi xong pid
+    with _submit_lock():
+        job = _read_job(job_id)
+        job.update(status="running", started_at=_now(), pid=os.getpid())
+        _write_job(job)
+    report = _Reporter(job)
+    try:
+        if settings.JOB_TORCH_THREADS > 0:
+            import torch
+            torch.set_num_threads(settings.JOB_TORCH_THREADS)
+        job["result"] = _JOB_FUNCTIONS[kind](report)
+        job["status"] = "succeeded"
+    except JobCancelled:
+        job["status"] = "cancelled"
+    except Exception as e:
+        job["status"] = "cancelled" if os.path.exists(_cancel_path(job_id)) else "failed"
+        job["error"] = None if job["status"] == "cancelled" else str(e)
+    job["finished_at"] = _now()
+    _write_job(job)
+    if os.path.exists(_cancel_path(job_id)):
+        os.remove(_cancel_path(job_id))
+
+
+if __name__ == "__main__":
+    # Điểm vào của tiến trình tác vụ (submit_job); dùng bản module đã import để các lớp/ngoại lệ là một
+    from app.services.job_service import _run_job as run_job
+
+    run_job(sys.argv[1], sys.argv[2])
@@ -0,0 +1,287 @@
+# app/services/model_registry_service.py
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá giữa các luồng trong tiến trình
+    fcntl = None
+
+from app.core.config import settings
+from app.services.model_service import FINE_TUNE_FILE, GENERATOR_MODEL_NAME, model_manager
+
+# Kho phiên bản ViT5 fine-tune: mỗi lần fine-tune tạo một phiên bản versions/<version_id>/ (checkpoint đầy đủ,
+# hoặc chỉ adapter LoRA kèm mô hình nền trong model_meta.json); CURRENT chứa version_id đang phục vụ,
+# các worker tự chuyển sang phiên bản mới khi CURRENT thay đổi
+REGISTRY_DIR = "data/model_registry"
+VERSIONS_DIR = "data/model_registry/versions"
+CURRENT_FILE = "data/model_registry/CURRENT"
+LOCK_FILE = "data/model_registry/.lock"
+MODEL_META_FILE = "model_meta.json"
+ADAPTER_CONFIG_FILE = "adapter_config.json"
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+
+_registry_lock = threading.Lock()
+
+
+def _version_dir(version_id: str) -> str:
+    return os.path.join(VERSIONS_DIR, version_id)
+
+
+def has_weights(directory: str) -> bool:
+    return any(os.path.exists(os.path.join(directory, name)) for name in WEIGHT_FILES)
+
+
+def read_current():
+    try:
+        with open(CURRENT_FILE, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _current_stamp():
+    # Thời điểm ghi CURRENT: promote/rollback lại cùng một phiên bản cũng đổi giá trị này
+    try:
+        return os.stat(CURRENT_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _write_current(version_id: str):
+    # Ghi file tạm rồi đổi tên: các worker khác luôn đọc được một phiên bản hoàn chỉnh
+    tmp = CURRENT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version_id)
+    os.replace(tmp, CURRENT_FILE)
+    # Promote/rollback mới: thử nạp lại kể cả phiên bản đã nạp lỗi trước đó
+    _serving.update(failed=None, failed_stamp=None)
+
+
+@contextmanager
+def _write_lock():
+    """Khoá thay đổi kho phiên bản giữa các luồng và giữa các tiến trình (flock trên REGISTRY_DIR/.lock)."""
+    with _registry_lock:
+        os.makedirs(REGISTRY_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _list_version_ids():
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    # Tên phiên bản bắt đầu bằng thời gian tạo nên sắp xếp theo tên là theo thời gian
+    return sorted(
+        name for name in os.listdir(VERSIONS_DIR)
+        if not name.endswith(".tmp") and os.path.isdir(_version_dir(name))
+    )
+
+
+def read_version_meta(version_id: str) -> dict:
+    try:
+        with open(os.path.join(_version_dir(version_id), MODEL_META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def resolve_version(version_id: str = None):
+    """
+    (mô hình nền, adapter LoRA hoặc None) của phiên bản version_id (mặc định: phiên bản đang phục vụ).
+    Chưa có phiên bản nào: checkpoint cũ ở FINE_TUNE_FILE nếu có, ngược lại là mô hình gốc.
+    """
+    version_id = version_id or read_current()
+    if version_id:
+        directory = _version_dir(version_id)
+        if os.path.exists(os.path.join(directory, ADAPTER_CONFIG_FILE)):
+            return read_version_meta(version_id).get("base") or GENERATOR_MODEL_NAME, directory
+        return directory, None
+    return (FINE_TUNE_FILE if has_weights(FINE_TUNE_FILE) else GENERATOR_MODEL_NAME), None
+
+
+def create_version():
+    """Tạo thư mục tạm cho một phiên bản mới, trả về (version_id, thư mục). Ghi xong thì gọi register_version."""
+    version_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = _version_dir(version_id) + ".tmp"
+    os.makedirs(tmp_dir)
+    return version_id, tmp_dir
+
+
+def discard_version(version_id: str):
+    """Xoá phiên bản chưa đăng ký (huấn luyện lỗi hoặc bị huỷ)."""
+    shutil.rmtree(_version_dir(version_id) + ".tmp", ignore_errors=True)
+
+
+def register_version(version_id: str, meta: dict, promote: bool = True) -> dict:
+    """
+    Hoàn tất phiên bản tạo bởi create_version: ghi model_meta.json (số dòng dữ liệu, loss, thời điểm...),
+    đổi tên thư mục tạm và (promote=True) đưa vào phục vụ. Trả về meta của phiên bản.
+    """
+    tmp_dir = _version_dir(version_id) + ".tmp"
+    if not has_weights(tmp_dir) and not os.path.exists(os.path.join(tmp_dir, ADAPTER_CONFIG_FILE)):
+        discard_version(version_id)
+        raise RuntimeError(f"Phiên bản {version_id} không có trọng số mô hình.")
+    meta = {**meta, "version_id": version_id, "created_at": datetime.utcnow().isoformat()}
+    with open(os.path.join(tmp_dir, MODEL_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.rename(tmp_dir, _version_dir(version_id))
+    if promote:
+        promote_version(version_id)
+    return meta
+
+
+def promote_version(version_id: str) -> str:
+    """Đưa phiên bản version_id vào phục vụ (các worker chuyển sang trong nền). ValueError nếu không có phiên bản."""
+    with _write_lock():
+        if version_id not in _list_version_ids():
+            raise ValueError(f"Không tìm thấy phiên bản mô hình: {version_id}")
+        _write_current(version_id)
+        _prune_versions()
+    return version_id
+
+
+def rollback_version(version_id: str = None) -> str:
+    """
+    Quay lại phiên bản version_id (mặc định: phiên bản liền trước phiên bản đang phục vụ).
+    Trả về version_id đã kích hoạt; ValueError nếu không có phiên bản phù hợp.
+    """
+    with _write_lock():
+        versions = _list_version_ids()
+        current = read_current()
+        if version_id is None:
+            older = [v for v in versions if current is None or v < current]
+            if not older:
+                raise ValueError("Không có phiên bản mô hình cũ hơn để quay lại.")
+            version_id = older[-1]
+        elif version_id not in versions:
+            raise ValueError(f"Không tìm thấy phiên bản mô hình: {version_id}")
+        _write_current(version_id)
+    return version_id
+
+
+def _prune_versions():
+    """
+    Giữ phiên bản đang phục vụ, MODEL_KEEP_VERSIONS phiên bản khác gần nhất và mô hình nền của các
+    phiên bản adapter được giữ; xoá phần còn lại. Gọi trong _write_lock().
+    """
+    current = read_current()
+    versions = _list_version_ids()
+    old = [v for v in versions if v != current]
+    keep = set(old[max(0, len(old) - settings.MODEL_KEEP_VERSIONS):]) | {current}
+    for version_id in list(keep):
+        base_version = read_version_meta(version_id).get("base_version") if version_id else None
+        if base_version:
+            keep.add(base_version)
+    for version_id in versions:
+        if version_id not in keep:
+            shutil.rmtree(_version_dir(version_id), ignore_errors=True)
+
+
+def list_versions():
+    """Các phiên bản mô hình còn lưu trên đĩa (cũ nhất trước)."""
+    current = read_current()
+    return [
+        {**read_version_meta(version_id), "version_id": version_id, "current": version_id == current}
+        for version_id in _list_version_ids()
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Phục vụ: chuyển sang phiên bản mới trong nền
+# ---------------------------------------------------------------------------
+
+# Phiên bản mô hình đang phục vụ trong worker này (None: checkpoint cũ hoặc mô hình gốc).
+# failed/failed_stamp: phiên bản nạp lỗi và thời điểm ghi CURRENT lúc đó (không thử lại cho tới lần promote/rollback sau)
+_serving = {"version_id": None, "failed": None, "failed_stamp": None, "loaded_at": None}
+_reload_lock = threading.Lock()
+_last_reload_check = time.monotonic()
+
+# Câu dùng để chạy thử mô hình mới trước khi đưa vào phục vụ
+WARMUP_PROMPT = "xin chào"
+
+
+def _load_version(version_id: str = None):
+    """Nạp (tokenizer, model) của phiên bản version_id (mặc định: phiên bản đang phục vụ theo CURRENT)."""
+    from app.services.generation_service import load_generator
+
+    source, adapter = resolve_version(version_id)
+    return load_generator(source=source, adapter=adapter)
+
+
+def _mark_serving(version_id: str):
+    _serving.update(version_id=version_id, loaded_at=datetime.utcnow().isoformat())
+    if _serving["failed"] == version_id:
+        _serving.update(failed=None, failed_stamp=None)
+
+
+def load_current_generator():
+    """Nạp (tokenizer, model) của phiên bản đang phục vụ theo CURRENT (hàm nạp của model_manager)."""
+    version_id = read_current()
+    generator = _load_version(version_id)
+    _mark_serving(version_id)
+    return generator
+
+
+def _reload_generator(version_id: str, stamp):
+    from app.services.generation_service import generate
+
+    try:
+        start = time.perf_counter()
+        tokenizer, model = _load_version(version_id)
+        # Chạy thử một lần để request đầu tiên trên mô hình mới không phải chờ khởi tạo
+        generate(tokenizer, model, [WARMUP_PROMPT], {"num_beams": 1, "max_length": 8})
+        # Các request đang chạy dùng tiếp mô hình cũ, request mới dùng mô hình mới
+        model_manager.set("generator", (tokenizer, model))
+        # Chỉ ghi nhận phiên bản mới sau khi đã thực sự phục vụ
+        _mark_serving(version_id)
+        print(f"Đã chuyển sang mô hình {version_id} sau {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        _serving.update(failed=version_id, failed_stamp=stamp)
+        print(f"Lỗi nạp phiên bản mô hình {version_id}: {str(e)}")
+    finally:
+        _reload_lock.release()
+
+
+def maybe_reload(force: bool = False):
+    """
+    Chuyển sang phiên bản được promote bởi worker/tiến trình khác (kiểm tra tối đa mỗi MODEL_RELOAD_CHECK_SECONDS).
+    Mô hình mới được nạp ở luồng nền; trong lúc đó chat vẫn dùng mô hình cũ.
+    Phiên bản nạp lỗi được thử lại khi CURRENT được ghi lại (promote/rollback).
+    """
+    global _last_reload_check
+
+    now = time.monotonic()
+    if not force and now - _last_reload_check < settings.MODEL_RELOAD_CHECK_SECONDS:
+        return
+    _last_reload_check = now
+    if not model_manager.is_loaded("generator"):
+        return
+    version_id, stamp = read_current(), _current_stamp()
+    if version_id == _serving["version_id"]:
+        return
+    if version_id == _serving["failed"] and stamp == _serving["failed_stamp"]:
+        return
+    if not _reload_lock.acquire(blocking=False):
+        return
+    threading.Thread(target=_reload_generator, args=(version_id, stamp), name="generator-reload", daemon=True).start()
+
+
+def get_serving_stats() -> dict:
+    return {
+        "current": read_current(),
+        "serving": _serving["version_id"],
+        "loaded_at": _serving["loaded_at"],
+        "failed": _serving["failed"],
+    }
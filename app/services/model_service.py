@@ -0,0 +1,126 @@
+# app/services/model_service.py
+import threading
+import time
+
+from app.core.config import settings
+
+# Tên các mô hình gốc
+EMBED_MODEL_NAME = 'VoVanPhuc/sup-SimCSE-VietNamese-phobert-base'
+GENERATOR_MODEL_NAME = "VietAI/vit5-base"
+
+# Đường dẫn file lưu dư liệu fine-tune
+# (checkpoint trước khi có kho phiên bản app/services/model_registry_service.py, chỉ còn được đọc)
+FINE_TUNE_FILE = "data/fine_tune/"
+
+
+# Backend mã hoá câu: torch (SentenceTransformer fp32), onnx (ONNX Runtime fp32), onnx-int8 (lượng tử hoá int8)
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _load_embed_model():
+    backend = settings.EMBED_BACKEND.lower()
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"EMBED_BACKEND không hợp lệ: {backend} (hỗ trợ: {', '.join(EMBED_BACKENDS)})")
+    if backend != "torch":
+        from app.services.onnx_embedding_service import load_onnx_encoder
+        return load_onnx_encoder(backend)
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL_NAME)
+
+
+def _load_generator():
+    """Nạp tokenizer và mô hình ViT5 (phiên bản fine-tune đang phục vụ nếu có) theo GEN_BACKEND."""
+    from app.services.model_registry_service import load_current_generator
+    return load_current_generator()
+
+
+class ModelManager:
+    """
+    Quản lý các mô hình dùng chung trong một worker.
+    - Mô hình chỉ được nạp ở lần dùng đầu tiên (hoặc khi gọi warmup).
+    - enabled: danh sách mô hình worker này phục vụ cho các route chat.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = set(enabled)
+        self._loaders = {
+            "embed": _load_embed_model,       # SentenceTransformer (v1, v2, index)
+            "generator": _load_generator,     # (tokenizer, model) ViT5 (v2, v3)
+        }
+        self._models = {}
+        self._versions = {}
+        self._load_seconds = {}
+        self._locks = {name: threading.Lock() for name in self._loaders}
+
+    def register_loader(self, name: str, loader):
+        """Thay thế/bổ sung hàm nạp mô hình (dùng cho benchmark hoặc backend khác)."""
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+        self._models.pop(name, None)
+
+    def is_enabled(self, name: str) -> bool:
+        return name in self.enabled
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str):
+        """Lấy mô hình theo tên, nạp nếu chưa có."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Không có mô hình '{name}'")
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._load_seconds[name] = round(time.perf_counter() - start, 3)
+                self._models[name] = model
+        return model
+
+    def set(self, name: str, model):
+        """Gán lại mô hình đang phục vụ (ví dụ sau khi fine-tune), tăng phiên bản của mô hình."""
+        self._models[name] = model
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def version(self, name: str) -> int:
+        """Phiên bản mô hình trong tiến trình (dùng để vô hiệu hoá cache câu trả lời)."""
+        return self._versions.get(name, 0)
+
+    def warmup(self, names=None):
+        """Nạp trước các mô hình (mặc định: các mô hình worker này phục vụ)."""
+        for name in (names if names is not None else sorted(self.enabled)):
+            self.get(name)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": sorted(self.enabled),
+            "loaded": sorted(self._models),
+            "load_seconds": dict(self._load_seconds),
+        }
+
+
+model_manager = ModelManager(
+    enabled=[name.strip() for name in settings.WORKER_MODELS.split(",") if name.strip()]
+)
+
+
+def get_embed_model():
+    return model_manager.get("embed")
+
+
+def get_embed_model_tag():
+    """
+    Định danh mô hình embedding đang dùng (gắn nhãn cho cache vector, thay đổi thì cache bị vô hiệu hoá).
+    Backend ONNX cho vector hơi khác bản gốc nên có nhãn riêng.
+    """
+    backend = settings.EMBED_BACKEND.lower()
+    return EMBED_MODEL_NAME if backend == "torch" else f"{EMBED_MODEL_NAME}@{backend}"
+
+
+def get_generator():
+    """Trả về (tokenizer, model) của ViT5."""
+    return model_manager.get("generator")
@@ -0,0 +1,196 @@
+# app/services/onnx_embedding_service.py
+import json
+import os
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.model_service import EMBED_MODEL_NAME
+
+# Thư mục lưu mô hình embedding đã export sang ONNX (fp32 và int8) cùng tokenizer
+ONNX_EMBED_DIR = "data/onnx_embed/"
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+ONNX_CONFIG_FILE = "encoder_config.json"
+
+# Câu mẫu dùng để kiểm tra khi không có dữ liệu trong DB
+SAMPLE_TEXTS = [
+    "Làm thế nào để đổi mật khẩu tài khoản?",
+    "Tôi quên mật khẩu thì phải làm sao",
+    "Thời gian làm việc của bộ phận hỗ trợ là khi nào?",
+    "Hướng dẫn đăng ký tài khoản mới",
+    "Phí chuyển tiền liên ngân hàng là bao nhiêu",
+    "Cách cập nhật thông tin cá nhân trên ứng dụng",
+    "Tại sao tôi không đăng nhập được?",
+    "Liên hệ tổng đài chăm sóc khách hàng như thế nào",
+]
+
+
+def _pool(hidden, attention_mask, pooling: str):
+    if pooling == "cls":
+        return hidden[:, 0]
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    if pooling == "max":
+        return np.where(mask > 0, hidden, -1e9).max(axis=1)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+class OnnxSentenceEncoder:
+    """
+    Bộ mã hoá câu chạy bằng ONNX Runtime, dùng thay SentenceTransformer (cùng hàm encode)
+    cho cache embedding, rebuild index và các route chat.
+    quantized=True dùng bản lượng tử hoá động int8.
+    """
+
+    def __init__(self, model_dir: str = ONNX_EMBED_DIR, quantized: bool = True, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        path = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FP32_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.quantized = quantized
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs):
+        """Giống SentenceTransformer.encode: trả về ma trận float32 (hoặc một vector nếu truyền một câu)."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        output = np.zeros((len(sentences), self.config["dim"]), dtype="float32")
+        # Sắp theo độ dài để mỗi batch ít phải pad
+        order = np.argsort([-len(text) for text in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer(
+                [sentences[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=self.config["max_seq_length"],
+                return_tensors="np",
+            )
+            hidden = self.session.run(None, {
+                "input_ids": enc["input_ids"].astype("int64"),
+                "attention_mask": enc["attention_mask"].astype("int64"),
+            })[0]
+            output[idx] = _pool(hidden, enc["attention_mask"], self.config["pooling"])
+        if self.config.get("normalize"):
+            output /= np.clip(np.linalg.norm(output, axis=1, keepdims=True), 1e-12, None)
+        return output[0] if single else output
+
+
+def export_onnx_embed_model(embed_model, output_dir: str = ONNX_EMBED_DIR):
+    """
+    Export mô hình SentenceTransformer sang ONNX (trục batch và độ dài câu động)
+    rồi lượng tử hoá động int8 (trọng số int8, activation lượng tử hoá lúc chạy).
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    transformer = embed_model[0].auto_model.eval()
+    pooling = embed_model[1].get_pooling_mode_str()
+    pooling = {"cls": "cls", "max": "max"}.get(pooling, "mean")
+
+    class _HiddenStates(torch.nn.Module):
+        # Chỉ xuất last_hidden_state, pooling làm bằng numpy khi chạy
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    dummy = embed_model.tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(output_dir, ONNX_FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _HiddenStates(transformer),
+            (dummy["input_ids"], dummy["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, ONNX_INT8_FILE), weight_type=QuantType.QInt8)
+
+    embed_model.tokenizer.save_pretrained(output_dir)
+    config = {
+        "source_model": EMBED_MODEL_NAME,
+        "dim": embed_model.get_sentence_embedding_dimension(),
+        "max_seq_length": embed_model.max_seq_length,
+        "pooling": pooling,
+        "normalize": any(type(module).__name__ == "Normalize" for module in embed_model),
+        "verification": {},
+    }
+    _write_config(output_dir, config)
+    return config
+
+
+def _write_config(model_dir: str, config: dict):
+    with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def cosine_similarity(a, b):
+    """Cosine giữa từng cặp dòng của hai ma trận."""
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return np.sum(a * b, axis=1)
+
+
+def verify_onnx_encoder(embed_model, texts, model_dir: str = ONNX_EMBED_DIR, threshold: float = None):
+    """
+    So sánh embedding ONNX (fp32 và int8) với embedding fp32 của PyTorch trên các câu texts.
+    Kết quả được ghi vào encoder_config.json; backend chỉ được dùng khi cosine nhỏ nhất >= threshold.
+    """
+    threshold = threshold if threshold is not None else settings.EMBED_ONNX_MIN_COSINE
+    reference = embed_model.encode(texts, convert_to_numpy=True)
+    results = {}
+    for backend, quantized in (("onnx", False), ("onnx-int8", True)):
+        cosine = cosine_similarity(reference, OnnxSentenceEncoder(model_dir, quantized).encode(texts))
+        results[backend] = {
+            "min_cosine": round(float(cosine.min()), 5),
+            "mean_cosine": round(float(cosine.mean()), 5),
+            "threshold": threshold,
+            "texts": len(texts),
+            "passed": bool(cosine.min() >= threshold),
+        }
+    with open(os.path.join(model_dir, ONNX_CONFIG_FILE), encoding="utf-8") as f:
+        config = json.load(f)
+    config["verification"] = results
+    _write_config(model_dir, config)
+    return results
+
+
+def load_onnx_encoder(backend: str, model_dir: str = ONNX_EMBED_DIR):
+    """Nạp backend ONNX ('onnx' hoặc 'onnx-int8') đã export và đã qua kiểm tra cosine."""
+    config_path = os.path.join(model_dir, ONNX_CONFIG_FILE)
+    if not os.path.exists(config_path):
+        raise RuntimeError(
+            f"Chưa export mô hình embedding ONNX ({model_dir}). "
+            "Chạy: python -m benchmarks.embed_backend --export"
+        )
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+    if config.get("source_model") != EMBED_MODEL_NAME:
+        raise RuntimeError(f"Mô hình ONNX được export từ {config.get('source_model')}, cần export lại từ {EMBED_MODEL_NAME}.")
+    verification = config.get("verification", {}).get(backend, {})
+    if not verification.get("passed"):
+        raise RuntimeError(
+            f"Backend {backend} chưa qua kiểm tra cosine với mô hình gốc ({verification or 'chưa kiểm tra'})."
+        )
+    return OnnxSentenceEncoder(model_dir, quantized=backend == "onnx-int8", threads=settings.EMBED_ONNX_THREADS)
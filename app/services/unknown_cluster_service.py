@@ -0,0 +1,238 @@
+# app/services/unknown_cluster_service.py
+import os
+from datetime import datetime
+
+import faiss
+import numpy as np
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.unknown_question import UnknownQuestion
+from app.models.unknown_question_cluster import UnknownQuestionCluster
+from app.services.embedding_cache_service import embedding_cache
+
+# Tâm các cụm (centroids) và id cụm tương ứng trong DB, dùng để phân cụm tăng dần các câu hỏi mới
+CLUSTER_DIR = "data/unknown_clusters"
+CENTROIDS_FILE = "data/unknown_clusters/centroids.npz"
+
+# Số vòng lặp k-means
+KMEANS_NITER = 20
+
+
+def _load_centroids():
+    """(centroids, cluster_ids) đã lưu, (None, None) nếu chưa phân cụm lần nào."""
+    try:
+        with np.load(CENTROIDS_FILE) as data:
+            centroids, ids = data["centroids"], data["ids"]
+    except (OSError, KeyError, ValueError):
+        return None, None
+    if len(centroids) != len(ids):
+        return None, None
+    return centroids.astype("float32"), ids.astype("int64")
+
+
+def _save_centroids(centroids, ids):
+    os.makedirs(CLUSTER_DIR, exist_ok=True)
+    tmp_path = CENTROIDS_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, centroids=np.asarray(centroids, dtype="float32"), ids=np.asarray(ids, dtype="int64"))
+    os.replace(tmp_path, CENTROIDS_FILE)
+
+
+def clear_clusters(db: Session):
+    """Xoá toàn bộ cụm (khi xoá hết câu hỏi hoặc trước khi phân cụm lại từ đầu). Chưa commit."""
+    db.execute(update(UnknownQuestion).where(UnknownQuestion.cluster_id.isnot(None)).values(cluster_id=None))
+    db.query(UnknownQuestionCluster).delete()
+    try:
+        os.remove(CENTROIDS_FILE)
+    except OSError:
+        pass
+
+
+def _encode(texts):
+    # Qua cache embedding: câu hỏi đã mã hoá ở lần phân cụm trước (hoặc khi chat) không phải mã hoá lại
+    vectors = embedding_cache.encode(texts, batch_size=settings.UNKNOWN_CLUSTER_ENCODE_BATCH)
+    return np.ascontiguousarray(vectors, dtype="float32")
+
+
+def _iter_batches(db: Session, unclustered_only: bool):
+    """Đọc câu hỏi theo từng lô (keyset theo id)."""
+    last_id = 0
+    while True:
+        query = db.query(UnknownQuestion.id, UnknownQuestion.question, UnknownQuestion.timestamp).filter(
+            UnknownQuestion.id > last_id
+        )
+        if unclustered_only:
+            query = query.filter(UnknownQuestion.cluster_id.is_(None))
+        rows = query.order_by(UnknownQuestion.id).limit(settings.UNKNOWN_CLUSTER_BATCH_SIZE).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+class _ClusterStats:
+    """Thống kê của một cụm trong lúc phân cụm: số câu, thời gian, câu hỏi đại diện, tâm cụm."""
+
+    def __init__(self, cluster, centroid):
+        self.cluster = cluster
+        self.centroid = centroid
+        self.count = cluster.count or 0
+        self.touched = False
+
+    def add(self, row, vector, distance: float, running_mean: bool):
+        self.count += 1
+        self.touched = True
+        if running_mean:
+            # Cập nhật tâm cụm theo trung bình cộng dồn (phân cụm tăng dần)
+            self.centroid += (vector - self.centroid) / self.count
+        cluster = self.cluster
+        if row.timestamp is not None:
+            cluster.first_seen = row.timestamp if cluster.first_seen is None else min(cluster.first_seen, row.timestamp)
+            cluster.last_seen = row.timestamp if cluster.last_seen is None else max(cluster.last_seen, row.timestamp)
+        if not cluster.representative or distance < cluster.representative_distance:
+            cluster.representative = row.question
+            cluster.representative_distance = float(distance)
+
+    def finish(self):
+        if not self.touched:
+            return
+        self.cluster.count = self.count
+        self.cluster.updated_at = datetime.utcnow()
+
+
+def _assign_batch(db: Session, rows, vectors, stats, centroids, ids, allow_new: bool):
+    """
+    Gán mỗi câu hỏi vào cụm có tâm gần nhất. allow_new=True: câu hỏi xa hơn UNKNOWN_CLUSTER_MAX_DISTANCE
+    so với mọi tâm cụm tạo thành cụm mới. Trả về (centroids, ids, số cụm mới).
+    """
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    if len(centroids):
+        index.add(centroids)
+        distances, positions = index.search(vectors, 1)
+    else:
+        distances = np.full((len(rows), 1), np.inf, dtype="float32")
+        positions = np.full((len(rows), 1), -1, dtype="int64")
+
+    new_clusters = 0
+    assignments = []
+    for i, row in enumerate(rows):
+        distance, position = float(distances[i, 0]), int(positions[i, 0])
+        if allow_new and (position < 0 or distance > settings.UNKNOWN_CLUSTER_MAX_DISTANCE):
+            # Có thể gần một cụm vừa tạo trong cùng lô (chưa có trong index)
+            if len(centroids) > index.ntotal:
+                extra = centroids[index.ntotal:]
+                extra_distances = ((extra - vectors[i]) ** 2).sum(axis=1)
+                best = int(extra_distances.argmin())
+                if extra_distances[best] <= settings.UNKNOWN_CLUSTER_MAX_DISTANCE:
+                    distance, position = float(extra_distances[best]), index.ntotal + best
+            if position < 0 or distance > settings.UNKNOWN_CLUSTER_MAX_DISTANCE:
+                cluster = UnknownQuestionCluster(representative=row.question, representative_distance=0.0, count=0)
+                db.add(cluster)
+                db.flush()
+                centroids = np.vstack([centroids, vectors[i:i + 1]]) if len(centroids) else vectors[i:i + 1].copy()
+                ids = np.append(ids, cluster.id)
+                stats[cluster.id] = _ClusterStats(cluster, centroids[-1].copy())
+                position, distance = len(centroids) - 1, 0.0
+                new_clusters += 1
+        cluster_id = int(ids[position])
+        cluster_stats = stats[cluster_id]
+        cluster_stats.add(row, vectors[i], distance, running_mean=allow_new)
+        centroids[position] = cluster_stats.centroid
+        assignments.append({"id": row.id, "cluster_id": cluster_id})
+
+    db.execute(update(UnknownQuestion), assignments)
+    return centroids, ids, new_clusters
+
+
+def _full_recluster(db: Session, total: int, progress_callback=None):
+    """Phân cụm lại toàn bộ: k-means trên một mẫu câu hỏi, rồi gán mọi câu hỏi vào tâm gần nhất."""
+    sample_size = min(total, settings.UNKNOWN_CLUSTER_TRAIN_SIZE)
+    sample = [row.question for row in db.query(UnknownQuestion.question).order_by(func.random()).limit(sample_size)]
+    sample_vectors = _encode(sample)
+    k = max(1, min(settings.UNKNOWN_CLUSTER_K, len(sample)))
+    kmeans = faiss.Kmeans(sample_vectors.shape[1], k, niter=KMEANS_NITER, seed=1234)
+    kmeans.train(sample_vectors)
+    centroids = kmeans.centroids.astype("float32")
+
+    clear_clusters(db)
+    clusters = [UnknownQuestionCluster(representative="", representative_distance=0.0, count=0) for _ in range(k)]
+    db.add_all(clusters)
+    db.flush()
+    ids = np.asarray([cluster.id for cluster in clusters], dtype="int64")
+    stats = {cluster.id: _ClusterStats(cluster, centroids[i].copy()) for i, cluster in enumerate(clusters)}
+
+    done = 0
+    for rows in _iter_batches(db, unclustered_only=False):
+        # Tâm cụm giữ nguyên theo k-means (không cập nhật dồn)
+        _assign_batch(db, rows, _encode([row.question for row in rows]), stats, centroids, ids, allow_new=False)
+        done += len(rows)
+        if progress_callback:
+            progress_callback(done, total)
+
+    # Bỏ các cụm rỗng
+    keep = []
+    for i, cluster_id in enumerate(ids):
+        cluster_stats = stats[int(cluster_id)]
+        if cluster_stats.count:
+            cluster_stats.finish()
+            keep.append(i)
+        else:
+            db.delete(cluster_stats.cluster)
+    return centroids[keep], ids[keep], len(keep), done
+
+
+def cluster_unknown_questions(db: Session, full: bool = False, progress_callback=None):
+    """
+    Phân cụm câu hỏi chưa trả lời (chạy trong tác vụ nền, kết quả lưu sẵn cho /unknown_question/clusters).
+    Mặc định chỉ phân cụm các câu hỏi mới: gán vào tâm cụm gần nhất (cập nhật tâm cụm theo trung bình
+    cộng dồn) hoặc tạo cụm mới nếu xa mọi cụm hơn UNKNOWN_CLUSTER_MAX_DISTANCE.
+    full=True (hoặc chưa có cụm nào): k-means lại từ đầu với tối đa UNKNOWN_CLUSTER_K cụm.
+    progress_callback(số câu đã xử lý, tổng số câu cần xử lý) được gọi sau mỗi lô.
+    """
+    centroids, ids = _load_centroids()
+    full = full or centroids is None
+    try:
+        if full:
+            total = db.query(func.count(UnknownQuestion.id)).scalar()
+            if not total:
+                clear_clusters(db)
+                db.commit()
+                return {"mode": "full", "clusters": 0, "assigned": 0, "new_clusters": 0}
+            centroids, ids, new_clusters, assigned = _full_recluster(db, total, progress_callback)
+        else:
+            total = db.query(func.count(UnknownQuestion.id)).filter(UnknownQuestion.cluster_id.is_(None)).scalar()
+            clusters = db.query(UnknownQuestionCluster).filter(UnknownQuestionCluster.id.in_(ids.tolist())).all()
+            by_id = {cluster.id: cluster for cluster in clusters}
+            # Bỏ tâm của các cụm không còn trong DB
+            keep = [i for i, cluster_id in enumerate(ids) if int(cluster_id) in by_id]
+            centroids, ids = centroids[keep], ids[keep]
+            stats = {int(cluster_id): _ClusterStats(by_id[int(cluster_id)], centroids[i].copy()) for i, cluster_id in enumerate(ids)}
+
+            assigned = new_clusters = 0
+            for rows in _iter_batches(db, unclustered_only=True):
+                centroids, ids, created = _assign_batch(
+                    db, rows, _encode([row.question for row in rows]), stats, centroids, ids, allow_new=True
+                )
+                new_clusters += created
+                assigned += len(rows)
+                if progress_callback:
+                    progress_callback(assigned, total)
+            for cluster_stats in stats.values():
+                cluster_stats.finish()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        # Lưu các vector mới mã hoá (kể cả khi phân cụm lỗi) cho lần chạy sau
+        embedding_cache.save()
+    if len(ids):
+        _save_centroids(centroids, ids)
+    return {
+        "mode": "full" if full else "incremental",
+        "clusters": int(len(ids)),
+        "assigned": assigned,
+        "new_clusters": new_clusters,
+    }
@@ -0,0 +1,97 @@
+# app/utils/batching.py
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu đến đồng thời thành một batch và xử lý bằng một lần gọi duy nhất.
+
+    - batch_fn nhận danh sách item và trả về danh sách kết quả cùng thứ tự.
+    - Một batch được xử lý khi đủ max_batch_size item, hoặc khi đã chờ max_wait_ms
+      kể từ lúc item đầu tiên của batch vào hàng đợi.
+    - Luồng xử lý chạy ngầm và được khởi tạo khi có item đầu tiên (an toàn khi fork).
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = "batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._init_state()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self):
+        # Tiến trình con sau khi fork không có luồng xử lý, cần tạo lại toàn bộ trạng thái
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._thread = None
+        self._batches = 0
+        self._items = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
+
+    def submit(self, item) -> Future:
+        """Đưa một item vào hàng đợi, trả về Future chứa kết quả của item đó."""
+        future = Future()
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.append((item, future))
+            self._cond.notify()
+        return future
+
+    def run(self, item, timeout: float = None):
+        """Gửi item và chờ kết quả (dùng trong các handler đồng bộ)."""
+        return self.submit(item).result(timeout=timeout)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                size = min(len(self._queue), self.max_batch_size)
+                batch = [self._queue.popleft() for _ in range(size)]
+            self._process(batch)
+
+    def _process(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = self.batch_fn(items)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+        with self._cond:
+            self._batches += 1
+            self._items += len(batch)
+            self._last_batch_size = len(batch)
+            self._max_batch_size_seen = max(self._max_batch_size_seen, len(batch))
+
+    def stats(self) -> dict:
+        """Thống kê hàng đợi và kích thước batch."""
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size_seen": self._max_batch_size_seen,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
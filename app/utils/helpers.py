@@ -0,0 +1,55 @@
+# app/utils/helpers.py
+import hashlib
+import os
+import resource
+import sys
+import unicodedata
+
+
+def get_rss_mb() -> float:
+    """Bộ nhớ thường trú (RSS) hiện tại của tiến trình, tính bằng MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2, 1)
+    except (OSError, ValueError, IndexError):
+        # Không có /proc (macOS, ...): dùng RSS cao nhất thay thế
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 ** 2 if sys.platform == "darwin" else 1024
+        return round(max_rss / divisor, 1)
+
+
+def get_pss_mb():
+    """
+    Bộ nhớ PSS (trang dùng chung được chia đều cho các tiến trình) tính bằng MB,
+    phản ánh đúng hơn RSS khi nhiều worker dùng chung mô hình/index. None nếu không hỗ trợ.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def normalize_text(text: str, strip_diacritics: bool = False) -> str:
+    """
+    Chuẩn hoá câu hỏi để so khớp: Unicode NFC (dấu gõ tổ hợp hay dựng sẵn đều như nhau),
+    chữ thường, gộp khoảng trắng. strip_diacritics=True bỏ luôn dấu tiếng Việt (đ -> d).
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    if strip_diacritics:
+        text = "".join(c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c))
+        text = text.replace("đ", "d")
+    return " ".join(text.split())
+
+
+def question_hash(question: str) -> str:
+    """
+    Hash (sha256) của câu hỏi sau chuẩn hoá, bỏ dấu câu ở cuối: các câu chỉ khác
+    chữ hoa/thường, khoảng trắng hay dấu '?' cuối câu có cùng hash.
+    """
+    text = normalize_text(question).rstrip(" ?.!…")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
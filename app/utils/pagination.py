@@ -0,0 +1,63 @@
+# app/utils/pagination.py
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+
+from app.core.config import settings
+
+
+def encode_cursor(values: dict) -> str:
+    """Con trỏ trang (keyset): giá trị khoá sắp xếp của bản ghi cuối trang, mã hoá base64 url-safe."""
+    data = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in values.items()}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, datetime_keys=()) -> dict:
+    """Giải mã con trỏ từ encode_cursor. ValueError nếu con trỏ không hợp lệ."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(data, dict):
+            raise ValueError(cursor)
+        for key in datetime_keys:
+            data[key] = datetime.fromisoformat(data[key])
+        return data
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Con trỏ trang không hợp lệ: {cursor}") from e
+
+
+class CountCache:
+    """Cache tổng số bản ghi theo bộ lọc trong ttl giây (tránh COUNT(*) toàn bảng ở mỗi trang)."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, count):
+        """Tổng số bản ghi của key, gọi count() khi chưa có hoặc đã hết hạn."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+        if item is not None and now - item[1] < self.ttl:
+            return item[0]
+        total = count()
+        with self._lock:
+            self._items[key] = (total, now)
+        return total
+
+
+count_cache = CountCache(settings.PAGINATION_COUNT_TTL_SECONDS)
+
+
+def page_info(page_size: int, next_cursor, total_records=None, page=None) -> dict:
+    """Thông tin phân trang trả về cho client (total_records/total_pages chỉ có khi đã đếm)."""
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total_records": total_records,
+        "total_pages": (total_records + page_size - 1) // page_size if total_records is not None else None,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+    }
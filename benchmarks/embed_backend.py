@@ -0,0 +1,120 @@
+# benchmarks/embed_backend.py
+"""
+Export mô hình embedding sang ONNX (fp32 + int8), kiểm tra cosine so với PyTorch fp32
+và đo độ trễ từng câu hỏi, thông lượng mã hoá corpus của các backend (torch, onnx, onnx-int8).
+
+Ví dụ:
+    python -m benchmarks.embed_backend --export
+    python -m benchmarks.embed_backend --source db --corpus 5000 --output bench_embed.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.model_service import EMBED_MODEL_NAME
+from app.services.onnx_embedding_service import (
+    ONNX_CONFIG_FILE, ONNX_EMBED_DIR, ONNX_FP32_FILE, ONNX_INT8_FILE, SAMPLE_TEXTS,
+    OnnxSentenceEncoder, cosine_similarity, export_onnx_embed_model, verify_onnx_encoder,
+)
+
+
+def db_texts():
+    """Câu hỏi của toàn bộ Document trong DB."""
+    from app.db.session import SessionLocal
+    from app.models.document import Document
+
+    db = SessionLocal()
+    try:
+        return [row.question for row in db.query(Document.question).all()]
+    finally:
+        db.close()
+
+
+def synthetic_texts(n: int, seed: int = 0):
+    """Câu giả lập ghép từ các câu mẫu (độ dài khác nhau)."""
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(SAMPLE_TEXTS, rng.integers(1, 4))) for _ in range(n)]
+
+
+def measure(encoder, queries, corpus, batch_size: int):
+    encoder.encode(queries[:4], batch_size=batch_size)  # Làm nóng
+
+    # Độ trễ từng câu hỏi (batch = 1, giống luồng chat không gom batch)
+    latencies = []
+    for text in queries:
+        start = time.perf_counter()
+        encoder.encode([text], batch_size=1)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # Thông lượng mã hoá corpus (giống rebuild index)
+    start = time.perf_counter()
+    vectors = encoder.encode(corpus, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+
+    return vectors, {
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+        "corpus_texts_per_second": round(len(corpus) / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ONNX int8 và so sánh các backend mô hình embedding")
+    parser.add_argument("--export", action="store_true", help="Export (lại) mô hình ONNX trước khi đo")
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--corpus", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=settings.EMBED_ONNX_THREADS, help="Số luồng ONNX Runtime")
+    parser.add_argument("--min-cosine", type=float, default=settings.EMBED_ONNX_MIN_COSINE)
+    parser.add_argument("--output", default=None, help="File JSON lưu kết quả")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(EMBED_MODEL_NAME)
+    texts = db_texts() if args.source == "db" else synthetic_texts(args.corpus)
+    rng = np.random.default_rng(1)
+    corpus = [texts[i] for i in rng.choice(len(texts), min(args.corpus, len(texts)), replace=False)]
+    queries = [texts[i] for i in rng.choice(len(texts), args.queries)]
+
+    if args.export or not os.path.exists(os.path.join(ONNX_EMBED_DIR, ONNX_CONFIG_FILE)):
+        print(f"Export {EMBED_MODEL_NAME} sang ONNX: {ONNX_EMBED_DIR}")
+        export_onnx_embed_model(reference, ONNX_EMBED_DIR)
+    # Kiểm tra cosine trên corpus đo (kết quả được ghi lại, quyết định backend có được dùng hay không)
+    verification = verify_onnx_encoder(reference, corpus, ONNX_EMBED_DIR, args.min_cosine)
+
+    results = []
+    baseline, row = measure(reference, queries, corpus, args.batch_size)
+    results.append({"backend": "torch", **row})
+    for backend, quantized, file_name in (("onnx", False, ONNX_FP32_FILE), ("onnx-int8", True, ONNX_INT8_FILE)):
+        encoder = OnnxSentenceEncoder(ONNX_EMBED_DIR, quantized=quantized, threads=args.threads)
+        vectors, row = measure(encoder, queries, corpus, args.batch_size)
+        cosine = cosine_similarity(baseline, vectors)
+        row.update(
+            min_cosine=round(float(cosine.min()), 5),
+            mean_cosine=round(float(cosine.mean()), 5),
+            passed=verification[backend]["passed"],
+            size_mb=round(os.path.getsize(os.path.join(ONNX_EMBED_DIR, file_name)) / 1024 ** 2, 1),
+        )
+        results.append({"backend": backend, **row})
+
+    for row in results:
+        print(
+            f"{row['backend']:10} p50={row['latency_ms_p50']:.2f}ms p99={row['latency_ms_p99']:.2f}ms "
+            f"corpus={row['corpus_texts_per_second']}/s"
+            + (f" cosine min={row['min_cosine']} mean={row['mean_cosine']} passed={row['passed']}" if "min_cosine" in row else "")
+        )
+    if args.output:
+        report = {"queries": len(queries), "corpus": len(corpus), "batch_size": args.batch_size, "results": results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
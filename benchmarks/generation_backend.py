@@ -0,0 +1,127 @@
+# benchmarks/generation_backend.py
+"""
+So sánh các backend (torch, torch-int8, onnx) và profile giải mã (greedy, beam2, beam4) của ViT5:
+tokens/giây, độ trễ từng prompt và độ lệch câu trả lời so với cấu hình hiện tại (torch + beam4).
+
+Ví dụ:
+    python -m benchmarks.generation_backend --prompts 50 --output bench_generation.json
+    python -m benchmarks.generation_backend --backends torch torch-int8 --profiles greedy beam4 --source db
+"""
+import argparse
+import json
+import time
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from app.services.generation_service import DECODING_PROFILES, GEN_BACKENDS, generate, generator_source, load_generator
+
+# Prompt mẫu khi không dùng dữ liệu trong DB (cùng định dạng với /chat/v2 và /chat/v3)
+SAMPLE_PROMPTS = [
+    "Câu hỏi: Làm thế nào để đổi mật khẩu?\n Trả lời:",
+    "Câu hỏi: Thời gian làm việc của bộ phận hỗ trợ?\n Trả lời:",
+    "Câu hỏi: Tôi quên mật khẩu thì phải làm sao?\nCâu trả lời thô: Vào mục Quên mật khẩu trên màn hình đăng nhập và làm theo hướng dẫn.\n"
+    " Chỉ dựa vào câu trả lời thô được cung cấp, hãy diễn đạt lại câu trả lời cho tự nhiên:",
+    "Câu hỏi: Phí chuyển tiền là bao nhiêu?\nCâu trả lời thô: Miễn phí chuyển tiền nội bộ, liên ngân hàng 5.000đ/giao dịch.\n"
+    " Chỉ dựa vào câu trả lời thô được cung cấp, hãy diễn đạt lại câu trả lời cho tự nhiên:",
+]
+
+# Cấu hình hiện tại dùng làm mốc so sánh chất lượng
+REFERENCE = ("torch", "beam4")
+
+
+def db_prompts(limit: int):
+    """Prompt dựng từ dữ liệu fine-tune (v3) và Document (v2)."""
+    from app.db.session import SessionLocal
+    from app.models.document import Document
+    from app.models.fine_tune_data import FineTuneData
+
+    db = SessionLocal()
+    try:
+        prompts = [f"Câu hỏi: {row.answer}\n Trả lời:" for row in db.query(FineTuneData.answer).limit(limit)]
+        prompts += [
+            f"Câu hỏi: {row.question}\nCâu trả lời thô: {row.answer}\n Chỉ dựa vào câu trả lời thô được cung cấp, hãy diễn đạt lại câu trả lời cho tự nhiên:"
+            for row in db.query(Document.question, Document.answer).limit(limit)
+        ]
+    finally:
+        db.close()
+    return prompts[:limit]
+
+
+def similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def measure(tokenizer, model, prompts, profile: dict, batch_size: int):
+    generate(tokenizer, model, prompts[:1], profile)  # Làm nóng
+
+    # Từng prompt một (batch = 1): độ trễ và tokens/giây
+    answers, latencies, tokens = [], [], 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        answer = generate(tokenizer, model, [prompt], profile)[0]
+        latencies.append(time.perf_counter() - start)
+        answers.append(answer)
+        tokens += len(tokenizer(answer).input_ids)
+
+    # Gom batch như generation batcher
+    start = time.perf_counter()
+    for i in range(0, len(prompts), batch_size):
+        generate(tokenizer, model, prompts[i:i + batch_size], profile)
+    batch_seconds = time.perf_counter() - start
+
+    return answers, {
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "tokens_per_second": round(tokens / sum(latencies), 1),
+        "avg_answer_tokens": round(tokens / len(prompts), 1),
+        "batch_prompts_per_second": round(len(prompts) / batch_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens/giây và độ lệch câu trả lời của các backend/profile ViT5")
+    parser.add_argument("--source", choices=["sample", "db"], default="sample")
+    parser.add_argument("--prompts", type=int, default=40)
+    parser.add_argument("--backends", nargs="+", choices=GEN_BACKENDS, default=list(GEN_BACKENDS))
+    parser.add_argument("--profiles", nargs="+", choices=list(DECODING_PROFILES), default=list(DECODING_PROFILES))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--output", default=None, help="File JSON lưu kết quả")
+    args = parser.parse_args()
+
+    prompts = db_prompts(args.prompts) if args.source == "db" else (SAMPLE_PROMPTS * args.prompts)[:args.prompts]
+    backends = [REFERENCE[0]] + [b for b in args.backends if b != REFERENCE[0]]
+
+    results, reference_answers = [], None
+    for backend in backends:
+        tokenizer, model = load_generator(backend)
+        profiles = list(args.profiles)
+        if backend == REFERENCE[0] and REFERENCE[1] not in profiles:
+            profiles.insert(0, REFERENCE[1])
+        # Chạy profile mốc trước để có câu trả lời tham chiếu
+        profiles.sort(key=lambda name: (backend, name) != REFERENCE)
+        for name in profiles:
+            answers, row = measure(tokenizer, model, prompts, DECODING_PROFILES[name], args.batch_size)
+            if (backend, name) == REFERENCE:
+                reference_answers = answers
+            row["exact_match"] = round(float(np.mean([a == r for a, r in zip(answers, reference_answers)])), 3)
+            row["similarity"] = round(float(np.mean([similarity(a, r) for a, r in zip(answers, reference_answers)])), 3)
+            results.append({"backend": backend, "profile": name, **row})
+            print(
+                f"{backend:10} {name:6} {row['tokens_per_second']:7.1f} tok/s p50={row['latency_ms_p50']}ms "
+                f"p95={row['latency_ms_p95']}ms exact={row['exact_match']} sim={row['similarity']}"
+            )
+
+    if args.output:
+        report = {
+            "model": generator_source(),
+            "prompts": len(prompts),
+            "reference": "/".join(REFERENCE),
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# benchmarks/index_recall.py
+"""
+Đo recall@k và độ trễ tìm kiếm của các loại FAISS index (ivf, hnsw, ivfpq) so với index flat (chính xác).
+
+Ví dụ:
+    python -m benchmarks.index_recall --synthetic 500000 --dim 768 --queries 1000 --output bench_index.json
+    python -m benchmarks.index_recall --source db --queries 500
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.index_service import build_index, set_search_params
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 1000, seed: int = 0):
+    """Vector giả lập có cấu trúc cụm (gần với embedding câu hỏi thật hơn phân phối đều)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 1, (clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, n)
+    return (centers[labels] + rng.normal(0, 0.5, (n, dim))).astype("float32")
+
+
+def db_vectors():
+    """Vector của toàn bộ Document trong DB (lấy qua cache embedding)."""
+    from app.db.session import SessionLocal
+    from app.models.document import Document
+    from app.services.embedding_cache_service import embedding_cache
+
+    db = SessionLocal()
+    try:
+        texts = [row.question for row in db.query(Document.question).all()]
+    finally:
+        db.close()
+    vectors = embedding_cache.encode(texts)
+    embedding_cache.save()
+    return vectors
+
+
+def make_queries(vectors, n_queries: int, seed: int = 1):
+    """Câu hỏi giả lập: vector trong corpus cộng nhiễu nhỏ."""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), n_queries, replace=len(vectors) < n_queries)]
+    scale = float(np.std(vectors)) * 0.1
+    return (picked + rng.normal(0, scale, picked.shape)).astype("float32")
+
+
+def measure(index, queries, k: int, truth_ids, truth_dist):
+    # Độ trễ từng câu hỏi (batch = 1, giống luồng chat không gom batch)
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # Thông lượng khi tìm kiếm cả batch
+    start = time.perf_counter()
+    D, I = index.search(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    recall = np.mean([len(set(I[i]) & set(truth_ids[i])) / k for i in range(len(queries))])
+    # Độ lệch khoảng cách top-1 so với khoảng cách chính xác (dùng để hiệu chỉnh ngưỡng)
+    same_top1 = I[:, 0] == truth_ids[:, 0]
+    offset = float(np.mean(D[same_top1, 0] - truth_dist[same_top1, 0])) if same_top1.any() else None
+
+    return {
+        f"recall@{k}": round(float(recall), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+        "batch_qps": round(len(queries) / batch_seconds, 1),
+        "top1_distance_offset": round(offset, 3) if offset is not None else None,
+    }
+
+
+def run(vectors, queries, k: int, nprobes, ef_searches):
+    ids = np.arange(len(vectors), dtype="int64")
+    results = []
+
+    def build(index_type):
+        start = time.perf_counter()
+        index, meta = build_index(vectors, ids, index_type=index_type)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1024 ** 2
+        return index, meta, round(build_seconds, 2), round(size_mb, 1)
+
+    flat, _, build_seconds, size_mb = build("flat")
+    truth_dist, truth_ids = flat.search(queries, k)
+    row = {"type": "flat", "params": {}, "build_seconds": build_seconds, "size_mb": size_mb}
+    row.update(measure(flat, queries, k, truth_ids, truth_dist))
+    results.append(row)
+
+    for index_type, param_name, values in (("ivf", "nprobe", nprobes), ("ivfpq", "nprobe", nprobes), ("hnsw", "ef_search", ef_searches)):
+        index, meta, build_seconds, size_mb = build(index_type)
+        for value in values:
+            set_search_params(index, **{param_name: value})
+            row = {
+                "type": meta["type"],
+                "params": {param_name: value},
+                "build_seconds": build_seconds,
+                "size_mb": size_mb,
+                "distance_offset": round(meta["distance_offset"], 3),
+            }
+            row.update(measure(index, queries, k, truth_ids, truth_dist))
+            # Ngưỡng đề xuất cho loại index này (ngưỡng gốc cộng độ lệch đo được)
+            offset = row["top1_distance_offset"] or 0.0
+            row["suggested_thresholds"] = [round(settings.THRESH_STRICT + offset, 2), round(settings.THRESH_SUGGEST + offset, 2)]
+            results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k và độ trễ của các loại FAISS index so với flat")
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--synthetic", type=int, default=100000, help="Số vector giả lập")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--output", default=None, help="File JSON lưu kết quả")
+    args = parser.parse_args()
+
+    vectors = db_vectors() if args.source == "db" else synthetic_vectors(args.synthetic, args.dim)
+    queries = make_queries(vectors, args.queries)
+    results = run(vectors, queries, args.k, args.nprobe, args.ef_search)
+
+    report = {
+        "corpus_size": len(vectors),
+        "dim": int(vectors.shape[1]),
+        "queries": len(queries),
+        "k": args.k,
+        "results": results,
+    }
+    for row in results:
+        print(
+            f"{row['type']:6} {json.dumps(row['params']):20} recall@{args.k}={row[f'recall@{args.k}']:.4f} "
+            f"p50={row['latency_ms_p50']:.3f}ms p99={row['latency_ms_p99']:.3f}ms "
+            f"build={row['build_seconds']}s size={row['size_mb']}MB"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
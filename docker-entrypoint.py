@@ -43,4 +43,21 @@ if __name__ == "__main__":
         exit(1)
 
     print("Starting application...")
-    subprocess.run(["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", "8000"])
\ No newline at end of file
+    workers = int(os.getenv("WEB_WORKERS", "1"))
+    if workers > 1:
+        # Nhiều worker: nạp mô hình trước khi fork (--preload) và memory-map FAISS index
+        # để các worker dùng chung bộ nhớ; chia đều số luồng torch cho các worker.
+        env = dict(os.environ)
+        env.setdefault("MODEL_PRELOAD", "true")
+        env.setdefault("FAISS_MMAP", "true")
+        env.setdefault("INFERENCE_TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+        subprocess.run([
+            "gunicorn", "app.main:app",
+            "-k", "uvicorn.workers.UvicornWorker",
+            "-w", str(workers),
+            "--preload",
+            "--bind", "0.0.0.0:8000",
+            "--timeout", os.getenv("WEB_TIMEOUT", "120"),
+        ], env=env)
+    else:
+        subprocess.run(["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", "8000"])
\ No newline at end of file
@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os
+import sys
+
+# Cấu hình tối thiểu để import app (không cần PostgreSQL)
+for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_SERVER", "POSTGRES_PORT", "POSTGRES_DB"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
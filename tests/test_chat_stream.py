@@ -0,0 +1,51 @@
+# tests/test_chat_stream.py
+import asyncio
+import gc
+
+import pytest
+
+from app.api.v1.endpoints import chat
+from app.schemas.chat import ChatRequest
+from app.services.executor_service import InferenceExecutor
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = InferenceExecutor(workers=1, queue_size=0, route_limits={})
+    monkeypatch.setattr(chat, "inference_executor", executor)
+    monkeypatch.setattr(
+        chat, "stream_answer",
+        lambda route, user_id, message, db: iter([("token", "xin chào"), ("done", {"answer": "xin chào"})]),
+    )
+    return executor
+
+
+def test_stream_releases_slot_after_last_chunk(executor):
+    response = chat.stream_response("v2", ChatRequest(message="xin chào"), db=None)
+    assert executor.stats()["in_flight"] == 1
+
+    async def consume():
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(consume())
+    assert chunks[0].startswith("event: token")
+    assert executor.stats()["in_flight"] == 0
+    assert executor.stats()["completed"] == 1
+
+
+def test_stream_releases_slot_when_cancelled_before_first_chunk(executor):
+    response = chat.stream_response("v2", ChatRequest(message="xin chào"), db=None)
+    assert executor.stats()["in_flight"] == 1
+
+    async def cancel_before_first_chunk():
+        # Client ngắt kết nối trước khi Starlette lấy chunk đầu tiên: generator không bao giờ được chạy
+        task = asyncio.ensure_future(response.body_iterator.__anext__())
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_before_first_chunk())
+    del response
+    gc.collect()
+    assert executor.stats()["in_flight"] == 0
+    assert executor.stats()["completed"] == 1